@@ -0,0 +1,139 @@
+"""
+Benchmark the per-miss cost of fuzzy matching, as done for every exact
+index lookup with no results, comparing the previous linear scan of all
+fuzzy rules (calling startswith() for every url prefix of every rule)
+with the dispatch of the urlkey through the url prefix index of
+FuzzyMatcher, as well as the previous per-candidate re.sub() normalization
+with the precomputed normalized urlkeys.
+
+Synthetic urls are generated from a fixed seed, so results are
+reproducible. Most are cache-busted JS/XHR urls on arbitrary hosts,
+which only match the general fuzzy rule, after trying all others:
+
+  python benchmarks/fuzzy_bench.py --urls 20000 --candidates 20
+"""
+
+from argparse import ArgumentParser
+import random
+import re
+import time
+
+from pywb.utils.canonicalize import canonicalize
+from pywb.warcserver.index.fuzzymatcher import FuzzyMatcher
+
+
+# ============================================================================
+class LinearFuzzyMatcher(FuzzyMatcher):
+    """ FuzzyMatcher with the previous linear scan of the rules """
+    def get_matching_rules(self, urlkey):
+        return [rule for rule in self.rules
+                if any((urlkey.startswith(prefix) for prefix in rule.url_prefix))]
+
+
+def match_normalized_re_sub(fuzzy, urlkey, cdx, rx_cache):
+    """ The previous url normalization of match_general_fuzzy_query() """
+    match_urlkey = cdx['urlkey']
+
+    for normalize_rx in fuzzy.url_normalize_rx:
+        match_urlkey = re.sub(normalize_rx[0], normalize_rx[1], match_urlkey)
+        curr_urlkey = rx_cache.get(normalize_rx[0])
+
+        if not curr_urlkey:
+            curr_urlkey = re.sub(normalize_rx[0], normalize_rx[1], urlkey)
+            rx_cache[normalize_rx[0]] = curr_urlkey
+            urlkey = curr_urlkey
+
+        if curr_urlkey == match_urlkey:
+            return True
+
+    return False
+
+
+def gen_urls(rand, num_urls, special_ratio):
+    special = ['https://www.youtube.com/get_video_info?video_id={0}&el=embedded&ps=default&eurl=&hl=en_US',
+               'https://graph.facebook.com/v2.3/{0}?access_token=abc&fields=id,name&callback=cb',
+               'https://www.google.com/recaptcha/api2/anchor?k={0}&co=aHR0cDo&hl=en&v=v1',
+               'https://twitter.com/i/profiles/show/{0}/timeline/tweets?include_available_features=1']
+
+    urls = []
+    for i in range(num_urls):
+        if rand.random() < special_ratio:
+            url = rand.choice(special).format(rand.getrandbits(32))
+        else:
+            url = 'https://cdn.example-{0}.com/js/app-{1}.js?_={2}&v={3}'.format(
+                  rand.randint(0, 1000), rand.randint(0, 50), rand.getrandbits(40), rand.randint(0, 9))
+
+        urls.append((url, canonicalize(url)))
+
+    return urls
+
+
+def run(name, func, items, repeat):
+    best = None
+    for x in range(repeat):
+        start = time.time()
+        for item in items:
+            func(item)
+
+        elapsed = time.time() - start
+        best = min(best, elapsed) if best else elapsed
+
+    print('{0:<40} {1:8.2f} us/miss'.format(name, best * 1000000 / len(items)))
+    return best
+
+
+def main():
+    parser = ArgumentParser(description='Benchmark fuzzy matching per-miss cost')
+    parser.add_argument('--urls', type=int, default=20000)
+    parser.add_argument('--candidates', type=int, default=20, help='candidate cdx per fuzzy query')
+    parser.add_argument('--special-ratio', type=float, default=0.1,
+                        help='ratio of urls matching domain-specific rules')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--repeat', type=int, default=3)
+
+    r = parser.parse_args()
+
+    rand = random.Random(r.seed)
+    urls = gen_urls(rand, r.urls, r.special_ratio)
+
+    linear = LinearFuzzyMatcher()
+    fuzzy = FuzzyMatcher()
+
+    print('{0} urls, {1} rules with {2} distinct prefix lengths, best of {3}\n'.format(
+          r.urls, len(fuzzy.rules), len(fuzzy.prefix_lens), r.repeat))
+
+    params = {'url': '', 'matchType': 'exact'}
+
+    old = run('rule match, linear scan', lambda item: linear.get_fuzzy_match(item[1], item[0], params), urls, r.repeat)
+    new = run('rule match, prefix index', lambda item: fuzzy.get_fuzzy_match(item[1], item[0], params), urls, r.repeat)
+
+    # candidates returned by the fuzzy prefix query, which differ by query
+    queries = []
+    for url, urlkey in urls[:max(1, r.urls // r.candidates)]:
+        prefix = urlkey.split('?', 1)[0]
+        cdx_list = [{'urlkey': prefix + '?_={0}&v={1}'.format(rand.getrandbits(40), rand.randint(0, 9))}
+                    for i in range(r.candidates)]
+        queries.append((urlkey, cdx_list))
+
+    def filter_old(query):
+        urlkey, cdx_list = query
+        rx_cache = {}
+        for cdx in cdx_list:
+            match_normalized_re_sub(fuzzy, urlkey, cdx, rx_cache)
+
+    def filter_new(query):
+        urlkey, cdx_list = query
+        norm_urlkeys = fuzzy.get_normalized_urlkeys(urlkey)
+        for cdx in cdx_list:
+            fuzzy.match_general_fuzzy_query('', '', norm_urlkeys, cdx)
+
+    old_filter = run('normalize candidates, re.sub', filter_old, queries, r.repeat)
+    new_filter = run('normalize candidates, precompiled', filter_new, queries, r.repeat)
+
+    print('')
+    print('rule match speedup:     {0:.2f}x'.format(old / new))
+    print('normalization speedup:  {0:.2f}x'.format(old_filter / new_filter))
+
+
+if __name__ == '__main__':
+    main()
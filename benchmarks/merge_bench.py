@@ -0,0 +1,105 @@
+"""
+Benchmark merging of cdx from many index sources, as done by the index
+aggregators, comparing heapq.merge() of CDXObjects (the previous aggregator
+merge) with batch_merge() on precomputed urlkey + timestamp keys.
+
+Synthetic, sorted CDXJ lines are generated for each source from a fixed
+seed, so results are reproducible:
+
+  python benchmarks/merge_bench.py --sources 300 --lines 1000
+
+Sources with fewer hosts each (--hosts) have less overlap with each other,
+resulting in longer runs from the same source.
+"""
+
+from argparse import ArgumentParser
+from heapq import merge
+from itertools import chain
+import random
+import time
+
+from pywb.utils.merge import batch_merge
+from pywb.warcserver.index.cdxobject import CDXObject, LazyCDXObject
+from pywb.warcserver.index.aggregator import BaseAggregator
+
+
+LINE = '{urlkey} {timestamp} {{"url": "http://{host}/{path}", "mime": "text/html", "status": "200", ' \
+       '"digest": "{digest}", "length": "{length}", "offset": "{offset}", "filename": "{host}.warc.gz"}}'
+
+
+def gen_source(rand, num_lines, num_urls, hosts):
+    lines = []
+    for i in range(num_lines):
+        path = 'page-{0}'.format(rand.randint(0, num_urls))
+        host = 'example-{0}.com'.format(rand.choice(hosts))
+        lines.append(LINE.format(urlkey='com,{0})/{1}'.format(host[:-4], path),
+                                 timestamp='2020{0:010d}'.format(rand.randint(0, 10 ** 10 - 1)),
+                                 host=host,
+                                 path=path,
+                                 digest='%032X' % rand.getrandbits(128),
+                                 length=rand.randint(100, 100000),
+                                 offset=rand.randint(0, 10 ** 9)).encode('utf-8'))
+
+    lines.sort()
+    return lines
+
+
+def run(name, func, sources, cls, repeat):
+    best = None
+    for x in range(repeat):
+        iters = [(cls(line) for line in lines) for lines in sources]
+
+        start = time.time()
+        count = 0
+        for cdx in func(iters):
+            count += 1
+
+        elapsed = time.time() - start
+        best = min(best, elapsed) if best else elapsed
+
+    print('{0:<40} {1:>8} lines  {2:8.3f}s'.format(name, count, best))
+    return best
+
+
+def main():
+    parser = ArgumentParser(description='Benchmark index aggregator merge')
+    parser.add_argument('--sources', type=int, default=300)
+    parser.add_argument('--lines', type=int, default=1000, help='lines per source')
+    parser.add_argument('--urls', type=int, default=5000, help='distinct paths per host')
+    parser.add_argument('--host-pool', type=int, default=100, help='total number of hosts')
+    parser.add_argument('--hosts', type=int, default=5, help='hosts in each source, chosen from the pool')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--repeat', type=int, default=3)
+
+    r = parser.parse_args()
+
+    rand = random.Random(r.seed)
+    sources = []
+    for i in range(r.sources):
+        hosts = rand.sample(range(r.host_pool), r.hosts)
+        sources.append(gen_source(rand, r.lines, r.urls, hosts))
+
+    print('{0} sources, {1} lines each from {2} of {3} hosts, best of {4}\n'.format(
+          r.sources, r.lines, r.hosts, r.host_pool, r.repeat))
+
+    key = BaseAggregator._sort_key
+
+    run('no merge (parse only), CDXObject', lambda iters: chain(*iters), sources, CDXObject, r.repeat)
+    run('no merge (parse only), LazyCDXObject', lambda iters: chain(*iters), sources, LazyCDXObject, r.repeat)
+
+    old = run('heapq.merge, CDXObject', lambda iters: merge(*iters), sources, CDXObject, r.repeat)
+    run('heapq.merge with key, CDXObject', lambda iters: merge(*iters, key=key), sources, CDXObject, r.repeat)
+    new = run('batch_merge, CDXObject', lambda iters: batch_merge(iters, key=key), sources, CDXObject, r.repeat)
+    lazy = run('batch_merge, LazyCDXObject', lambda iters: batch_merge(iters, key=key), sources, LazyCDXObject, r.repeat)
+
+    raw_old = run('heapq.merge, raw lines', lambda iters: merge(*iters), sources, bytes, r.repeat)
+    raw_new = run('batch_merge, raw lines', lambda iters: batch_merge(iters), sources, bytes, r.repeat)
+
+    print('')
+    print('CDXObject speedup:      {0:.2f}x'.format(old / new))
+    print('LazyCDXObject speedup:  {0:.2f}x'.format(old / lazy))
+    print('raw lines speedup:      {0:.2f}x'.format(raw_old / raw_new))
+
+
+if __name__ == '__main__':
+    main()
@@ -280,6 +280,9 @@ def write_multi_cdx_index(output, inputs, **options):
                     writer = write_cdx_index(outfile, infile, filename,
                                              **options)
 
+            if options.get('bloom'):
+                write_host_filter(outpath)
+
         return writer
 
     # write to one cdx file
@@ -308,9 +311,20 @@ def write_multi_cdx_index(output, inputs, **options):
                     except warcio.exceptions.ArchiveLoadFailed:
                         logging.error('Error while indexing file %s, %s',filename,traceback.format_exc())
 
+        if output != '-' and options.get('bloom'):
+            outfile.flush()
+            write_host_filter(output)
+
         return writer
 
 
+#=================================================================
+def write_host_filter(filename):
+    from pywb.warcserver.index.hostfilter import HostBloomFilter
+
+    HostBloomFilter.write_for_file(filename)
+
+
 #=================================================================
 def write_cdx_index(outfile, infile, filename, **options):
     #filename = filename.encode(sys.getfilesystemencoding())
@@ -387,6 +401,12 @@ Output file or directory.
 - If directory, each input file is written to a separate output file
   with a .cdx extension
 - If output is '-', output is written to stdout
+"""
+
+    bloom_help = """
+Also write a bloom filter of the hosts in each output file,
+with a .bloom extension, used to skip the index for queries
+on other hosts. Not supported when writing to stdout
 """
 
     input_help = """
@@ -461,6 +481,10 @@ instead of current working directory
     parser.add_argument('-o', '--output',
                         default='-', help=output_help)
 
+    parser.add_argument('-b', '--bloom',
+                        action='store_true',
+                        help=bloom_help)
+
     parser.add_argument('inputs', nargs='+', help=input_help)
 
     cmd = parser.parse_args(args=args)
@@ -475,7 +499,8 @@ instead of current working directory
                           verify_http=cmd.verify,
                           cdx09=cmd.cdx09,
                           cdxj=cmd.cdxj,
-                          minimal=cmd.minimal_cdxj)
+                          minimal=cmd.minimal_cdxj,
+                          bloom=cmd.bloom)
 
 
 if __name__ == '__main__':
@@ -4,7 +4,7 @@ import sys
 
 from pywb.manager.manager import CollectionsManager
 from pywb.utils.canonicalize import canonicalize
-from pywb.warcserver.access_checker import AccessChecker
+from pywb.warcserver.access_checker import AccessChecker, AccessRulesSnapshot
 from pywb.warcserver.index.cdxobject import CDXObject
 
 
@@ -128,6 +128,27 @@ class ACLManager(CollectionsManager):
 
         except Exception as e:
             print('Error Saving ACL Rules: ' + str(e))
+            return
+
+        # if previously compiled, keep the snapshot up-to-date
+        if os.path.isfile(self.acl_file + AccessRulesSnapshot.EXT):
+            self.compile_snapshot()
+
+    def compile_snapshot(self, r=None):
+        """Compile the access control list into a binary snapshot,
+        which is memory-mapped and shared by all workers instead of
+        each loading the rules, and updated on each change to the rules
+
+        :param argparse.Namespace|None r: Not used
+        :rtype: None
+        """
+        try:
+            snapshot_file = AccessRulesSnapshot.compile(self.acl_file)
+            print('Compiled {0} rules to {1}'.format(len(self.rules), snapshot_file))
+
+        except Exception as e:
+            print('Error Compiling ACL Rules: ' + str(e))
+            sys.exit(1)
 
     def to_key(self, url_or_surt, exact_match=False):
         """ If 'url_or_surt' already a SURT, use as is
@@ -360,4 +381,5 @@ class ACLManager(CollectionsManager):
         command('validate', 'coll_name', func=cls.validate_save)
         command('match', 'coll_name', 'url', 'default_access', func=cls.find_match, user_opt=True)
         command('importtxt', 'coll_name', 'filename', 'access', func=cls.add_excludes)
+        command('compile', 'coll_name', func=cls.compile_snapshot)
 
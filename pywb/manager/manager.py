@@ -251,11 +251,13 @@ directory structure expected by pywb
 
         if not os.path.isfile(collection_index_path):
             shutil.move(rewritten_index_path, collection_index_path)
+            self._update_host_filter(collection_index_path)
             return
 
         temp_coll_index_path = collection_index_path + '.tmp.' + timestamp20_now()
         self._merge_indices(collection_index_path, rewritten_index_path, temp_coll_index_path)
         shutil.move(temp_coll_index_path, collection_index_path)
+        self._update_host_filter(collection_index_path)
 
         tempdir.cleanup()
 
@@ -263,6 +265,7 @@ directory structure expected by pywb
         cdx_file = os.path.join(self.indexes_dir, self.DEF_INDEX_FILE)
         logging.info('Indexing ' + self.archive_dir + ' to ' + cdx_file)
         self._cdx_index(cdx_file, [self.archive_dir])
+        self._update_host_filter(cdx_file)
 
     def _cdx_index(self, out, input_, rel_root=None):
         from pywb.indexer.cdxindexer import write_multi_cdx_index
@@ -306,6 +309,7 @@ directory structure expected by pywb
         # no existing file, so just make it the new file
         if not os.path.isfile(cdx_file):
             shutil.move(temp_file, cdx_file)
+            self._update_host_filter(cdx_file)
             return
 
         merged_file = temp_file + '.merged'
@@ -315,6 +319,15 @@ directory structure expected by pywb
         shutil.move(merged_file, cdx_file)
         #os.rename(merged_file, cdx_file)
         os.remove(temp_file)
+        self._update_host_filter(cdx_file)
+
+    @staticmethod
+    def _update_host_filter(cdx_file):
+        from pywb.warcserver.index.hostfilter import HostBloomFilter
+
+        # rebuild host filter, if any, to match the updated index
+        if os.path.isfile(cdx_file + HostBloomFilter.EXT):
+            HostBloomFilter.write_for_file(cdx_file)
 
     @staticmethod
     def _merge_indices(index1, index2, dest):
@@ -468,6 +481,38 @@ directory structure expected by pywb
 
         migrate.convert_to_cdxj()
 
+    def convert_columnar(self, path, force=False):
+        from pywb.manager.migrate import MigrateColumnar
+
+        migrate = MigrateColumnar(path)
+        count = migrate.count_cdx()
+        if count == 0:
+            print('No CDXJ index files found, nothing to convert')
+            return
+
+        msg = 'Convert {0} CDXJ index files to columnar format? (y/n)'.format(count)
+        if not force:
+            res = get_input(msg)
+            try:
+                res = strtobool(res)
+            except ValueError:
+                res = False
+
+            if not res:
+                return
+
+        migrate.convert_to_columnar()
+
+    def build_host_filters(self, path):
+        from pywb.manager.migrate import HostFilterBuilder
+
+        builder = HostFilterBuilder(path)
+        if builder.count_cdx() == 0:
+            print('No index files found')
+            return
+
+        builder.build_host_filters()
+
 
 #=============================================================================
 def main(args=None):
@@ -587,6 +632,27 @@ Create manage file based web archive collections
     migrate.add_argument('-f', '--force', action='store_true')
     migrate.set_defaults(func=do_migrate)
 
+    # Convert CDXJ to Columnar
+    def do_columnar(r):
+        m = CollectionsManager('', must_exist=False)
+        m.convert_columnar(r.path, r.force)
+
+    columnar_help = 'Convert CDXJ indexes to the binary columnar (.cdxc) format'
+    columnar = subparsers.add_parser('cdx-columnar', help=columnar_help)
+    columnar.add_argument('path', default='./', nargs='?')
+    columnar.add_argument('-f', '--force', action='store_true')
+    columnar.set_defaults(func=do_columnar)
+
+    # Host Filters
+    def do_bloom(r):
+        m = CollectionsManager('', must_exist=False)
+        m.build_host_filters(r.path)
+
+    bloom_help = 'Create host bloom filters for indexes, allowing queries to skip indexes without the host'
+    bloom = subparsers.add_parser('cdx-bloom', help=bloom_help)
+    bloom.add_argument('path', default='./', nargs='?')
+    bloom.set_defaults(func=do_bloom)
+
     # ACL
     from pywb.manager.aclmanager import ACLManager
     def do_acl(r):
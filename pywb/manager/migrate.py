@@ -1,5 +1,9 @@
 from pywb.utils.canonicalize import canonicalize
 from pywb.warcserver.index.cdxobject import CDXObject, URLKEY, ORIGINAL
+from pywb.warcserver.index.columnar import ColumnarIndex
+from pywb.warcserver.index.hostfilter import HostBloomFilter
+from pywb.warcserver.index.indexsource import FileIndexSource
+from pywb.warcserver.index.zipnum import ZipNumIndexSource
 from pywb.indexer.cdxindexer import CDXJ
 
 import os
@@ -8,13 +12,20 @@ import shutil
 
 #=============================================================================
 class MigrateCDX(object):
+    CDX_EXT = '.cdx'
+
     def __init__(self, dir_):
         self.cdx_dir = dir_
 
     def iter_cdx_files(self):
+        if os.path.isfile(self.cdx_dir):
+            if self.cdx_dir.endswith(self.CDX_EXT):
+                yield self.cdx_dir
+            return
+
         for root, dirs, files in os.walk(self.cdx_dir):
             for filename in files:
-                if filename.endswith('.cdx'):
+                if filename.endswith(self.CDX_EXT):
                     full_path = os.path.join(root, filename)
                     yield full_path
 
@@ -44,3 +55,31 @@ class MigrateCDX(object):
             os.remove(filename)
 
 
+
+
+#=============================================================================
+class MigrateColumnar(MigrateCDX):
+    CDX_EXT = '.cdxj'
+
+    def convert_to_columnar(self):
+        for filename in self.iter_cdx_files():
+            outfile = filename[:-len(self.CDX_EXT)] + ColumnarIndex.EXT
+
+            print('Converting {0} -> {1}'.format(filename, outfile))
+
+            with open(filename, 'rb') as fh:
+                cdx_iter = (CDXObject(line) for line in fh if line.strip())
+                ColumnarIndex.write(outfile, cdx_iter)
+
+            os.remove(filename)
+
+
+#=============================================================================
+class HostFilterBuilder(MigrateCDX):
+    CDX_EXT = FileIndexSource.CDX_EXT + ZipNumIndexSource.IDX_EXT + (ColumnarIndex.EXT,)
+
+    def build_host_filters(self):
+        for filename in self.iter_cdx_files():
+            print('Writing host filter {0}'.format(filename + HostBloomFilter.EXT))
+
+            HostBloomFilter.write_for_file(filename)
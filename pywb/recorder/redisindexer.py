@@ -25,7 +25,8 @@ class WritableRedisIndexer(RedisIndexSource):
 
         super(WritableRedisIndexer, self).__init__(redis_url,
                                                    redis,
-                                                   cdx_key_template)
+                                                   cdx_key_template,
+                                                   key_version_key=kwargs.get('key_version_key'))
 
         name = kwargs.get('name', 'recorder')
         self.cdx_lookup = SimpleAggregator({name: self})
@@ -70,10 +71,16 @@ class WritableRedisIndexer(RedisIndexSource):
 
         cdx_list = cdxout.getvalue().rstrip().split(b'\n')
 
+        # if adding a new key, increment version to invalidate cached key lists
+        new_key = self.key_version_key and not self.redis.exists(z_key)
+
         for cdx in cdx_list:
             if cdx:
                 self.redis.zadd(z_key, 0, cdx)
 
+        if new_key:
+            self.redis.incr(res_template(self.key_version_key, params))
+
         return cdx_list
 
     def lookup_revisit(self, lookup_params, digest, url, iso_dt):
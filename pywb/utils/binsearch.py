@@ -2,8 +2,11 @@
 Utility functions for performing binary search over a sorted text file
 """
 
+from bisect import bisect_left
 from collections import deque
 import itertools
+import logging
+import os
 import six
 
 import sys
@@ -14,29 +17,47 @@ if six.PY3:
 
 
 #=================================================================
-def binsearch_offset(reader, key, compare_func=cmp, block_size=8192):
+def binsearch_offset(reader, key, compare_func=cmp, block_size=8192, min_offset=0):
     """
     Find offset of the line which matches a given 'key' using binary search
     If key is not found, the offset is of the line after the key
 
     File is subdivided into block_size (default 8192) sized blocks
     Optional compare_func may be specified
+
+    If 'min_offset' is specified, the key is known to be at or after
+    the line starting at that offset, and the search gallops forward
+    from it, with a number of reads logarithmic in the distance
+    from 'min_offset' instead of in the size of the file
     """
+    def block_line(block):
+        reader.seek(block * block_size)
+
+        if block > 0:
+            reader.readline()  # skip partial line
+
+        return reader.readline()
+
     min_ = 0
 
     reader.seek(0, 2)
     max_ = int(reader.tell() / block_size)
 
+    if min_offset > 0:
+        min_ = min(int((min_offset - 1) / block_size), max_)
+        step = 1
+        while min_ + step < max_:
+            if compare_func(key, block_line(min_ + step)) > 0:
+                min_ += step
+                step *= 2
+            else:
+                max_ = min_ + step
+                break
+
     while max_ - min_ > 1:
         mid = int(min_ + ((max_ - min_) / 2))
-        reader.seek(mid * block_size)
 
-        if mid > 0:
-            reader.readline()  # skip partial line
-
-        line = reader.readline()
-
-        if compare_func(key, line) > 0:
+        if compare_func(key, block_line(mid)) > 0:
             min_ = mid
         else:
             max_ = mid
@@ -45,18 +66,380 @@ def binsearch_offset(reader, key, compare_func=cmp, block_size=8192):
 
 
 #=================================================================
-def binsearch(reader, key, compare_func=cmp, block_size=8192):
+class BlockIndex(object):
+    """
+    Sparse in-memory index of a sorted text file, storing the (truncated)
+    first full line of every 'block_size' block and its offset.
+
+    A lookup is a single in-memory bisect, after which the file
+    is read starting from the returned offset.
+
+    The index is persisted next to the indexed file, with the '.blkidx'
+    extension, and rebuilt if the size or mtime of the file changes.
+    """
+    EXT = '.blkidx'
+    HEADER = b'#pywb-blkidx'
+    VERSION = 1
+
+    DEFAULT_KEY_LEN = 128
+
+    logger = logging.getLogger('warcserver')
+
+    _cache = {}
+
+    def __init__(self, keys, offsets, block_size, key_len, stat_sig=None):
+        self.keys = keys
+        self.offsets = offsets
+        self.block_size = block_size
+        self.key_len = key_len
+        self.stat_sig = stat_sig
+
+    def find_offset(self, key):
+        """
+        Return offset of a line that sorts before 'key' (or 0), such that
+        the first line >= 'key' is at or after the offset.
+
+        Both the stored keys and the search key are truncated to 'key_len',
+        so that a stored key less than the search key guarantees
+        that the full line is also less than the key.
+        """
+        i = bisect_left(self.keys, key[:self.key_len])
+        if i == 0:
+            return 0
+
+        return self.offsets[i - 1]
+
+    @classmethod
+    def build(cls, reader, block_size=8192, key_len=DEFAULT_KEY_LEN, stat_sig=None):
+        """
+        Build block index by scanning a sorted text file, recording
+        the first full line starting in each block
+        """
+        keys = []
+        offsets = []
+
+        reader.seek(0)
+        offset = 0
+        next_block = 0
+
+        for line in reader:
+            if offset >= next_block:
+                keys.append(line[:key_len].rstrip(b'\r\n'))
+                offsets.append(offset)
+                next_block = (offset // block_size + 1) * block_size
+
+            offset += len(line)
+
+        return cls(keys, offsets, block_size, key_len, stat_sig)
+
+    @staticmethod
+    def _stat_sig(filename):
+        stat = os.stat(filename)
+        return (stat.st_size, stat.st_mtime_ns)
+
+    @classmethod
+    def load_for_file(cls, filename, block_size=8192, key_len=DEFAULT_KEY_LEN,
+                      persist=True):
+        """
+        Return block index for specified file, using in-memory copy
+        if file is unchanged, otherwise loading from or creating the
+        persisted '.blkidx' file
+        """
+        stat_sig = cls._stat_sig(filename)
+
+        block_index = cls._cache.get(filename)
+        if (block_index and block_index.stat_sig == stat_sig and
+            block_index.block_size == block_size and
+            block_index.key_len == key_len):
+            return block_index
+
+        idx_filename = filename + cls.EXT
+
+        block_index = cls.read(idx_filename, stat_sig, block_size, key_len)
+
+        if not block_index:
+            with open(filename, 'rb') as fh:
+                block_index = cls.build(fh, block_size, key_len, stat_sig)
+
+            if persist:
+                block_index.write(idx_filename)
+
+        cls._cache[filename] = block_index
+        return block_index
+
+    @classmethod
+    def read(cls, idx_filename, stat_sig, block_size, key_len):
+        """
+        Read persisted block index, if it exists and matches the file
+        signature and block settings, otherwise return None
+        """
+        try:
+            fh = open(idx_filename, 'rb')
+        except IOError:
+            return None
+
+        with fh:
+            header = fh.readline().split(b' ')
+            try:
+                expected = (cls.VERSION, stat_sig[0], stat_sig[1], block_size, key_len)
+                if (header[0] != cls.HEADER or
+                    tuple(int(v) for v in header[1:]) != expected):
+                    return None
+            except ValueError:
+                return None
+
+            keys = []
+            offsets = []
+            for line in fh:
+                offset, key = line.rstrip(b'\n').split(b' ', 1)
+                offsets.append(int(offset))
+                keys.append(key)
+
+        return cls(keys, offsets, block_size, key_len, stat_sig)
+
+    def write(self, idx_filename):
+        """
+        Atomically write the block index, ignoring errors
+        (eg. if the index directory is not writable)
+        """
+        tmp_filename = idx_filename + '.tmp.' + str(os.getpid())
+        try:
+            with open(tmp_filename, 'wb') as fh:
+                fh.write(b'%s %d %d %d %d %d\n' % (self.HEADER,
+                                                  self.VERSION,
+                                                  self.stat_sig[0],
+                                                  self.stat_sig[1],
+                                                  self.block_size,
+                                                  self.key_len))
+
+                for offset, key in zip(self.offsets, self.keys):
+                    fh.write(b'%d %s\n' % (offset, key))
+
+            os.replace(tmp_filename, idx_filename)
+        except (IOError, OSError) as e:
+            self.logger.debug('Unable to write block index: ' + str(e))
+            try:
+                os.remove(tmp_filename)
+            except OSError:
+                pass
+
+
+#=================================================================
+class TimestampIndex(object):
+    """
+    Secondary index of the urlkeys with many captures in a sorted CDX(J)
+    file, storing the timestamp and offset of every 'interval'-th capture
+    of each urlkey with at least 'min_captures' captures.
+
+    A search for 'urlkey timestamp' of an indexed urlkey is then a bisect
+    of its timestamps, and the file is read starting at most 'interval'
+    lines before the first matching line.
+
+    The index is persisted next to the indexed file, with the '.tsidx'
+    extension, and rebuilt if the size or mtime of the file changes.
+    """
+    EXT = '.tsidx'
+    HEADER = b'#pywb-tsidx'
+    VERSION = 1
+
+    DEFAULT_MIN_CAPTURES = 1000
+    DEFAULT_INTERVAL = 100
+
+    logger = logging.getLogger('warcserver')
+
+    _cache = {}
+
+    def __init__(self, entries, min_captures, interval, stat_sig=None):
+        # urlkey -> (timestamps, offsets)
+        self.entries = entries
+        self.min_captures = min_captures
+        self.interval = interval
+        self.stat_sig = stat_sig
+
+    def find_offset(self, key):
+        """
+        For a 'urlkey timestamp' (or just 'urlkey') search key, return
+        the offset of a line of the urlkey that sorts before the key,
+        or of the first line of the urlkey, such that the first line >= 'key'
+        is at or after the offset.
+
+        Return None if the urlkey is not in the index.
+        """
+        urlkey, _, timestamp = key.partition(b' ')
+        entry = self.entries.get(urlkey)
+        if not entry:
+            return None
+
+        timestamps, offsets = entry
+        i = bisect_left(timestamps, timestamp)
+        return offsets[max(i - 1, 0)]
+
+    @classmethod
+    def build(cls, reader, min_captures=DEFAULT_MIN_CAPTURES,
+              interval=DEFAULT_INTERVAL, stat_sig=None):
+        """
+        Build timestamp index by scanning a sorted CDX(J) file
+        """
+        entries = {}
+
+        reader.seek(0)
+        offset = 0
+
+        last_urlkey = None
+        count = 0
+        timestamps = []
+        offsets = []
+
+        for line in itertools.chain(reader, [b'']):
+            parts = line.rstrip().split(b' ', 2)
+            urlkey = parts[0]
+
+            if urlkey != last_urlkey:
+                if count >= min_captures:
+                    entries[last_urlkey] = (timestamps, offsets)
+
+                last_urlkey = urlkey
+                count = 0
+                timestamps = []
+                offsets = []
+
+            if len(parts) > 1 and count % interval == 0:
+                timestamps.append(parts[1])
+                offsets.append(offset)
+
+            count += 1
+            offset += len(line)
+
+        return cls(entries, min_captures, interval, stat_sig)
+
+    @staticmethod
+    def _stat_sig(filename):
+        stat = os.stat(filename)
+        return (stat.st_size, stat.st_mtime_ns)
+
+    @classmethod
+    def load_for_file(cls, filename, min_captures=DEFAULT_MIN_CAPTURES,
+                      interval=DEFAULT_INTERVAL, persist=True):
+        """
+        Return timestamp index for specified file, using in-memory copy
+        if file is unchanged, otherwise loading from or creating the
+        persisted '.tsidx' file
+        """
+        stat_sig = cls._stat_sig(filename)
+
+        ts_index = cls._cache.get(filename)
+        if (ts_index and ts_index.stat_sig == stat_sig and
+            ts_index.min_captures == min_captures and
+            ts_index.interval == interval):
+            return ts_index
+
+        idx_filename = filename + cls.EXT
+
+        ts_index = cls.read(idx_filename, stat_sig, min_captures, interval)
+
+        if not ts_index:
+            with open(filename, 'rb') as fh:
+                ts_index = cls.build(fh, min_captures, interval, stat_sig)
+
+            if persist:
+                ts_index.write(idx_filename)
+
+        cls._cache[filename] = ts_index
+        return ts_index
+
+    @classmethod
+    def read(cls, idx_filename, stat_sig, min_captures, interval):
+        """
+        Read persisted timestamp index, if it exists and matches the file
+        signature and settings, otherwise return None
+        """
+        try:
+            fh = open(idx_filename, 'rb')
+        except IOError:
+            return None
+
+        with fh:
+            header = fh.readline().split(b' ')
+            try:
+                expected = (cls.VERSION, stat_sig[0], stat_sig[1], min_captures, interval)
+                if (header[0] != cls.HEADER or
+                    tuple(int(v) for v in header[1:]) != expected):
+                    return None
+            except ValueError:
+                return None
+
+            entries = {}
+            for line in fh:
+                offset, urlkey, timestamp = line.rstrip(b'\n').split(b' ')
+                entry = entries.get(urlkey)
+                if not entry:
+                    entry = entries[urlkey] = ([], [])
+
+                entry[0].append(timestamp)
+                entry[1].append(int(offset))
+
+        return cls(entries, min_captures, interval, stat_sig)
+
+    def write(self, idx_filename):
+        """
+        Atomically write the timestamp index, ignoring errors
+        (eg. if the index directory is not writable)
+        """
+        tmp_filename = idx_filename + '.tmp.' + str(os.getpid())
+        try:
+            with open(tmp_filename, 'wb') as fh:
+                fh.write(b'%s %d %d %d %d %d\n' % (self.HEADER,
+                                                  self.VERSION,
+                                                  self.stat_sig[0],
+                                                  self.stat_sig[1],
+                                                  self.min_captures,
+                                                  self.interval))
+
+                for urlkey in sorted(self.entries):
+                    timestamps, offsets = self.entries[urlkey]
+                    for timestamp, offset in zip(timestamps, offsets):
+                        fh.write(b'%d %s %s\n' % (offset, urlkey, timestamp))
+
+            os.replace(tmp_filename, idx_filename)
+        except (IOError, OSError) as e:
+            self.logger.debug('Unable to write timestamp index: ' + str(e))
+            try:
+                os.remove(tmp_filename)
+            except OSError:
+                pass
+
+
+#=================================================================
+def binsearch(reader, key, compare_func=cmp, block_size=8192, block_index=None,
+              ts_index=None):
     """
     Perform a binary search for a specified key to within a 'block_size'
     (default 8192) granularity, and return first full line found.
+
+    If a 'block_index' is provided, the search is performed in memory
+    and the reader is only seeked once (only supported for default
+    'compare_func')
+
+    If a 'ts_index' (TimestampIndex) is provided and contains the urlkey
+    of the key, it is used instead of the 'block_index'
     """
+    offset = None
+    if ts_index is not None and compare_func is cmp:
+        offset = ts_index.find_offset(key)
 
-    min_ = binsearch_offset(reader, key, compare_func, block_size)
+    if offset is not None:
+        reader.seek(offset)
 
-    reader.seek(min_)
+    elif block_index is not None and compare_func is cmp:
+        reader.seek(block_index.find_offset(key))
 
-    if min_ > 0:
-        reader.readline()  # skip partial line
+    else:
+        min_ = binsearch_offset(reader, key, compare_func, block_size)
+
+        reader.seek(min_)
+
+        if min_ > 0:
+            reader.readline()  # skip partial line
 
     def gen_iter(line):
         while line:
@@ -66,6 +449,69 @@ def binsearch(reader, key, compare_func=cmp, block_size=8192):
     return gen_iter(reader.readline())
 
 
+#=================================================================
+def search_offset(reader, key, block_size=8192, block_index=None, ts_index=None,
+                  min_offset=0):
+    """
+    Return the offset of the first line >= 'key', or of the end
+    of the file if there is no such line.
+
+    If 'min_offset' is specified, it must be the offset of a line
+    at or before that line, eg. as returned for a smaller key, and
+    the search starts from there.
+    """
+    offset = None
+    if ts_index is not None:
+        offset = ts_index.find_offset(key)
+
+    if offset is None and block_index is not None:
+        offset = block_index.find_offset(key)
+
+    if offset is None:
+        offset = binsearch_offset(reader, key, cmp, block_size, min_offset)
+
+        if offset > 0:
+            reader.seek(offset)
+            offset += len(reader.readline())  # skip partial line
+
+    offset = max(offset, min_offset)
+    reader.seek(offset)
+
+    while True:
+        line = reader.readline()
+        if not line or line.rstrip() >= key:
+            return offset
+
+        offset += len(line)
+
+
+#=================================================================
+def iter_lines_reverse(reader, offset, block_size=8192):
+    """
+    Iterate over the lines before 'offset' (which must be the start
+    of a line) in reverse order, reading 'block_size' blocks backwards.
+
+    The reader is seeked before each read.
+    """
+    remainder = b''
+
+    while offset > 0:
+        start = max(0, offset - block_size)
+        reader.seek(start)
+        lines = (reader.read(offset - start) + remainder).split(b'\n')
+        offset = start
+
+        # first line may be partial, unless at start of file
+        remainder = lines.pop(0) if start > 0 else b''
+
+        for line in reversed(lines):
+            if line:
+                yield line.rstrip()
+
+    if remainder:
+        yield remainder.rstrip()
+
+
 #=================================================================
 def linearsearch(iter_, key, prev_size=0, compare_func=cmp):
     """
@@ -101,7 +547,8 @@ def linearsearch(iter_, key, prev_size=0, compare_func=cmp):
 
 
 #=================================================================
-def search(reader, key, prev_size=0, compare_func=cmp, block_size=8192):
+def search(reader, key, prev_size=0, compare_func=cmp, block_size=8192,
+           block_index=None, ts_index=None):
     """
     Perform a binary search for a specified key to within a 'block_size'
     (default 8192) sized block followed by linear search
@@ -110,7 +557,7 @@ def search(reader, key, prev_size=0, compare_func=cmp, block_size=8192):
     When performin_g linear search, keep track of up to N previous lines before
     first matching line.
     """
-    iter_ = binsearch(reader, key, compare_func, block_size)
+    iter_ = binsearch(reader, key, compare_func, block_size, block_index, ts_index)
     iter_ = linearsearch(iter_,
                          key, prev_size=prev_size,
                          compare_func=compare_func)
@@ -118,13 +565,14 @@ def search(reader, key, prev_size=0, compare_func=cmp, block_size=8192):
 
 
 #=================================================================
-def iter_range(reader, start, end, prev_size=0):
+def iter_range(reader, start, end, prev_size=0, block_index=None, ts_index=None):
     """
     Creates an iterator which iterates over lines where
     start <= line < end (end exclusive)
     """
 
-    iter_ = search(reader, start, prev_size=prev_size)
+    iter_ = search(reader, start, prev_size=prev_size, block_index=block_index,
+                   ts_index=ts_index)
 
     end_iter = itertools.takewhile(
         lambda line: line < end,
@@ -0,0 +1,87 @@
+import threading
+from collections import OrderedDict
+
+
+# =============================================================================
+class LRUCache(object):
+    """Thread-safe LRU cache, bounded by the total size of its entries.
+
+    By default, each entry has a size of 1 and the cache is bounded by
+    number of entries. If a sizeof function is provided, it is called
+    on each value to determine its size, eg. len() to bound by bytes.
+    """
+    def __init__(self, max_size, sizeof=None):
+        self.max_size = max_size
+        self.sizeof = sizeof
+
+        self.cache = OrderedDict()
+        self.size = 0
+        self.lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, default=None):
+        with self.lock:
+            entry = self.cache.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+
+            self.cache.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, value):
+        size = self.sizeof(value) if self.sizeof else 1
+
+        # don't cache values that can never fit
+        if size > self.max_size:
+            return
+
+        with self.lock:
+            old = self.cache.pop(key, None)
+            if old is not None:
+                self.size -= old[1]
+
+            self.cache[key] = (value, size)
+            self.size += size
+
+            while self.size > self.max_size:
+                _, (_, old_size) = self.cache.popitem(last=False)
+                self.size -= old_size
+                self.evictions += 1
+
+    def remove(self, key):
+        with self.lock:
+            old = self.cache.pop(key, None)
+            if old is not None:
+                self.size -= old[1]
+
+    def clear(self):
+        with self.lock:
+            self.cache.clear()
+            self.size = 0
+
+    def resize(self, max_size):
+        with self.lock:
+            self.max_size = max_size
+            while self.size > self.max_size:
+                _, (_, old_size) = self.cache.popitem(last=False)
+                self.size -= old_size
+                self.evictions += 1
+
+    def __len__(self):
+        return len(self.cache)
+
+    def __contains__(self, key):
+        return key in self.cache
+
+    def stats(self):
+        return dict(hits=self.hits,
+                    misses=self.misses,
+                    evictions=self.evictions,
+                    entries=len(self.cache),
+                    size=self.size,
+                    max_size=self.max_size)
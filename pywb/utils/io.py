@@ -1,4 +1,8 @@
+import mmap
+import os
+import threading
 import zlib
+from collections import OrderedDict
 from contextlib import closing, contextmanager
 from tempfile import SpooledTemporaryFile
 
@@ -133,3 +137,200 @@ class StreamClosingReader(object):
 
     def close(self):
         no_except_close(self.stream)
+
+
+# ============================================================================
+class MMapReader(object):
+    """Read-only memory-mapped file, providing the seek()/tell()/readline()
+    interface used by the binary search functions.
+
+    Lines are read directly from the OS page cache, which is shared by
+    all processes mapping the same file, without read() syscalls or
+    intermediate buffering.
+    """
+    def __init__(self, filename):
+        with open(filename, 'rb') as fh:
+            self.mmap = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+
+        self.name = filename
+
+        self.seek = self.mmap.seek
+        self.tell = self.mmap.tell
+        self.read = self.mmap.read
+        self.readline = self.mmap.readline
+
+    @classmethod
+    def open(cls, filename):
+        """Open filename as an MMapReader, or a regular file if it
+        can not be mapped (eg. an empty file)
+        """
+        try:
+            return cls(filename)
+        except ValueError:
+            return open(filename, 'rb')
+
+    def readlines(self):
+        return list(iter(self.readline, b''))
+
+    def __iter__(self):
+        return iter(self.readline, b'')
+
+    def close(self):
+        self.mmap.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+# ============================================================================
+class FileHandlePool(object):
+    """Bounded LRU pool of idle, open, read-only file handles, keyed by path.
+
+    Handles are checked out exclusively with acquire() and returned to the
+    pool when the returned PooledFile is closed. An idle handle is only
+    reused if the file inode, size and mtime are unchanged, otherwise it is
+    closed and the file reopened.
+    """
+    DEFAULT_MAX_SIZE = 256
+
+    def __init__(self, max_size=DEFAULT_MAX_SIZE):
+        self.max_size = max_size
+        self.idle = OrderedDict()
+        self.num_idle = 0
+        # reentrant, as a handle may be released by a generator finalized
+        # by the garbage collector while the lock is held
+        self.lock = threading.RLock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def _stat_sig(filename):
+        stat = os.stat(filename)
+        return (stat.st_dev, stat.st_ino, stat.st_size, stat.st_mtime_ns)
+
+    def acquire(self, filename, opener=None, kind=''):
+        """Return a PooledFile for filename, reusing an idle handle if
+        available, or opening a new one with opener (default: open 'rb')
+
+        :param str filename: The file to open
+        :param opener: Optional function called with filename to open the file
+        :param str kind: Optional key distinguishing handles from different openers
+        """
+        stat_sig = self._stat_sig(filename)
+        key = (filename, kind)
+
+        with self.lock:
+            handles = self.idle.get(key)
+            while handles:
+                fh_sig, fh = handles.pop()
+                self.num_idle -= 1
+                if fh_sig == stat_sig and not getattr(fh, 'closed', False):
+                    self.hits += 1
+                    return PooledFile(self, key, stat_sig, fh)
+
+                # file changed, close stale handle. the handle may also
+                # have been closed, if released from a generator collected
+                # together with the file object
+                no_except_close(fh)
+
+            self.misses += 1
+
+        if opener:
+            fh = opener(filename)
+        else:
+            fh = open(filename, 'rb')
+
+        return PooledFile(self, key, stat_sig, fh)
+
+    def release(self, pooled):
+        """Return the handle of a PooledFile to the idle pool,
+        evicting least recently used handles if pool is full
+        """
+        if self.max_size <= 0:
+            no_except_close(pooled.fh)
+            return
+
+        evicted = []
+
+        with self.lock:
+            handles = self.idle.get(pooled.key)
+            if handles is None:
+                handles = self.idle[pooled.key] = []
+            else:
+                self.idle.move_to_end(pooled.key)
+
+            handles.append((pooled.stat_sig, pooled.fh))
+            self.num_idle += 1
+
+            while self.num_idle > self.max_size:
+                key, handles = next(iter(self.idle.items()))
+                evicted.append(handles.pop(0)[1])
+                if not handles:
+                    del self.idle[key]
+
+                self.num_idle -= 1
+                self.evictions += 1
+
+        for fh in evicted:
+            no_except_close(fh)
+
+    def clear(self):
+        """Close all idle handles"""
+        with self.lock:
+            idle = self.idle
+            self.idle = OrderedDict()
+            self.num_idle = 0
+
+        for handles in idle.values():
+            for _, fh in handles:
+                no_except_close(fh)
+
+    def stats(self):
+        return dict(hits=self.hits,
+                    misses=self.misses,
+                    evictions=self.evictions,
+                    idle=self.num_idle,
+                    max_size=self.max_size)
+
+
+# ============================================================================
+class PooledFile(object):
+    """A file handle checked out from a FileHandlePool.
+    Closing the PooledFile returns the handle to the pool.
+    """
+    def __init__(self, pool, key, stat_sig, fh):
+        self.pool = pool
+        self.key = key
+        self.stat_sig = stat_sig
+        self.fh = fh
+        self.name = key[0]
+        self.closed = False
+
+        self.seek = fh.seek
+        self.tell = fh.tell
+        self.read = fh.read
+        self.readline = fh.readline
+
+    def readlines(self):
+        return self.fh.readlines()
+
+    def __iter__(self):
+        return iter(self.fh)
+
+    def close(self):
+        if self.closed:
+            return
+
+        self.closed = True
+        self.pool.release(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
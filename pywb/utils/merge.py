@@ -1,5 +1,9 @@
 import sys
 
+from bisect import bisect_left
+from heapq import heapify, heappop, heapreplace
+from itertools import islice
+
 if sys.version_info >= (3, 5):  #pragma: no cover
     from heapq import merge
 else:  #pragma: no cover
@@ -112,3 +116,85 @@ else:  #pragma: no cover
                 yield v
 
 
+
+
+def batch_merge(iterables, key=None, batch_size=64):
+    """Merge multiple sorted inputs into a single sorted output, as with
+    merge(), but comparing precomputed keys and yielding runs of values.
+
+    Values are read from each input in batches of up to *batch_size*, and
+    the key of each value is computed once. The input with the smallest
+    next key then yields all of its buffered values with keys less than
+    the next key of any other input, found by bisect, without a heap
+    operation per value.
+
+    If the next keys of two inputs are equal, the values themselves are
+    compared, as with merge(), and a single value is yielded.
+
+    Inputs are dropped as soon as exhausted, and once only one input
+    remains, its values are yielded directly.
+
+    >>> list(batch_merge([[1,3,5,7], [0,2,4,8], [5,10,15,20], [], [25]]))
+    [0, 1, 2, 3, 4, 5, 5, 7, 8, 10, 15, 20, 25]
+
+    >>> list(batch_merge([['dog', 'horse'], ['cat', 'fish', 'kangaroo']], key=len))
+    ['cat', 'dog', 'fish', 'horse', 'kangaroo']
+    """
+    h = []
+
+    def read_batch(it):
+        values = list(islice(it, batch_size))
+        if key is None:
+            return values, values
+
+        return [key(value) for value in values], values
+
+    for order, it in enumerate(map(iter, iterables)):
+        keys, values = read_batch(it)
+        if values:
+            h.append([keys[0], values[0], order, keys, values, 0, it])
+
+    heapify(h)
+
+    while len(h) > 1:
+        s = h[0]
+        keys, values, pos, it = s[3:]
+
+        # smallest key of the other inputs
+        next_key = h[1][0]
+        if len(h) > 2 and h[2][0] < next_key:
+            next_key = h[2][0]
+
+        end = pos + 1
+
+        # single value, or same key as another input (head value is smallest)
+        if end == len(keys) or keys[end] >= next_key:
+            yield values[pos]
+
+        else:
+            end = bisect_left(keys, next_key, end + 1)
+            for value in values[pos:end]:
+                yield value
+
+        if end == len(values):
+            keys, values = read_batch(it)
+            if not values:
+                heappop(h)
+                continue
+
+            s[3] = keys
+            s[4] = values
+            end = 0
+
+        s[0] = keys[end]
+        s[1] = values[end]
+        s[5] = end
+        heapreplace(h, s)
+
+    if h:
+        values, pos, it = h[0][4:]
+        for value in values[pos:]:
+            yield value
+
+        for value in it:
+            yield value
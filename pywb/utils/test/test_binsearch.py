@@ -76,7 +76,9 @@ org,iana)/time-zones 20140126200737 http://www.iana.org/time-zones text/html 200
 
 #=================================================================
 import os
-from pywb.utils.binsearch import iter_prefix, iter_exact, iter_range
+import shutil
+from pywb.utils.binsearch import iter_prefix, iter_exact, iter_range, BlockIndex
+from pywb.utils.binsearch import search_offset, iter_lines_reverse, TimestampIndex
 from pywb.utils.merge import merge
 
 from pywb import get_test_dir
@@ -110,6 +112,141 @@ def test_rev_merge():
             list(merge(reversed(lines1), reversed(lines2), reverse=True)))
 
 
+def test_block_index_range(tmpdir):
+    filename = str(tmpdir.join('iana.cdx'))
+    shutil.copy(test_cdx_dir + 'iana.cdx', filename)
+
+    block_index = BlockIndex.load_for_file(filename, block_size=512, key_len=24)
+    assert len(block_index.keys) > 20
+
+    with open(filename, 'rb') as cdx:
+        lines = [line.rstrip() for line in cdx]
+
+    keys = [b'a)/', b'org,iana)/', b'org,iana)/about', b'org,iana)/domains/root',
+            b'org,iana)/_css/2013.1/fonts/opensans-bold.ttf', b'org,iana)/time-zones', b'z)/']
+
+    for key in keys:
+        end_key = key + b'~'
+        expected = [line for line in lines if key <= line < end_key]
+        with open(filename, 'rb') as cdx:
+            assert list(iter_range(cdx, key, end_key, block_index=block_index)) == expected
+
+
+def test_block_index_persist(tmpdir):
+    filename = str(tmpdir.join('iana.cdx'))
+    shutil.copy(test_cdx_dir + 'iana.cdx', filename)
+
+    block_index = BlockIndex.load_for_file(filename, block_size=1024)
+    assert os.path.isfile(filename + BlockIndex.EXT)
+
+    # clear memory cache, load from persisted file
+    BlockIndex._cache.clear()
+    loaded = BlockIndex.load_for_file(filename, block_size=1024)
+    assert loaded.keys == block_index.keys
+    assert loaded.offsets == block_index.offsets
+
+    # modify file, index is rebuilt
+    with open(filename, 'ab') as fh:
+        fh.write(b'zz)/ 20140126200624 http://zz/ text/html 200 AAAA - - 1 1 zz.warc.gz\n')
+
+    os.utime(filename, ns=(0, 0))
+
+    rebuilt = BlockIndex.load_for_file(filename, block_size=1024)
+    assert rebuilt.stat_sig != block_index.stat_sig
+
+    with open(filename, 'rb') as cdx:
+        assert len(list(iter_range(cdx, b'zz)/', b'zz)/!', block_index=rebuilt))) == 1
+
+
+def test_search_offset_and_reverse(tmpdir):
+    filename = str(tmpdir.join('iana.cdx'))
+    shutil.copy(test_cdx_dir + 'iana.cdx', filename)
+
+    with open(filename, 'rb') as cdx:
+        lines = [line.rstrip() for line in cdx]
+
+    block_index = BlockIndex.load_for_file(filename, block_size=512)
+
+    keys = [b'a)/', b'org,iana)/', b'org,iana)/about 20140126200706',
+            b'org,iana)/_css/2013.1/fonts/opensans-bold.ttf 20140126200900', b'z)/']
+
+    for key in keys:
+        before = [line for line in lines if line < key]
+
+        for kwargs in (dict(block_size=256), dict(block_index=block_index)):
+            with open(filename, 'rb') as cdx:
+                offset = search_offset(cdx, key, **kwargs)
+                cdx.seek(offset)
+                assert cdx.readline().rstrip() == (lines[len(before)] if len(before) < len(lines) else b'')
+
+                # small blocks, lines span multiple reads
+                assert list(iter_lines_reverse(cdx, offset, block_size=100)) == before[::-1]
+
+
+def test_search_offset_min_offset(tmpdir):
+    filename = str(tmpdir.join('iana.cdx'))
+    shutil.copy(test_cdx_dir + 'iana.cdx', filename)
+
+    with open(filename, 'rb') as cdx:
+        lines = [line.rstrip() for line in cdx]
+
+    # sorted keys, some repeated, each searched from the offset of the previous
+    keys = sorted([b'a)/', b'org,iana)/', b'org,iana)/', b'org,iana)/about', b'org,iana)/time-zones', b'z)/'] +
+                  [line.split(b' ')[0] for line in lines[::7]])
+
+    for block_size in (64, 256, 8192):
+        min_offset = 0
+        for key in keys:
+            with open(filename, 'rb') as cdx:
+                expected = search_offset(cdx, key, block_size=block_size)
+                min_offset = search_offset(cdx, key, block_size=block_size, min_offset=min_offset)
+
+            assert min_offset == expected
+
+
+def write_many_captures(filename):
+    lines = [b'com,example)/ 20140101000000 {}']
+    lines += [b'com,example)/many 2014%02d%02d%02d0000 {"n": "%d"}' % (d // 100 % 28 + 1, d // 10 % 10, d % 10, d)
+              for d in range(2500)]
+    lines += [b'com,example)/other 20140102000000 {}']
+
+    lines.sort()
+    with open(filename, 'wb') as fh:
+        fh.write(b'\n'.join(lines) + b'\n')
+
+    return lines
+
+
+def test_timestamp_index(tmpdir):
+    filename = str(tmpdir.join('many.cdxj'))
+    lines = write_many_captures(filename)
+
+    ts_index = TimestampIndex.load_for_file(filename, min_captures=1000, interval=50)
+    assert list(ts_index.entries.keys()) == [b'com,example)/many']
+    assert len(ts_index.entries[b'com,example)/many'][0]) == 50
+
+    assert ts_index.find_offset(b'com,example)/other 2014') is None
+
+    keys = [b'com,example)/many', b'com,example)/many 2014', b'com,example)/many 20140115',
+            b'com,example)/many 20140115050000', b'com,example)/many 2015', b'com,example)/many 2013']
+
+    for key in keys:
+        end_key = b'com,example)/many!'
+        expected = [line for line in lines if key <= line < end_key]
+        with open(filename, 'rb') as cdx:
+            assert list(iter_range(cdx, key, end_key, ts_index=ts_index)) == expected
+
+            offset = search_offset(cdx, key, ts_index=ts_index)
+            assert offset == search_offset(cdx, key)
+
+    # persisted, reloaded if unchanged
+    TimestampIndex._cache.clear()
+    loaded = TimestampIndex.load_for_file(filename, min_captures=1000, interval=50)
+    assert loaded.entries == ts_index.entries
+
+    # different settings, rebuilt
+    assert TimestampIndex.load_for_file(filename, min_captures=5000, interval=50).entries == {}
+
 
 if __name__ == "__main__":
     import doctest
@@ -0,0 +1,41 @@
+from pywb.utils.cache import LRUCache
+
+
+# ============================================================================
+def test_lru_count():
+    cache = LRUCache(2)
+    cache.put('a', 1)
+    cache.put('b', 2)
+    assert cache.get('a') == 1
+
+    # 'b' least recently used
+    cache.put('c', 3)
+    assert cache.get('b') is None
+    assert cache.get('a') == 1
+    assert cache.get('c') == 3
+
+    assert cache.stats() == dict(hits=3, misses=1, evictions=1,
+                                 entries=2, size=2, max_size=2)
+
+
+def test_lru_byte_budget():
+    cache = LRUCache(10, sizeof=len)
+    cache.put('a', b'12345')
+    cache.put('b', b'1234')
+    assert cache.size == 9
+
+    # too large, never cached
+    cache.put('c', b'12345678901')
+    assert 'c' not in cache
+
+    cache.put('d', b'123')
+    assert 'a' not in cache
+    assert cache.size == 7
+
+    # replace existing
+    cache.put('d', b'1')
+    assert cache.size == 5
+
+    cache.resize(2)
+    assert len(cache) == 1
+    assert cache.get('d') == b'1'
@@ -0,0 +1,104 @@
+import os
+
+from pywb.utils.io import FileHandlePool, MMapReader
+
+
+# ============================================================================
+def write_file(tmpdir, name, data):
+    filename = str(tmpdir.join(name))
+    with open(filename, 'wb') as fh:
+        fh.write(data)
+    return filename
+
+
+def test_handle_pool_reuse(tmpdir):
+    filename = write_file(tmpdir, 'a.cdxj', b'a 1\nb 2\n')
+    pool = FileHandlePool(max_size=4)
+
+    with pool.acquire(filename) as fh:
+        assert fh.readline() == b'a 1\n'
+        first = fh.fh
+
+    # exclusive checkout: second acquire while first in use opens new handle
+    fh1 = pool.acquire(filename)
+    fh2 = pool.acquire(filename)
+    assert fh1.fh is first
+    assert fh2.fh is not first
+
+    fh1.close()
+    fh2.close()
+    # double close is ignored
+    fh2.close()
+
+    assert pool.stats()['hits'] == 1
+    assert pool.stats()['misses'] == 2
+    assert pool.stats()['idle'] == 2
+
+
+def test_handle_pool_file_changed(tmpdir):
+    filename = write_file(tmpdir, 'a.cdxj', b'a 1\n')
+    pool = FileHandlePool()
+
+    with pool.acquire(filename) as fh:
+        first = fh.fh
+
+    write_file(tmpdir, 'a.cdxj.new', b'b 2\n')
+    os.replace(filename + '.new', filename)
+
+    with pool.acquire(filename) as fh:
+        assert fh.fh is not first
+        assert fh.readline() == b'b 2\n'
+
+    assert first.closed
+    assert pool.stats()['hits'] == 0
+
+
+def test_handle_pool_closed_not_reused(tmpdir):
+    filename = write_file(tmpdir, 'a.cdxj', b'a 1\n')
+    pool = FileHandlePool()
+
+    with pool.acquire(filename) as fh:
+        first = fh.fh
+
+    first.close()
+
+    with pool.acquire(filename) as fh:
+        assert fh.fh is not first
+        assert fh.readline() == b'a 1\n'
+
+    assert pool.stats()['hits'] == 0
+
+
+def test_handle_pool_evict(tmpdir):
+    pool = FileHandlePool(max_size=2)
+
+    handles = []
+    for name in ('a', 'b', 'c'):
+        filename = write_file(tmpdir, name, b'x\n')
+        handles.append(pool.acquire(filename))
+
+    for fh in handles:
+        fh.close()
+
+    assert handles[0].fh.closed
+    assert not handles[2].fh.closed
+    assert pool.stats()['evictions'] == 1
+    assert pool.stats()['idle'] == 2
+
+    pool.clear()
+    assert handles[2].fh.closed
+
+
+def test_handle_pool_mmap(tmpdir):
+    filename = write_file(tmpdir, 'a.cdxj', b'a 1\nb 2\n')
+    empty = write_file(tmpdir, 'empty.cdxj', b'')
+
+    pool = FileHandlePool()
+    with pool.acquire(filename, MMapReader.open, 'mmap') as fh:
+        assert isinstance(fh.fh, MMapReader)
+        fh.seek(4)
+        assert fh.readline() == b'b 2\n'
+        assert fh.readline() == b''
+
+    with pool.acquire(empty, MMapReader.open, 'mmap') as fh:
+        assert fh.readline() == b''
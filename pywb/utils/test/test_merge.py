@@ -0,0 +1,40 @@
+from pywb.utils.merge import batch_merge, merge
+from pywb.warcserver.index.cdxobject import CDXObject
+
+import random
+import pytest
+
+
+# ============================================================================
+@pytest.mark.parametrize('batch_size', [1, 2, 64])
+def test_batch_merge_random(batch_size):
+    rand = random.Random(1234)
+
+    for x in range(50):
+        lists = [sorted(rand.randint(0, 100) for y in range(rand.randint(0, 50)))
+                 for i in range(rand.randint(0, 10))]
+
+        res = list(batch_merge(lists, batch_size=batch_size))
+        assert res == sorted(sum(lists, []))
+        assert res == list(merge(*lists))
+
+
+def test_batch_merge_key_ties():
+    a = [(1, 'b'), (2, 'a'), (2, 'c')]
+    b = [(0, 'z'), (2, 'b'), (3, 'a')]
+
+    # equal keys ordered by value
+    res = list(batch_merge([a, b], key=lambda x: x[0], batch_size=2))
+    assert res == [(0, 'z'), (1, 'b'), (2, 'a'), (2, 'b'), (2, 'c'), (3, 'a')]
+
+
+def test_batch_merge_cdx():
+    def make_cdx(urlkey, ts, source):
+        return CDXObject('{0} {1} {{"url": "http://{2}/", "source": "{2}"}}'.format(urlkey, ts, source).encode('utf-8'))
+
+    a = [make_cdx('com,example)/', '2015', 'a'), make_cdx('com,example)/', '2016', 'b')]
+    b = [make_cdx('com,example)/', '2016', 'a'), make_cdx('com,example)/a', '2014', 'a')]
+
+    res = list(batch_merge([a, b], key=lambda cdx: cdx['urlkey'] + ' ' + cdx['timestamp']))
+    assert res == list(merge(a, b))
+    assert [(cdx['timestamp'], cdx['source']) for cdx in res] == [('2015', 'a'), ('2016', 'a'), ('2016', 'b'), ('2014', 'a')]
@@ -1,15 +1,21 @@
 from pywb.warcserver.index.indexsource import FileIndexSource
 from pywb.warcserver.index.aggregator import DirectoryIndexSource, CacheDirectoryMixin
-from pywb.warcserver.index.aggregator import SimpleAggregator
+from pywb.warcserver.index.aggregator import SimpleAggregator, BaseAggregator
 from pywb.warcserver.index.cdxobject import CDXObject
 
 from pywb.utils.binsearch import search
+from pywb.utils.canonicalize import calc_search_range
+from pywb.utils.format import ParamFormatter, res_template
 from pywb.utils.merge import merge
 
 from warcio.timeutils import timestamp_to_datetime
 from datetime import datetime, timezone
 from dateutil.relativedelta import relativedelta
+from array import array
+from io import BytesIO
+import mmap
 import os
+import time
 
 
 # ============================================================================
@@ -75,6 +81,446 @@ class CacheDirectoryAccessSource(CacheDirectoryMixin, DirectoryAccessSource):
     """An cache directory index source specific to access control"""
 
 
+# ============================================================================
+class CompiledAccessRules(object):
+    """The access control rules of an access control list, compiled
+    into in-memory tables of exact, SURT prefix and match-any ('*,')
+    rules, each mapping the rule key to the rules per user.
+
+    Prefix rules are looked up by slicing the url key to each distinct
+    prefix rule length, from longest to shortest, so that finding the rule
+    for a url requires no search of the access control list.
+
+    Rules are cached per file and reloaded when the size or modification
+    time of the file, or of its binary snapshot, changes. If the file has
+    an up-to-date snapshot (see AccessRulesSnapshot), the snapshot is used
+    instead of compiling the rules in memory.
+    """
+
+    ANY_KEY = b'*,'  # type: bytes
+
+    _cache = {}  # type: dict
+
+    def __init__(self, stat_sig=None):
+        """Initialize a new, empty CompiledAccessRules
+
+        :param tuple stat_sig: The stat signature of the compiled file
+        """
+        self.exact_rules = {}
+        self.prefix_rules = {}
+        self.any_rules = {}
+        self.prefix_lens = []
+        self.stat_sig = stat_sig
+
+    @staticmethod
+    def _stat_sig(filename):
+        stat = os.stat(filename)
+        return (stat.st_size, stat.st_mtime_ns)
+
+    @classmethod
+    def load_for_file(cls, filename):
+        """Return the compiled rules or mapped snapshot for the supplied
+        access control file, using the cached copy if neither the file
+        nor its snapshot has changed
+
+        :param str filename: The access control file name
+        :return: The compiled rules or snapshot
+        :rtype: CompiledAccessRules|AccessRulesSnapshot
+        :raises OSError: Indicates the access control file could not be read
+        """
+        file_sig = cls._stat_sig(filename)
+        try:
+            snapshot_sig = cls._stat_sig(filename + AccessRulesSnapshot.EXT)
+        except OSError:
+            snapshot_sig = None
+
+        stat_sig = (file_sig, snapshot_sig)
+
+        rules = cls._cache.get(filename)
+        if rules and rules.stat_sig == stat_sig:
+            return rules
+
+        rules = None
+        if snapshot_sig:
+            rules = AccessRulesSnapshot.open(filename + AccessRulesSnapshot.EXT, file_sig)
+
+        if not rules:
+            with open(filename, 'rb') as fh:
+                rules = cls.compile(fh)
+
+        rules.stat_sig = stat_sig
+
+        cls._cache[filename] = rules
+        return rules
+
+    @classmethod
+    def compile(cls, lines):
+        """Return the compiled rules of the supplied access control list lines
+
+        :param lines: An iterable of the access control list lines
+        :return: The compiled rules
+        :rtype: CompiledAccessRules
+        """
+        rules = cls()
+
+        # same precedence as the reverse merge of the access control lists:
+        # for duplicate key and user, the greater line applies
+        for line in sorted((line.rstrip(b'\r\n') for line in lines), reverse=True):
+            rules.add_rule(line)
+
+        rules.prefix_lens.sort(reverse=True)
+        return rules
+
+    def add_rule(self, line):
+        """Adds the rule of an access control list line, unless a rule
+        for the same key and user has already been added
+
+        :param bytes line: The access control list line
+        """
+        # skip empty/invalid lines
+        if not line:
+            return
+
+        acl_key = line.split(b' ')[0]
+
+        if acl_key == self.ANY_KEY:
+            table = self.any_rules
+
+        elif acl_key.endswith(AccessChecker.EXACT_SUFFIX_B):
+            acl_key = acl_key[:-len(AccessChecker.EXACT_SUFFIX_B)]
+            table = self.exact_rules.setdefault(acl_key, {})
+
+        else:
+            if acl_key not in self.prefix_rules:
+                self.prefix_rules[acl_key] = {}
+                if len(acl_key) not in self.prefix_lens:
+                    self.prefix_lens.append(len(acl_key))
+
+            table = self.prefix_rules[acl_key]
+
+        acl_obj = CDXObject(line)
+        table.setdefault(acl_obj.get('user') or None, (line, acl_obj))
+
+    def find_rule(self, key, acl_user=None):
+        """Returns the most specific rule for the supplied url key:
+        an exact rule, the rule of the longest matching prefix or the
+        match-any rule, preferring rules for the supplied user over rules
+        for all users. Keys with only rules for other users are skipped.
+
+        The rule is returned with its rank, for selecting the most
+        specific rule of several access control lists
+
+        :param bytes key: The url key
+        :param str|None acl_user: The access control user, if any
+        :return: The (rank, rule) of the matching rule, if any
+        :rtype: tuple|None
+        """
+        match = self._select(self.exact_rules.get(key), acl_user)
+        if match:
+            return ranked_rule(2, len(key), match)
+
+        key_len = len(key)
+        for prefix_len in self.prefix_lens:
+            if prefix_len > key_len:
+                continue
+
+            match = self._select(self.prefix_rules.get(key[:prefix_len]), acl_user)
+            if match:
+                return ranked_rule(1, prefix_len, match)
+
+        match = self._select(self.any_rules, acl_user)
+        if match:
+            return ranked_rule(0, 0, match)
+
+        return None
+
+    @staticmethod
+    def _select(rules, acl_user):
+        if not rules:
+            return None
+
+        match = rules.get(acl_user)
+        if match is None:
+            match = rules.get(None)
+
+        return match
+
+
+# ============================================================================
+def ranked_rule(kind, key_len, match):
+    """Returns a matched rule with its rank: exact rules (kind 2) rank above
+    prefix rules (kind 1), which rank above match-any rules (kind 0),
+    longer keys rank above shorter ones and rules for a specific user
+    rank above rules for all users. Otherwise, as for the reverse merge
+    of the access control lists, the greater line ranks higher.
+
+    :param int kind: The kind of rule
+    :param int key_len: The length of the rule key
+    :param tuple match: The (line, rule) of the matched rule
+    :return: The (rank, rule) of the matched rule
+    :rtype: tuple
+    """
+    line, rule = match
+    return (kind, key_len, bool(rule.get('user')), line), rule
+
+
+# ============================================================================
+class AccessRulesSnapshot(object):
+    """A sorted binary snapshot of an access control list, written next
+    to the list with the '.aclb' extension by 'wb-manager acl compile'.
+
+    The snapshot is memory-mapped read-only, so that the rules are shared
+    through the OS page cache by all worker processes, instead of each
+    worker compiling its own copy of a large list. Rules are found by
+    binary search of the mapped key tables and only the lines of the
+    matched key are parsed.
+
+    The snapshot consists of a text header line, followed by:
+
+    - the rule lines of the prefix keys and then of the exact keys
+      (with the '###' suffix), grouped by key in ascending key order,
+      with the rules of each key in descending order
+    - the offsets of the first line of each prefix key, and the end offset
+    - for each prefix key, the index of its longest prefix key, or -1
+    - the offsets of the first line of each exact key, and the end offset
+
+    The header records the size and mtime of the access control list
+    the snapshot was compiled from, and the snapshot is not used if the
+    list has since changed.
+    """
+
+    EXT = '.aclb'  # type: str
+    HEADER = b'#pywb-aclb'  # type: bytes
+    VERSION = 1  # type: int
+
+    ANY_KEY = CompiledAccessRules.ANY_KEY
+
+    def __init__(self, mm, prefix_offsets, parents, exact_offsets, stat_sig=None):
+        self.mmap = mm
+        self.prefix_offsets = prefix_offsets
+        self.parents = parents
+        self.exact_offsets = exact_offsets
+        self.stat_sig = stat_sig
+
+    @classmethod
+    def open(cls, snapshot_filename, file_sig):
+        """Map the snapshot, if it was compiled from the current version
+        of the access control list, otherwise return None
+
+        :param str snapshot_filename: The snapshot file name
+        :param tuple file_sig: The (size, mtime) of the access control list
+        :return: The mapped snapshot or None
+        :rtype: AccessRulesSnapshot|None
+        """
+        try:
+            with open(snapshot_filename, 'rb') as fh:
+                header = fh.readline().split(b' ')
+                mm = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+        except (IOError, OSError, ValueError):
+            return None
+
+        try:
+            if (header[0] != cls.HEADER or
+                (int(header[1]), int(header[2]), int(header[3])) != (cls.VERSION,) + tuple(file_sig)):
+                mm.close()
+                return None
+
+            num_prefix, num_exact, tables_offset = (int(v) for v in header[4:7])
+        except (ValueError, IndexError):
+            mm.close()
+            return None
+
+        tables = memoryview(mm)[tables_offset:].cast('q')
+
+        prefix_offsets = tables[:num_prefix + 1]
+        parents = tables[num_prefix + 1:num_prefix * 2 + 1]
+        exact_offsets = tables[num_prefix * 2 + 1:num_prefix * 2 + num_exact + 2]
+
+        return cls(mm, prefix_offsets, parents, exact_offsets)
+
+    @classmethod
+    def compile(cls, filename):
+        """Compile the snapshot of an access control list, atomically
+        replacing any existing snapshot
+
+        :param str filename: The access control file name
+        :return: The snapshot file name
+        :rtype: str
+        """
+        with open(filename, 'rb') as fh:
+            file_sig = CompiledAccessRules._stat_sig(filename)
+            lines = [line.rstrip(b'\r\n') for line in fh]
+
+        snapshot_filename = filename + cls.EXT
+        cls.write(snapshot_filename, lines, file_sig)
+        return snapshot_filename
+
+    @classmethod
+    def write(cls, snapshot_filename, lines, file_sig):
+        """Write the snapshot of the supplied access control list lines
+        to a temporary file, then move it in place of any existing snapshot,
+        so that workers mapping the previous snapshot are not affected
+
+        :param str snapshot_filename: The snapshot file name
+        :param list[bytes] lines: The access control list lines
+        :param tuple file_sig: The (size, mtime) of the access control list
+        """
+        prefix_keys = {}
+        exact_keys = {}
+
+        for line in sorted(lines, reverse=True):
+            # skip empty/invalid lines
+            if not line:
+                continue
+
+            acl_key = line.split(b' ')[0]
+            if acl_key.endswith(AccessChecker.EXACT_SUFFIX_B):
+                exact_keys.setdefault(acl_key, []).append(line)
+            else:
+                prefix_keys.setdefault(acl_key, []).append(line)
+
+        prefix_sorted = sorted(prefix_keys)
+        exact_sorted = sorted(exact_keys)
+
+        # the parent of each prefix key is the closest preceding key
+        # which is a prefix of it
+        parents = []
+        stack = []
+        for i, acl_key in enumerate(prefix_sorted):
+            while stack and not acl_key.startswith(prefix_sorted[stack[-1]]):
+                stack.pop()
+
+            parents.append(stack[-1] if stack else -1)
+            stack.append(i)
+
+        data = BytesIO()
+        prefix_offsets = array('q')
+        exact_offsets = array('q')
+
+        for sorted_keys, key_lines, offsets in ((prefix_sorted, prefix_keys, prefix_offsets),
+                                                (exact_sorted, exact_keys, exact_offsets)):
+            for acl_key in sorted_keys:
+                offsets.append(data.tell())
+                for line in key_lines[acl_key]:
+                    data.write(line + b'\n')
+
+            offsets.append(data.tell())
+
+        header = b'%s %d %d %d %d %d ' % (cls.HEADER, cls.VERSION, file_sig[0], file_sig[1],
+                                           len(prefix_sorted), len(exact_sorted))
+
+        # header is padded so that the tables are aligned
+        data_offset = len(header) + 32
+        tables_offset = data_offset + data.tell()
+        tables_offset += -tables_offset % 8
+
+        header += b'%d' % tables_offset
+        header += b' ' * (data_offset - len(header) - 1) + b'\n'
+
+        for offsets in (prefix_offsets, exact_offsets):
+            for i in range(len(offsets)):
+                offsets[i] += data_offset
+
+        tmp_filename = snapshot_filename + '.tmp.' + str(os.getpid())
+        try:
+            with open(tmp_filename, 'wb') as fh:
+                fh.write(header)
+                fh.write(data.getvalue())
+                fh.write(b'\n' * (tables_offset - fh.tell()))
+                fh.write(prefix_offsets.tobytes())
+                fh.write(array('q', parents).tobytes())
+                fh.write(exact_offsets.tobytes())
+
+            os.replace(tmp_filename, snapshot_filename)
+        except (IOError, OSError):
+            try:
+                os.remove(tmp_filename)
+            except OSError:
+                pass
+
+            raise
+
+    def close(self):
+        for offsets in (self.prefix_offsets, self.parents, self.exact_offsets):
+            offsets.release()
+
+        self.mmap.close()
+
+    def _get_key(self, offsets, i):
+        start = offsets[i]
+        end = self.mmap.find(b' ', start, offsets[i + 1])
+        if end < 0:
+            end = offsets[i + 1] - 1
+
+        return self.mmap[start:end]
+
+    def _search(self, offsets, key):
+        """Return the index of the last key <= the supplied key, or -1"""
+        lo = 0
+        hi = len(offsets) - 1
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if key < self._get_key(offsets, mid):
+                hi = mid
+            else:
+                lo = mid + 1
+
+        return lo - 1
+
+    def _select(self, offsets, i, acl_user):
+        lines = self.mmap[offsets[i]:offsets[i + 1]].split(b'\n')
+
+        no_user_match = None
+        for line in lines:
+            if not line:
+                continue
+
+            acl_obj = CDXObject(line)
+            user = acl_obj.get('user') or None
+            if user == acl_user:
+                return line, acl_obj
+
+            if not user and not no_user_match:
+                no_user_match = (line, acl_obj)
+
+        return no_user_match
+
+    def find_rule(self, key, acl_user=None):
+        """Returns the most specific rule for the supplied url key, with the
+        same precedence as CompiledAccessRules.find_rule()
+
+        :param bytes key: The url key
+        :param str|None acl_user: The access control user, if any
+        :return: The (rank, rule) of the matching rule, if any
+        :rtype: tuple|None
+        """
+        exact_key = key + AccessChecker.EXACT_SUFFIX_B
+        i = self._search(self.exact_offsets, exact_key)
+        if i >= 0 and self._get_key(self.exact_offsets, i) == exact_key:
+            match = self._select(self.exact_offsets, i, acl_user)
+            if match:
+                return ranked_rule(2, len(key), match)
+
+        # all prefix keys of the key are ancestors of the last key <= key
+        i = self._search(self.prefix_offsets, key)
+        while i >= 0:
+            acl_key = self._get_key(self.prefix_offsets, i)
+            if key.startswith(acl_key) and acl_key != self.ANY_KEY:
+                match = self._select(self.prefix_offsets, i, acl_user)
+                if match:
+                    return ranked_rule(1, len(acl_key), match)
+
+            i = self.parents[i]
+
+        i = self._search(self.prefix_offsets, self.ANY_KEY)
+        if i >= 0 and self._get_key(self.prefix_offsets, i) == self.ANY_KEY:
+            match = self._select(self.prefix_offsets, i, acl_user)
+            if match:
+                return ranked_rule(0, 0, match)
+
+        return None
+
+
 # ============================================================================
 class AccessChecker(object):
     """An access checker class"""
@@ -87,12 +533,19 @@ class AccessChecker(object):
     # another '#' (U+0023 > U+0020)
     EXACT_SUFFIX_SEARCH_B = b'####'  # type: bytes
 
-    def __init__(self, access_source, default_access='allow', embargo=None):
+    # how often, in seconds, the access control files of a collection
+    # are listed and checked for changes
+    RULES_CHECK_INTERVAL = 5  # type: int
+
+    def __init__(self, access_source, default_access='allow', embargo=None,
+                 check_interval=RULES_CHECK_INTERVAL):
         """Initialize a new AccessChecker
 
         :param str|list[str]|AccessRulesAggregator access_source: An access source
         :param str default_access: The default access action (allow)
         :param dict embargo: A dict specifying optional embargo setting
+        :param int check_interval: How often, in seconds, to check the
+        access control files for changes (0 to check on every lookup)
         """
         if isinstance(access_source, str):
             self.aggregator = self.create_access_aggregator([access_source])
@@ -109,6 +562,11 @@ class AccessChecker(object):
 
         self.embargo = self.parse_embargo(embargo)
 
+        self.check_interval = check_interval
+
+        # collection -> (last check time, compiled rules list or None)
+        self.rules_cache = {}
+
     def parse_embargo(self, embargo):
         if not embargo:
             return None
@@ -143,35 +601,65 @@ class AccessChecker(object):
 
         return embargo
 
-    def check_embargo(self, url, ts):
+    def get_embargo_cutoff(self):
+        """Returns the embargo as a (access, before, cutoff) tuple, with any
+        relative embargo period resolved against the current time, so that
+        the cutoff can be computed once per request
+
+        :return: The embargo access, True if captures before the cutoff
+        are embargoed, or False if captures after, and the cutoff datetime,
+        or None if there is no embargo
+        :rtype: tuple|None
+        """
         if not self.embargo:
             return None
 
-        dt = timestamp_to_datetime(ts, tz_aware=True)
         access = self.embargo.get('access', 'exclude')
 
         # embargo before
         before = self.embargo.get('before')
         if before:
-            print(dt, before)
-            return access if dt < before else None
+            return access, True, before
 
         # embargo after
         after = self.embargo.get('after')
         if after:
-            return access if dt > after else None
+            return access, False, after
 
-        # embargo if newser than
+        # embargo if newer than
         newer = self.embargo.get('newer')
         if newer:
-            actual = datetime.now(timezone.utc) - newer
-            return access if actual < dt else None
+            return access, False, datetime.now(timezone.utc) - newer
 
         # embargo if older than
         older = self.embargo.get('older')
         if older:
-            actual = datetime.now(timezone.utc) - older
-            return access if actual > dt else None
+            return access, True, datetime.now(timezone.utc) - older
+
+        return None
+
+    def check_embargo(self, url, ts, embargo_cutoff=None):
+        """Returns the embargo access for a capture, if embargoed
+
+        :param str url: The URL of the capture
+        :param str ts: The timestamp of the capture
+        :param tuple embargo_cutoff: The embargo cutoff from get_embargo_cutoff(),
+        if already computed
+        :return: The embargo access or None
+        :rtype: str|None
+        """
+        embargo_cutoff = embargo_cutoff or self.get_embargo_cutoff()
+        if not embargo_cutoff:
+            return None
+
+        access, before, cutoff = embargo_cutoff
+
+        dt = timestamp_to_datetime(ts, tz_aware=True)
+
+        if before:
+            return access if dt < cutoff else None
+        else:
+            return access if dt > cutoff else None
 
     def check_date_access(
         self, ts, access, default_access, rule
@@ -260,6 +748,111 @@ class AccessChecker(object):
         """Attempts to find the access control rule for the
         supplied URL otherwise returns the default rule
 
+        Rules are looked up in the compiled rules of the access control
+        files, falling back to querying the access source if it includes
+        any sources which are not access control files
+
+        :param str url: The URL for the rule to be found
+        :param str|None ts: A timestamp (not used)
+        :param str|None urlkey: The access control url key
+        :param str|None collection: The collection, if any
+        :param str|None acl_user: The access control user, if any
+        :return: The access control rule for the supplied URL
+        if one exists otherwise the default rule
+        :rtype: CDXObject
+        """
+        rules_list = self.get_compiled_rules(collection)
+        if rules_list is not None:
+            key = calc_search_range(url, 'exact')[0].encode('utf-8')
+
+            # most specific rule of all the access control lists
+            best = None
+            for rules in rules_list:
+                res = rules.find_rule(key, acl_user)
+                if res and (not best or res[0] > best[0]):
+                    best = res
+
+            return best[1] if best else self.default_rule
+
+        return self.query_access_rule(url, ts, urlkey, collection, acl_user)
+
+    def get_compiled_rules(self, collection=None):
+        """Returns the compiled rules of each access control file of the
+        collection, or None if the access source can not be compiled.
+
+        The access control files are listed and checked for changes at
+        most every check_interval seconds
+
+        :param str|None collection: The collection, if any
+        :return: The list of compiled rules or snapshots, or None
+        :rtype: list|None
+        """
+        now = time.time()
+        cached = self.rules_cache.get(collection)
+        if cached and now - cached[0] < self.check_interval:
+            return cached[1]
+
+        rules_list = None
+
+        rule_files = self.get_rule_files(self.aggregator, collection)
+        if rule_files is not None:
+            try:
+                rules_list = [CompiledAccessRules.load_for_file(filename)
+                              for filename in sorted(set(rule_files))]
+            except OSError:
+                rules_list = None
+
+        self.rules_cache[collection] = (now, rules_list)
+        return rules_list
+
+    def get_rule_files(self, source, collection=None):
+        """Returns the access control files of the supplied source,
+        including the files of nested aggregators, or None if any of
+        the sources is not an access control file
+
+        :param source: An access source
+        :param str|None collection: The collection, if any
+        :return: The list of access control file names or None
+        :rtype: list[str]|None
+        """
+        if isinstance(source, FileAccessIndexSource):
+            if '{url' in source.filename_template:
+                return None
+
+            params = {}
+            if collection:
+                params['param.coll'] = collection
+
+            return [res_template(source.filename_template, params)]
+
+        if not isinstance(source, BaseAggregator):
+            return None
+
+        params = {'nosource': 'true'}
+        if collection:
+            params['param.coll'] = collection
+
+        rule_files = []
+
+        try:
+            sources = list(source._iter_sources(params))
+        except Exception:
+            return None
+
+        for name, child in sources:
+            files = self.get_rule_files(child, collection)
+            if files is None:
+                return None
+
+            rule_files.extend(files)
+
+        return rule_files
+
+    def query_access_rule(self, url, ts=None, urlkey=None, collection=None, acl_user=None):
+        """Finds the access control rule for the supplied URL by querying
+        the access source, for sources which can not be compiled,
+        otherwise returns the default rule
+
         :param str url: The URL for the rule to be found
         :param str|None ts: A timestamp (not used)
         :param str|None urlkey: The access control url key
@@ -349,6 +942,14 @@ class AccessChecker(object):
         """
         default_access = self.default_rule['access']
 
+        embargo_cutoff = self.get_embargo_cutoff()
+
+        # the last rule found for this request, by (urlkey, source collection),
+        # as consecutive captures usually share the same urlkey
+        # (the acl_user is the same for all captures)
+        last_key = None
+        last_rule = None
+
         for cdx in cdx_iter:
             url = cdx.get('url')
             timestamp = cdx.get('timestamp')
@@ -362,13 +963,22 @@ class AccessChecker(object):
             access = None
 
             if self.aggregator:
-                rule = self.find_access_rule(
-                    url,
-                    timestamp,
-                    cdx.get('urlkey'),
-                    cdx.get('source-coll'),
-                    acl_user
-                )
+                urlkey = cdx.get('urlkey')
+                source_coll = cdx.get('source-coll')
+
+                rule_key = (urlkey or url, source_coll)
+                if rule_key == last_key:
+                    rule = last_rule
+                else:
+                    rule = self.find_access_rule(
+                        url,
+                        timestamp,
+                        urlkey,
+                        source_coll,
+                        acl_user
+                    )
+                    last_key = rule_key
+                    last_rule = rule
 
                 access = rule.get('access', 'exclude')
 
@@ -376,8 +986,8 @@ class AccessChecker(object):
                 timestamp, access, default_access, rule
             )
 
-            if access != 'allow_ignore_embargo' and access != 'exclude':
-                embargo_access = self.check_embargo(url, timestamp)
+            if embargo_cutoff and access != 'allow_ignore_embargo' and access != 'exclude':
+                embargo_access = self.check_embargo(url, timestamp, embargo_cutoff)
                 if embargo_access and embargo_access != 'allow':
                     access = embargo_access
 
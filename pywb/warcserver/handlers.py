@@ -4,11 +4,14 @@ from pywb.utils.memento import MementoUtils
 
 from warcio.recordloader import ArchiveLoadFailed
 
-from pywb.warcserver.index.cdxobject import CDXException
+from pywb.warcserver.index.cdxobject import CDXObject, CDXException
 from pywb.warcserver.index.fuzzymatcher import FuzzyMatcher
+from pywb.warcserver.index.query import CDXQuery
 from pywb.warcserver.resource.responseloader import  WARCPathLoader, LiveWebLoader, VideoLoader
 
 import six
+import itertools
+import json
 import logging
 import traceback
 
@@ -33,6 +36,24 @@ def to_link(cdx_iter, fields, params):
     content_type = 'application/link-format'
     return content_type, MementoUtils.make_timemap(cdx_iter, params)
 
+def iter_raw_chunks(line_iter, limit, chunk_size):
+    buff = []
+    size = 0
+    for line in itertools.islice(line_iter, limit):
+        if not line.endswith(b'\n'):
+            line += b'\n'
+
+        buff.append(line)
+        size += len(line)
+
+        if size >= chunk_size:
+            yield b''.join(buff)
+            buff = []
+            size = 0
+
+    if buff:
+        yield b''.join(buff)
+
 
 #=============================================================================
 class IndexHandler(object):
@@ -45,14 +66,25 @@ class IndexHandler(object):
 
     DEF_OUTPUT = 'cdxj'
 
+    # params which require processing of each cdx, and so disable raw output
+    RAW_SKIP_PARAMS = ('filter', 'fields', 'fl', 'closest', 'reverse', 'sort',
+                       'from', 'from_ts', 'to', 'collapseTime', 'resolveRevisits',
+                       'content_type', 'showNumPages', 'showPagedIndex', 'custom_ops')
+
+    RAW_CHUNK_SIZE = 65536
+
+    MAX_BATCH_QUERIES = 10000
+
     def __init__(self, index_source, opts=None, *args, **kwargs):
         self.index_source = index_source
         self.opts = opts or {}
-        self.fuzzy = FuzzyMatcher(kwargs.get('rules_file'))
+        self.fuzzy = FuzzyMatcher(kwargs.get('rules_file'),
+                                  kwargs.get('fuzzy_miss_cache_ttl'),
+                                  kwargs.get('fuzzy_miss_cache_size'))
         self.access_checker = kwargs.get('access_checker')
 
     def get_supported_modes(self):
-        return dict(modes=['list_sources', 'index'])
+        return dict(modes=['list_sources', 'index', 'batch'])
 
     def _load_index_source(self, params):
         url = params.get('url')
@@ -60,10 +92,11 @@ class IndexHandler(object):
             errs = dict(last_exc=BadRequestException('The "url" param is required'))
             return None, errs
 
-        input_req = params.get('_input_req')
-        if input_req:
-            params['alt_url'] = input_req.include_method_query(url)
+        self._set_alt_url(params)
 
+        return self._load_fuzzy_index(params)
+
+    def _load_fuzzy_index(self, params):
         cdx_iter = self.fuzzy(self.index_source, params)
 
         acl_user = params['_input_req'].env.get("HTTP_X_PYWB_ACL_USER")
@@ -73,12 +106,144 @@ class IndexHandler(object):
 
         return cdx_iter
 
+    def _set_alt_url(self, params):
+        input_req = params.get('_input_req')
+        if input_req:
+            params['alt_url'] = input_req.include_method_query(params['url'])
+
+    def _is_raw_query(self, params):
+        if self.access_checker or not params.get('url'):
+            return False
+
+        # source annotations are added to each cdx
+        if params.get('nosource') != 'true':
+            return False
+
+        return not any(name in params for name in self.RAW_SKIP_PARAMS)
+
+    def _load_raw_index(self, params):
+        """ Stream raw CDXJ lines from the index in large chunks, if
+        supported by the index source and no per-cdx processing is needed.
+
+        Returns None if raw loading not possible, or no lines are found,
+        so that the regular (eg. fuzzy match) lookup is used instead
+        """
+        raw_query = getattr(self.index_source, 'raw_query', None)
+        if not raw_query or not self._is_raw_query(params):
+            return None
+
+        self._set_alt_url(params)
+
+        try:
+            res = raw_query(params)
+            if not res:
+                return None
+
+            raw_iter, errs = res
+
+            limit = int(params.get('limit', 100000))
+            chunks = iter_raw_chunks(raw_iter, limit, self.RAW_CHUNK_SIZE)
+
+            first_chunk = next(chunks, None)
+
+        except WbException:
+            return None
+
+        if first_chunk is None:
+            return None
+
+        return itertools.chain([first_chunk], chunks), errs
+
+    def _parse_batch(self, params):
+        """ Parse the queries of a batch request from the POST body,
+        one per line, either a url or a json object of query params.
+
+        Returns a list of (urlkey, line number, params) for each query, combined
+        with the request query params, ordered by the urlkey of each query
+        """
+        input_req = params.get('_input_req')
+        body = input_req.get_req_body() if input_req else None
+        if not body:
+            raise BadRequestException('A POST body with one url or query per line is required')
+
+        base_params = dict((n, v) for n, v in six.iteritems(params)
+                           if n not in ('mode', 'url', 'alt_url'))
+
+        # offsets of the last search in each index file, shared by all queries
+        base_params['_search_offsets'] = {}
+
+        queries = []
+        for i, line in enumerate(body.read().decode('utf-8').split('\n')):
+            line = line.strip()
+            if not line:
+                continue
+
+            if len(queries) == self.MAX_BATCH_QUERIES:
+                msg = 'A batch may include at most {0} queries'
+                raise BadRequestException(msg.format(self.MAX_BATCH_QUERIES))
+
+            query_params = dict(base_params)
+            if line.startswith('{'):
+                try:
+                    query_params.update(json.loads(line))
+                except ValueError:
+                    raise BadRequestException('Invalid query on line {0}'.format(i))
+            else:
+                query_params['url'] = line
+
+            try:
+                key = CDXQuery(dict(query_params)).key
+            except Exception:
+                key = b''
+
+            queries.append((key, i, query_params))
+
+        queries.sort(key=lambda query: query[:2])
+        return queries
+
+    def _load_batch(self, params):
+        """ Resolve a batch of queries in urlkey order, so that each sorted
+        index is read in a single forward pass. The results of each query
+        are tagged with the line number of the query in the 'batch' field.
+
+        For a query that fails, a single cdx with an 'error' field is
+        returned instead, so that it can be told apart from a query
+        with no results
+        """
+        queries = self._parse_batch(params)
+
+        def iter_batch():
+            for key, i, query_params in queries:
+                try:
+                    if not query_params.get('url'):
+                        raise BadRequestException('The "url" param is required')
+
+                    cdx_iter, errs = self._load_fuzzy_index(query_params)
+
+                    for cdx in cdx_iter:
+                        cdx['batch'] = str(i)
+                        yield cdx
+
+                except WbException as wbe:
+                    yield self._batch_error(key, i, wbe)
+
+        return iter_batch(), {}
+
+    @staticmethod
+    def _batch_error(key, i, exc):
+        cdx = CDXObject()
+        cdx['urlkey'] = key.decode('utf-8') if key else '-'
+        cdx['timestamp'] = '-'
+        cdx['batch'] = str(i)
+        cdx['error'] = repr(exc)
+        return cdx
+
     def __call__(self, params):
         mode = params.get('mode', 'index')
         if mode == 'list_sources':
             return {}, self.index_source.get_source_list(params), {}
 
-        if mode != 'index':
+        if mode not in ('index', 'batch'):
             return {}, self.get_supported_modes(), {}
 
         output = params.get('output', self.DEF_OUTPUT)
@@ -94,9 +259,18 @@ class IndexHandler(object):
             errs = dict(last_exc=BadRequestException('output={0} not supported'.format(output)))
             return None, None, errs
 
+        if output == 'cdxj' and not fields and mode == 'index':
+            res = self._load_raw_index(params)
+            if res:
+                raw_iter, errs = res
+                return {'Content-Type': 'text/x-cdxj'}, raw_iter, errs
+
         cdx_iter = None
         try:
-            cdx_iter, errs = self._load_index_source(params)
+            if mode == 'batch':
+                cdx_iter, errs = self._load_batch(params)
+            else:
+                cdx_iter, errs = self._load_index_source(params)
         except BadRequestException as e:
             errs = dict(last_exc=e)
         if not cdx_iter:
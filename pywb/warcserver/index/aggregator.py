@@ -2,22 +2,26 @@ from gevent.pool import Pool
 import gevent
 
 import json
+import logging
 import time
 import os
 
 from warcio.timeutils import timestamp_now
 
+from bisect import bisect_left, bisect_right
 from heapq import merge
 from collections import deque
 from itertools import chain
 
+from pywb.utils.merge import batch_merge
 from pywb.utils.wbexception import NotFoundException, WbException
-from pywb.utils.format import ParamFormatter, res_template
+from pywb.utils.format import ParamFormatter, res_template, to_bool
 
 from pywb.warcserver.index.indexsource import FileIndexSource, RedisIndexSource
-from pywb.warcserver.index.cdxops import process_cdx
+from pywb.warcserver.index.cdxops import cdx_merge_closest, process_cdx
 from pywb.warcserver.index.query import CDXQuery
 from pywb.warcserver.index.zipnum import ZipNumIndexSource
+from pywb.warcserver.index.columnar import ColumnarIndexSource
 
 import six
 import glob
@@ -25,6 +29,10 @@ import glob
 
 #=============================================================================
 class BaseAggregator(object):
+    # if set, a ShardedQuery used to run large queries in parallel,
+    # set per aggregator with ShardedQuery.attach()
+    sharded_query = None
+
     def __call__(self, params):
         if params.get('closest') == 'now':
             params['closest'] = timestamp_now()
@@ -35,6 +43,20 @@ class BaseAggregator(object):
 
         query = CDXQuery(params)
 
+        if self._is_closest_query(query):
+            res = self.load_closest(query.params)
+            if res is not None:
+                iter_list, errs = res
+                cdx_iter = cdx_merge_closest(query.closest, iter_list)
+                cdx_iter = process_cdx(cdx_iter, query, closest_sorted=True)
+                return cdx_iter, dict(errs)
+
+        if self.sharded_query:
+            res = self.sharded_query(self, query)
+            if res is not None:
+                cdx_iter, errs = res
+                return cdx_iter, dict(errs)
+
         cdx_iter, errs = self.load_index(query.params)
 
         if not query.page_count:
@@ -42,6 +64,104 @@ class BaseAggregator(object):
 
         return cdx_iter, dict(errs)
 
+    @staticmethod
+    def _is_closest_query(query):
+        # revisits and collapsing depend on timestamp order
+        return (query.closest and query.is_exact and
+                not query.resolve_revisits and not query.collapse_time and
+                not query.page_count and not query.secondary_index_only)
+
+    def load_closest(self, params):
+        """ For an exact url query, load iterators from all sources over
+        the captures forward and backward from the closest timestamp,
+        each ordered by distance from it, returning (iter list, errs),
+        or None if not supported by all sources
+        """
+        try:
+            sources = list(self._iter_query_sources(params))
+        except WbException:
+            return None
+
+        if not all(hasattr(source, 'load_closest') for name, source in sources):
+            return None
+
+        iter_list = []
+        err_list = []
+
+        for name, source in sources:
+            try:
+                params['_name'] = name
+                params['_formatter'] = ParamFormatter(params, name)
+                res = source.load_closest(params)
+            except WbException as wbe:
+                err_list.append((name, repr(wbe)))
+                continue
+
+            if res is None:
+                return None
+
+            if isinstance(res, tuple):
+                res, errs = res
+                err_list.extend(errs)
+
+            iter_list.extend(self._add_source(cdx_iter, name, params) for cdx_iter in res)
+
+        return iter_list, err_list
+
+    def raw_query(self, params):
+        """ Load raw index lines for a query, if supported by all sources,
+        returning (line iterator, errs), or None if not supported.
+
+        No cdx processing (filtering, limit, sorting) is applied
+        """
+        query = CDXQuery(params)
+
+        res = self.load_raw_index(query.params)
+        if res is None:
+            return None
+
+        raw_iter, errs = res
+        return raw_iter, dict(errs)
+
+    def load_raw_index(self, params):
+        try:
+            sources = list(self._iter_query_sources(params))
+        except WbException:
+            return None
+
+        iter_list = []
+        err_list = []
+
+        for name, source in sources:
+            if not hasattr(source, 'load_raw_index'):
+                return None
+
+            try:
+                params['_name'] = name
+                params['_formatter'] = ParamFormatter(params, name)
+                res = source.load_raw_index(params)
+            except WbException as wbe:
+                err_list.append((name, repr(wbe)))
+                continue
+
+            if res is None:
+                return None
+
+            if isinstance(res, tuple):
+                raw_iter, errs = res
+                err_list.extend(errs)
+            else:
+                raw_iter = res
+
+            iter_list.append(raw_iter)
+
+        if len(iter_list) <= 1:
+            raw_iter = iter_list[0] if iter_list else iter([])
+        else:
+            raw_iter = merge(*iter_list)
+
+        return raw_iter, err_list
+
     def load_child_source(self, name, source, params):
         try:
             params['_name'] = name
@@ -57,6 +177,9 @@ class BaseAggregator(object):
             cdx_iter = iter([])
             err_list = [(name, repr(wbe))]
 
+        return self._add_source(cdx_iter, name, params), err_list
+
+    def _add_source(self, cdx_iter, name, params):
         def add_source(cdx, name):
             if not cdx.get('url'):
                 return cdx
@@ -77,7 +200,7 @@ class BaseAggregator(object):
 
             cdx_iter = (add_source(cdx, name) for cdx in cdx_iter)
 
-        return cdx_iter, err_list
+        return cdx_iter
 
     def _get_coll(self, name):
         return name
@@ -97,7 +220,11 @@ class BaseAggregator(object):
         return cdx_iter, err_list
 
     def _merge(self, iter_list):
-        return merge(*(iter_list))
+        return batch_merge(iter_list, key=self._sort_key)
+
+    @staticmethod
+    def _sort_key(cdx):
+        return cdx['urlkey'] + ' ' + cdx['timestamp']
 
     def _on_source_error(self, name):  #pragma: no cover
         pass
@@ -108,6 +235,29 @@ class BaseAggregator(object):
     def _iter_sources(self, params):  #pragma: no cover
         raise NotImplemented()
 
+    def _iter_query_sources(self, params):
+        """ Iterate over sources to load for a query, skipping sources
+        which can not contain any results, eg. if excluded by a host filter
+        """
+        for name, source in self._iter_sources(params):
+            may_contain = getattr(source, 'may_contain', None)
+            if may_contain and not may_contain(params):
+                continue
+
+            yield name, source
+
+    def get_index_sig(self, params):
+        """ Return the signatures of all sources for the query, which
+        change when any source, or the list of sources, changes
+        """
+        try:
+            sources = list(self._iter_sources(params))
+        except WbException:
+            return None
+
+        return tuple((name, source.get_index_sig(params)) for name, source in sources
+                     if hasattr(source, 'get_index_sig'))
+
     def get_source_list(self, params):
         sources = self._iter_sources(params)
         result = [(name, str(value)) for name, value in sources]
@@ -173,7 +323,7 @@ class SeqAggMixin(object):
 
 
     def _load_all(self, params):
-        sources = self._iter_sources(params)
+        sources = self._iter_query_sources(params)
         return [self.load_child_source(name, source, params)
                 for name, source in sources]
 
@@ -235,7 +385,7 @@ class GeventMixin(object):
     def _load_all(self, params):
         params['_timeout'] = self.timeout
 
-        sources = list(self._iter_sources(params))
+        sources = list(self._iter_query_sources(params))
 
         def do_spawn(name, source):
             return self.pool.spawn(self.load_child_source, name, source, params)
@@ -264,7 +414,8 @@ class GeventTimeoutAggregator(TimeoutMixin, GeventMixin, BaseSourceListAggregato
 class BaseDirectoryIndexSource(BaseAggregator):
     INDEX_SOURCES = [
                      (FileIndexSource.CDX_EXT, FileIndexSource),
-                     (ZipNumIndexSource.IDX_EXT, ZipNumIndexSource)
+                     (ZipNumIndexSource.IDX_EXT, ZipNumIndexSource),
+                     (ColumnarIndexSource.CDX_EXT, ColumnarIndexSource)
                     ]
 
     def __init__(self, base_prefix, base_dir='', name='', config=None):
@@ -274,8 +425,7 @@ class BaseDirectoryIndexSource(BaseAggregator):
         self.config = config
 
     def _iter_sources(self, params):
-        the_dir = res_template(self.base_dir, params)
-        the_dir = os.path.join(self.base_prefix, the_dir)
+        the_dir = self._get_glob_dir(params)
         try:
             sources = list(self._load_files(the_dir))
         except Exception:
@@ -283,6 +433,10 @@ class BaseDirectoryIndexSource(BaseAggregator):
 
         return sources
 
+    def _get_glob_dir(self, params):
+        the_dir = res_template(self.base_dir, params)
+        return os.path.join(self.base_prefix, the_dir)
+
     def _load_files(self, glob_dir):
         for the_dir in glob.iglob(glob_dir):
             for result in self._load_files_single_dir(the_dir):
@@ -290,25 +444,29 @@ class BaseDirectoryIndexSource(BaseAggregator):
 
     def _load_files_single_dir(self, the_dir):
         for name in os.listdir(the_dir):
-            for ext, cls in self.INDEX_SOURCES:
-                if not name.endswith(ext):
-                    continue
+            for result in self._load_file(the_dir, name):
+                yield result
 
-                filename = os.path.join(the_dir, name)
+    def _load_file(self, the_dir, name):
+        for ext, cls in self.INDEX_SOURCES:
+            if not name.endswith(ext):
+                continue
 
-                 #print('Adding ' + filename)
-                rel_path = os.path.relpath(the_dir, self.base_prefix)
-                if rel_path == '.':
-                    full_name = name
-                else:
-                    full_name = os.path.join(rel_path, name)
+            filename = os.path.join(the_dir, name)
 
-                if self.name:
-                    full_name = self.name + ':' + full_name
+             #print('Adding ' + filename)
+            rel_path = os.path.relpath(the_dir, self.base_prefix)
+            if rel_path == '.':
+                full_name = name
+            else:
+                full_name = os.path.join(rel_path, name)
+
+            if self.name:
+                full_name = self.name + ':' + full_name
 
-                index_src = cls(filename, self.config)
+            index_src = cls(filename, self.config)
 
-                yield full_name, index_src
+            yield full_name, index_src
 
     def _get_coll(self, name):
         return name.split(os.path.sep, 1)[0]
@@ -328,18 +486,18 @@ class BaseDirectoryIndexSource(BaseAggregator):
                 self.base_dir == other.base_dir)
 
     @classmethod
-    def init_from_string(cls, value):
+    def init_from_string(cls, value, config=None):
         if os.path.sep != '/':
             value = value.replace('/', os.path.sep)
         if '://' not in value and os.path.isdir(value):
-            return cls(value)
+            return cls(value, config=config)
 
     @classmethod
     def init_from_config(cls, config):
         if config['type'] != 'file':
             return
 
-        return cls.init_from_string(config['path'])
+        return cls.init_from_string(config['path'], config)
 
 
 #=============================================================================
@@ -349,6 +507,8 @@ class DirectoryIndexSource(SeqAggMixin, BaseDirectoryIndexSource):
 
 #=============================================================================
 class CacheDirectoryMixin(object):
+    logger = logging.getLogger('warcserver')
+
     def __init__(self, *args, **kwargs):
         super(CacheDirectoryMixin, self).__init__(*args, **kwargs)
         self.cached_file_list = {}
@@ -364,7 +524,7 @@ class CacheDirectoryMixin(object):
         if result:
             last_stat, files = result
             if stat and last_stat == stat:
-                print('Dir {0} unchanged'.format(the_dir))
+                self.logger.debug('Dir {0} unchanged'.format(the_dir))
                 return files
 
         files = super(CacheDirectoryMixin, self)._load_files_single_dir(the_dir)
@@ -374,7 +534,240 @@ class CacheDirectoryMixin(object):
 
 
 #=============================================================================
-class CacheDirectoryIndexSource(CacheDirectoryMixin, DirectoryIndexSource):
+class IndexRoutes(object):
+    """
+    Routing table of the key range (first and last urlkey) of each index
+    file in a directory, used to select only the index files whose key
+    range overlaps the range of a query.
+
+    The table is persisted in the directory, in the ROUTES_FILE, and is
+    refreshed when the directory is modified (eg. when an index file is
+    added, replaced or removed), or when any index file is modified in
+    place, checked at most every check_interval seconds. Only the key ranges
+    of new files, or of files which have changed size or mtime, are read again.
+    """
+    ROUTES_FILE = '.index-routes'
+    HEADER = b'#pywb-routes'
+    VERSION = 1
+
+    DEFAULT_CHECK_INTERVAL = 5  # in seconds
+
+    # key range of index files that can't be read, always selected
+    ALL_KEYS = (b'', b'\xff')
+
+    logger = logging.getLogger('warcserver')
+
+    def __init__(self, the_dir, check_interval=DEFAULT_CHECK_INTERVAL):
+        self.the_dir = the_dir
+        self.dir_mtime = None
+
+        self.check_interval = check_interval
+        self.last_check = 0
+
+        # name -> (stat sig, key range)
+        self.ranges = None
+
+        self.firsts = []
+        self.max_ends = []
+        self.routes = []
+
+    def refresh(self, load_file):
+        """ Update the table if the directory has changed, using
+        load_file(the_dir, name) to create the index source(s) for a file
+        """
+        dir_mtime = os.stat(self.the_dir).st_mtime_ns
+        if dir_mtime == self.dir_mtime:
+            now = time.time()
+            if now - self.last_check < self.check_interval:
+                return
+
+            self.last_check = now
+            if not self._files_changed():
+                return
+
+        if self.ranges is None:
+            self.ranges = self.read()
+
+        ranges = {}
+        routes = []
+        changed = False
+
+        for name in os.listdir(self.the_dir):
+            for full_name, source in load_file(self.the_dir, name):
+                stat = os.stat(os.path.join(self.the_dir, name))
+                stat_sig = (stat.st_size, stat.st_mtime_ns)
+
+                cached = self.ranges.get(name)
+                if cached and cached[0] == stat_sig:
+                    key_range = cached[1]
+                else:
+                    key_range = self._get_key_range(source)
+                    changed = True
+
+                ranges[name] = (stat_sig, key_range)
+
+                # empty index
+                if not key_range:
+                    continue
+
+                # lines for the last key are < last key + '!'
+                routes.append((key_range[0], key_range[1] + b'!', full_name, source))
+
+        changed = changed or len(ranges) != len(self.ranges)
+
+        routes.sort(key=lambda route: route[0])
+
+        max_end = b''
+        max_ends = []
+        for route in routes:
+            max_end = max(max_end, route[1])
+            max_ends.append(max_end)
+
+        self.ranges = ranges
+        self.firsts = [route[0] for route in routes]
+        self.max_ends = max_ends
+        self.routes = routes
+
+        if changed:
+            self.write()
+            dir_mtime = os.stat(self.the_dir).st_mtime_ns
+
+        self.dir_mtime = dir_mtime
+        self.last_check = time.time()
+
+    def _files_changed(self):
+        """ Return true if any index file in the table has been modified
+        in place (eg. rewritten or appended to), which does not modify
+        the directory
+        """
+        for name, (stat_sig, key_range) in self.ranges.items():
+            try:
+                stat = os.stat(os.path.join(self.the_dir, name))
+            except OSError:
+                return True
+
+            if (stat.st_size, stat.st_mtime_ns) != stat_sig:
+                return True
+
+        return False
+
+    def _get_key_range(self, source):
+        try:
+            return source.get_key_range()
+        except Exception as e:
+            self.logger.warning('Unable to read key range of {0}: {1}'.format(source, e))
+            return self.ALL_KEYS
+
+    def select(self, key, end_key):
+        """ Return (name, source) for each index file which may have
+        lines in the range [key, end_key)
+        """
+        hi = bisect_left(self.firsts, end_key)
+        lo = bisect_right(self.max_ends, key, 0, hi)
+
+        return [(route[2], route[3]) for route in self.routes[lo:hi]
+                if route[1] > key]
+
+    def read(self):
+        """ Read the persisted table, if any, as a dict of
+        name -> (stat sig, key range)
+        """
+        ranges = {}
+        try:
+            fh = open(os.path.join(self.the_dir, self.ROUTES_FILE), 'rb')
+        except IOError:
+            return ranges
+
+        with fh:
+            if fh.readline().rstrip() != self.HEADER + b' %d' % self.VERSION:
+                return ranges
+
+            for line in fh:
+                parts = line.rstrip(b'\n').split(b'\t')
+                try:
+                    stat_sig = (int(parts[1]), int(parts[2]))
+                except (IndexError, ValueError):
+                    continue
+
+                key_range = tuple(parts[3:5]) if len(parts) == 5 else None
+                ranges[parts[0].decode('utf-8')] = (stat_sig, key_range)
+
+        return ranges
+
+    def write(self):
+        """ Atomically write the table, ignoring errors
+        (eg. if the directory is not writable)
+        """
+        filename = os.path.join(self.the_dir, self.ROUTES_FILE)
+        tmp_filename = filename + '.tmp.' + str(os.getpid())
+        try:
+            with open(tmp_filename, 'wb') as fh:
+                fh.write(self.HEADER + b' %d\n' % self.VERSION)
+
+                for name, (stat_sig, key_range) in sorted(self.ranges.items()):
+                    # not persisted, read again next time
+                    if key_range == self.ALL_KEYS:
+                        continue
+
+                    line = [name.encode('utf-8'), b'%d' % stat_sig[0], b'%d' % stat_sig[1]]
+                    if key_range:
+                        line.extend(key_range)
+
+                    fh.write(b'\t'.join(line) + b'\n')
+
+            os.replace(tmp_filename, filename)
+        except (IOError, OSError) as e:
+            self.logger.debug('Unable to write index routes: ' + str(e))
+            try:
+                os.remove(tmp_filename)
+            except OSError:
+                pass
+
+
+#=============================================================================
+class KeyRangeRoutingMixin(object):
+    """
+    If the 'key_range_routing' config option is set, only load the index
+    files whose key range overlaps the range of the query, as recorded in
+    an IndexRoutes table for each directory.
+    """
+    def __init__(self, *args, **kwargs):
+        super(KeyRangeRoutingMixin, self).__init__(*args, **kwargs)
+        config = self.config or {}
+        self.key_range_routing = to_bool(config.get('key_range_routing'))
+        self.key_range_check_interval = float(config.get('key_range_check_interval',
+                                                         IndexRoutes.DEFAULT_CHECK_INTERVAL))
+        self.routes = {}
+
+    def _iter_sources(self, params):
+        key = params.get('key')
+        end_key = params.get('end_key')
+
+        # paged index queries return results even for no matching captures
+        if (not self.key_range_routing or not key or not end_key or
+            params.get('showNumPages') or params.get('showPagedIndex')):
+            return super(KeyRangeRoutingMixin, self)._iter_sources(params)
+
+        the_dir = self._get_glob_dir(params)
+        try:
+            sources = []
+            for single_dir in glob.iglob(the_dir):
+                routes = self.routes.get(single_dir)
+                if not routes:
+                    routes = IndexRoutes(single_dir, self.key_range_check_interval)
+                    self.routes[single_dir] = routes
+
+                routes.refresh(self._load_file)
+                sources.extend(routes.select(key, end_key))
+
+        except Exception:
+            raise NotFoundException(the_dir)
+
+        return sources
+
+
+#=============================================================================
+class CacheDirectoryIndexSource(KeyRangeRoutingMixin, CacheDirectoryMixin, DirectoryIndexSource):
     pass
 
 
@@ -402,5 +795,32 @@ class BaseRedisMultiKeyIndexSource(BaseAggregator, RedisIndexSource):
 
 #=============================================================================
 class RedisMultiKeyIndexSource(SeqAggMixin, BaseRedisMultiKeyIndexSource):
-    pass
+    def _load_all(self, params):
+        """ Load the index from all the matching keys with a single
+        redis pipeline, instead of one round trip per key.
+        Any other sources are loaded individually
+        """
+        sources = list(self._iter_query_sources(params))
+
+        pipe_names = set()
+        pipe = self.redis.pipeline(transaction=False)
+
+        for name, source in sources:
+            if type(source) is RedisIndexSource and source.redis is self.redis:
+                params['_name'] = name
+                params['_formatter'] = ParamFormatter(params, name)
+                pipe.zrangebylex(*source.get_range_args(source.redis_key_template, params))
+                pipe_names.add(name)
+
+        index_lists = iter(pipe.execute() if pipe_names else [])
+
+        res_list = []
+        for name, source in sources:
+            if name in pipe_names:
+                cdx_iter = RedisIndexSource.iter_cdx(next(index_lists))
+                res_list.append((self._add_source(cdx_iter, name, params), []))
+            else:
+                res_list.append(self.load_child_source(name, source, params))
+
+        return res_list
 
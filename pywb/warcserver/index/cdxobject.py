@@ -123,18 +123,7 @@ class CDXObject(OrderedDict):
             self[TIMESTAMP] = to_native_str(fields[1], 'utf-8')
             json_fields = self.json_decode(to_native_str(fields[-1], 'utf-8'))
             for n, v in six.iteritems(json_fields):
-                n = to_native_str(n, 'utf-8')
-                n = self.CDX_ALT_FIELDS.get(n, n)
-
-                if n == 'url':
-                    try:
-                        v.encode('ascii')
-                    except UnicodeEncodeError:
-                        v = quote(v.encode('utf-8'), safe=':/')
-
-                if n != 'filename':
-                    v = to_native_str(v, 'utf-8') or v
-
+                n, v = self._json_field(n, v)
                 self[n] = v
 
             self.cdxline = cdxline
@@ -158,6 +147,22 @@ class CDXObject(OrderedDict):
 
         self.cdxline = cdxline
 
+    @classmethod
+    def _json_field(cls, n, v):
+        n = to_native_str(n, 'utf-8')
+        n = cls.CDX_ALT_FIELDS.get(n, n)
+
+        if n == 'url':
+            try:
+                v.encode('ascii')
+            except UnicodeEncodeError:
+                v = quote(v.encode('utf-8'), safe=':/')
+
+        if n != 'filename':
+            v = to_native_str(v, 'utf-8') or v
+
+        return n, v
+
     def __setitem__(self, key, value):
         OrderedDict.__setitem__(self, key, value)
 
@@ -258,6 +263,108 @@ class CDXObject(OrderedDict):
         return cdx_block
 
 
+#=================================================================
+class LazyCDXObject(CDXObject):
+    """
+    CDXObject for a CDXJ line which only sets the urlkey and timestamp
+    fields initially, and decodes the json block the first time any
+    other field is accessed.
+
+    If not modified, the original line is returned as is by to_text(),
+    and by to_cdxj() if it is ascii (otherwise the url is quoted, as
+    in CDXObject)
+    """
+    # methods which require all fields to be loaded
+    LOAD_METHODS = ('__iter__', '__reversed__', '__len__', '__repr__', '__reduce__', '__delitem__',
+                    'keys', 'values', 'items', 'copy', 'pop', 'popitem',
+                    'setdefault', 'update', 'move_to_end', 'clear')
+
+    def __init__(self, cdxline=b''):
+        cdxline = cdxline.rstrip()
+        fields = cdxline.split(b' ', 2)
+
+        # not CDXJ, no json to defer
+        if len(fields) < 3 or not fields[2].startswith(b'{'):
+            self._json_block = None
+            CDXObject.__init__(self, cdxline)
+            return
+
+        OrderedDict.__init__(self)
+        OrderedDict.__setitem__(self, URLKEY, to_native_str(fields[0], 'utf-8'))
+        OrderedDict.__setitem__(self, TIMESTAMP, to_native_str(fields[1], 'utf-8'))
+
+        self._json_block = fields[2]
+        self._from_json = True
+        self._cached_json = None
+        self.cdxline = cdxline
+
+    def _load(self):
+        json_block = self._json_block
+        if json_block is None:
+            return
+
+        self._json_block = None
+
+        json_fields = self.json_decode(to_native_str(json_block, 'utf-8'))
+        for n, v in six.iteritems(json_fields):
+            n, v = self._json_field(n, v)
+            OrderedDict.__setitem__(self, n, v)
+
+    def __missing__(self, key):
+        if self._json_block is None:
+            raise KeyError(key)
+
+        self._load()
+        return OrderedDict.__getitem__(self, key)
+
+    def __contains__(self, key):
+        if self._json_block is not None and not OrderedDict.__contains__(self, key):
+            self._load()
+
+        return OrderedDict.__contains__(self, key)
+
+    def get(self, key, default=None):
+        if self._json_block is not None and not OrderedDict.__contains__(self, key):
+            self._load()
+
+        return OrderedDict.get(self, key, default)
+
+    def __setitem__(self, key, value):
+        self._load()
+        CDXObject.__setitem__(self, key, value)
+
+    def __eq__(self, other):
+        self._load()
+        if isinstance(other, LazyCDXObject):
+            other._load()
+
+        return OrderedDict.__eq__(self, other)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def to_cdxj(self, fields=None):
+        if fields is None and self.cdxline and self._from_json and self.cdxline.isascii():
+            return to_native_str(self.cdxline, 'utf-8') + '\n'
+
+        return super(LazyCDXObject, self).to_cdxj(fields)
+
+
+def _load_first(name):
+    method = getattr(OrderedDict, name)
+
+    def load_method(self, *args, **kwargs):
+        self._load()
+        return method(self, *args, **kwargs)
+
+    load_method.__name__ = name
+    return load_method
+
+
+for _name in LazyCDXObject.LOAD_METHODS:
+    setattr(LazyCDXObject, _name, _load_first(_name))
+
+
 #=================================================================
 class IDXObject(OrderedDict):
 
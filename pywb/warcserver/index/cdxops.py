@@ -5,15 +5,17 @@ from pywb.warcserver.index.cdxobject import OFFSET, LENGTH, FILENAME
 from pywb.warcserver.index.query import CDXQuery
 
 from warcio.timeutils import timestamp_to_sec, pad_timestamp
+from warcio.timeutils import timestamp_to_datetime, datetime_to_timestamp
 from warcio.timeutils import PAD_14_DOWN, PAD_14_UP
 
-import bisect
+import heapq
 
 from six.moves import zip, range, map
 import re
 
 from heapq import merge
 from collections import deque
+from itertools import groupby
 
 
 #=================================================================
@@ -61,7 +63,7 @@ def cdx_to_json(cdx_iter, fields):
 
 
 #=================================================================
-def process_cdx(cdx_iter, query):
+def process_cdx(cdx_iter, query, closest_sorted=False):
     if query.resolve_revisits:
         cdx_iter = cdx_resolve_revisits(cdx_iter)
 
@@ -81,7 +83,12 @@ def process_cdx(cdx_iter, query):
     limit = query.limit
 
     if closest:
-        cdx_iter = cdx_sort_closest(closest, cdx_iter, limit)
+        # already ordered by distance from closest, eg. by cdx_merge_closest()
+        if closest_sorted:
+            cdx_iter = cdx_limit(cdx_iter, limit)
+        else:
+            cdx_iter = cdx_sort_closest(closest, cdx_iter, limit,
+                                        ascending=query.is_exact)
 
     elif reverse:
         cdx_iter = cdx_reverse(cdx_iter, limit)
@@ -272,38 +279,88 @@ def cdx_collapse_time_status(cdx_iter, timelen=10):
 
 
 #=================================================================
-def cdx_sort_closest(closest, cdx_iter, limit=10):
+def cdx_sort_closest(closest, cdx_iter, limit=10, ascending=False):
     """
     sort CDXCaptureResult by closest to timestamp.
+
+    if 'ascending' is set, the cdx are known to be in ascending timestamp
+    order (eg. for a single url), and reading stops as soon as no later
+    cdx can be closer than the 'limit' closest found so far.
     """
-    closest_cdx = []
-    closest_keys = []
+    closest_heap = []
     closest_sec = timestamp_to_sec(closest)
 
-    for cdx in cdx_iter:
+    for count, cdx in enumerate(cdx_iter):
         sec = timestamp_to_sec(cdx[TIMESTAMP])
         key = abs(closest_sec - sec)
 
-        # create tuple to sort by key
-        #bisect.insort(closest_cdx, (key, cdx))
+        if len(closest_heap) < limit:
+            heapq.heappush(closest_heap, (-key, -count, cdx))
+            continue
 
-        i = bisect.bisect_right(closest_keys, key)
-        closest_keys.insert(i, key)
-        closest_cdx.insert(i, cdx)
+        # max-heap of closest so far, by key and then order
+        if key < -closest_heap[0][0]:
+            heapq.heapreplace(closest_heap, (-key, -count, cdx))
 
-        if len(closest_cdx) == limit:
-            # assuming cdx in ascending order and keys have started increasing
-            if key > closest_keys[-1]:
-                break
+        elif ascending and sec >= closest_sec:
+            break
 
-        if len(closest_cdx) > limit:
-            closest_cdx.pop()
+    closest_heap.sort(reverse=True)
 
-    for cdx in closest_cdx:
+    for key, count, cdx in closest_heap:
         yield cdx
 
-    #for cdx in map(lambda x: x[1], closest_cdx):
-    #    yield cdx
+
+#=================================================================
+def closest_timestamp(closest):
+    """
+    full 14-digit timestamp of the closest param, padded in the same
+    way as for computing distance, so that captures >= it in the index
+    are those at or after the closest time.
+
+    >>> closest_timestamp('2014')
+    '20141231235959'
+
+    >>> closest_timestamp('201402')
+    '20140228235959'
+    """
+    return datetime_to_timestamp(timestamp_to_datetime(closest))
+
+
+#=================================================================
+def cdx_reverse_ties(cdx_iter):
+    """
+    for cdx in descending timestamp order, eg. read backwards from the
+    closest timestamp, restore the original (ascending) order of any
+    cdx with the same timestamp.
+    """
+    for timestamp, group in groupby(cdx_iter, key=lambda cdx: cdx[TIMESTAMP]):
+        for cdx in reversed(list(group)):
+            yield cdx
+
+
+#=================================================================
+def cdx_merge_closest(closest, iter_list):
+    """
+    merge cdx iterators which are each ordered by distance from
+    the closest timestamp (eg. forward and backward from it) into
+    a single iterator, also ordered by distance, then by timestamp, and
+    then by cdx, as when sorting the merged cdx of all sources, so that the
+    order of captures with the same timestamp does not depend on the order
+    of the iterators (eg. the order of files in a directory).
+
+    only as many cdx as are consumed are read from each iterator.
+    """
+    closest_sec = timestamp_to_sec(closest)
+
+    def distance(cdx):
+        timestamp = cdx[TIMESTAMP]
+        return abs(closest_sec - timestamp_to_sec(timestamp)), timestamp, cdx
+
+    if len(iter_list) == 1:
+        return iter_list[0]
+
+    return merge(*iter_list, key=distance)
 
 
 #=================================================================
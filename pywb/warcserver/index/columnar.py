@@ -0,0 +1,676 @@
+from collections import OrderedDict
+from json import dumps as json_encode
+from json import loads as json_decode
+
+from warcio.timeutils import PAD_14_DOWN, PAD_14_UP, pad_timestamp, timestamp_to_sec
+
+from pywb.utils.format import res_template, to_bool
+from pywb.utils.wbexception import NotFoundException
+from pywb.warcserver.index.cdxobject import CDXObject
+from pywb.warcserver.index.cdxops import CDXFilter, cdx_reverse_ties, closest_timestamp
+from pywb.warcserver.index.hostfilter import HostBloomFilter
+from pywb.warcserver.index.indexsource import BaseIndexSource
+
+from array import array
+from itertools import islice
+
+import mmap
+import os
+import shutil
+import struct
+import sys
+import tempfile
+
+
+#=============================================================================
+class ColumnarIndex(object):
+    """
+    Read-only, memory-mapped binary CDX index, stored in fixed-width columns.
+
+    Each row (capture) is stored as:
+
+    * ids into a shared, sorted string table for the urlkey, url, mime,
+      status, digest and filename fields
+    * a fixed-width, space-padded timestamp
+    * 64-bit integers for the offset and length fields
+    * ids of the row 'layout' (field order and cdx format) and of a json
+      block of any additional fields
+
+    Since the string table is sorted, a value can be looked up by bisect,
+    and since all columns are fixed-width, any field of any row can be read
+    directly, without parsing the row.
+
+    Rows are sorted by urlkey and timestamp, as in a CDXJ file.
+    """
+    EXT = '.cdxc'
+
+    MAGIC = b'PYWBCDXC'
+    VERSION = 1
+
+    # magic, version, byte order, spilled column mask, rows, ts width, strings
+    HEADER = struct.Struct('<8sBcHIII')
+
+    STRING_COLUMNS = ('urlkey', 'url', 'mime', 'status', 'digest', 'filename')
+    INT_COLUMNS = ('offset', 'length')
+
+    LAYOUT = '_layout'
+    EXTRA = '_extra'
+
+    ID_COLUMNS = STRING_COLUMNS + (LAYOUT, EXTRA)
+
+    SECTIONS = ID_COLUMNS + ('timestamp',) + INT_COLUMNS + ('_str_offsets', '_str_heap')
+
+    # int column value for missing fields
+    NO_INT = 2 ** 64 - 1
+
+    # rows of each column buffered in memory before spooling to a temp file
+    WRITE_CHUNK_ROWS = 65536
+
+    _cache = {}
+
+    def __init__(self, filename, stat_sig=None):
+        self.filename = filename
+        self.stat_sig = stat_sig
+
+        with open(filename, 'rb') as fh:
+            self.mm = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, byteorder, self.spilled, self.num_rows, self.ts_width, self.num_strings = \
+            self.HEADER.unpack_from(self.mm, 0)
+
+        if magic != self.MAGIC or version != self.VERSION:
+            raise ValueError('Not a columnar cdx index: ' + filename)
+
+        if byteorder != sys.byteorder[0].encode('ascii'):
+            raise ValueError('Columnar cdx index has a different byte order, must be rebuilt: ' + filename)
+
+        offsets = struct.unpack_from('<%dQ' % len(self.SECTIONS), self.mm, self.HEADER.size)
+        self.sections = dict(zip(self.SECTIONS, offsets))
+
+        mv = memoryview(self.mm)
+
+        self.columns = {}
+        for name in self.ID_COLUMNS:
+            self.columns[name] = self._cast(mv, name, 'I', self.num_rows)
+
+        for name in self.INT_COLUMNS:
+            self.columns[name] = self._cast(mv, name, 'Q', self.num_rows)
+
+        self.str_offsets = self._cast(mv, '_str_offsets', 'Q', self.num_strings + 1)
+        self.ts_offset = self.sections['timestamp']
+        self.heap_offset = self.sections['_str_heap']
+
+        self._layouts = {}
+
+    def _cast(self, mv, name, fmt, count):
+        start = self.sections[name]
+        return mv[start:start + count * struct.calcsize(fmt)].cast(fmt)
+
+    def __len__(self):
+        return self.num_rows
+
+    def string(self, id_):
+        """ Return string table entry as bytes
+        """
+        start = self.heap_offset + self.str_offsets[id_]
+        end = self.heap_offset + self.str_offsets[id_ + 1]
+        return self.mm[start:end]
+
+    def find_string(self, value):
+        """ Return id of the string table entry equal to value, or None
+        """
+        lo = 1
+        hi = self.num_strings
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.string(mid) < value:
+                lo = mid + 1
+            else:
+                hi = mid
+
+        if lo < self.num_strings and self.string(lo) == value:
+            return lo
+
+        return None
+
+    def timestamp(self, i):
+        start = self.ts_offset + i * self.ts_width
+        return self.mm[start:start + self.ts_width].rstrip(b' ')
+
+    def line_key(self, i):
+        """ Return 'urlkey timestamp' prefix of the cdx line for row i
+        """
+        return self.string(self.columns['urlkey'][i]) + b' ' + self.timestamp(i)
+
+    def lower_bound(self, key, lo=0):
+        """ Return first row whose 'urlkey timestamp' is >= key
+        """
+        hi = self.num_rows
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.line_key(mid) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+
+        return lo
+
+    def value(self, name, i):
+        """ Return value of a column field for row i, as a str,
+        or '' if the field is not set
+        """
+        if name == 'timestamp':
+            return self.timestamp(i).decode('ascii')
+
+        value = self.columns[name][i]
+        if name in self.INT_COLUMNS:
+            return str(value) if value != self.NO_INT else ''
+
+        return self.string(value).decode('utf-8') if value else ''
+
+    def is_column(self, name):
+        """ Return true if field is always stored in its column,
+        and so can be read without loading the row
+        """
+        if name == 'timestamp':
+            return True
+
+        try:
+            index = self.STRING_COLUMNS.index(name)
+        except ValueError:
+            try:
+                index = len(self.ID_COLUMNS) + self.INT_COLUMNS.index(name)
+            except ValueError:
+                return False
+
+        return not (self.spilled & (1 << index))
+
+    def get_layout(self, i):
+        id_ = self.columns[self.LAYOUT][i]
+        layout = self._layouts.get(id_)
+        if not layout:
+            layout = json_decode(self.string(id_).decode('utf-8'))
+            self._layouts[id_] = layout
+
+        return layout
+
+    def get_cdx(self, i):
+        """ Create CDXObject for row i
+        """
+        is_json, fields = self.get_layout(i)
+
+        extra_id = self.columns[self.EXTRA][i]
+        if extra_id:
+            extra = json_decode(self.string(extra_id).decode('utf-8'),
+                                object_pairs_hook=OrderedDict)
+        else:
+            extra = {}
+
+        cdx = CDXObject()
+        for name in fields:
+            if name in extra:
+                cdx[name] = extra[name]
+            else:
+                cdx[name] = self.value(name, i)
+
+        if is_json:
+            dupe = OrderedDict(list(cdx.items())[2:])
+            line = cdx['urlkey'] + ' ' + cdx['timestamp'] + ' ' + json_encode(dupe)
+        else:
+            line = ' '.join(str(v) for v in cdx.values())
+
+        cdx.cdxline = line.encode('utf-8')
+        cdx._from_json = is_json
+        return cdx
+
+    def filter_func(self, cdx_filter):
+        """ Return a function of row number which applies the CDXFilter
+        directly to a column, or None if the filter field is not a column
+        """
+        field = cdx_filter.field
+        if not field or not self.is_column(field):
+            return None
+
+        def match(value):
+            return cdx_filter.compare_func(value) ^ cdx_filter.invert
+
+        if field not in self.STRING_COLUMNS:
+            return lambda i: match(self.value(field, i))
+
+        column = self.columns[field]
+
+        # exact match, compare string ids
+        if cdx_filter.compare_func == cdx_filter.exact and cdx_filter.filter_str:
+            target = self.find_string(cdx_filter.filter_str.encode('utf-8'))
+            return lambda i: (column[i] == target) ^ cdx_filter.invert
+
+        # string columns typically have few distinct values,
+        # so match each distinct value only once
+        matched = {}
+
+        def filter_row(i):
+            id_ = column[i]
+            res = matched.get(id_)
+            if res is None:
+                res = match(self.string(id_).decode('utf-8') if id_ else '')
+                matched[id_] = res
+
+            return res
+
+        return filter_row
+
+    def clamp_func(self, from_ts, to_ts):
+        """ Return function of row number which is true if the row timestamp
+        is within [from_ts, to_ts], as in cdx_clamp()
+        """
+        if from_ts and len(from_ts) < 14:
+            from_ts = pad_timestamp(from_ts, PAD_14_DOWN)
+
+        if to_ts and len(to_ts) < 14:
+            to_ts = pad_timestamp(to_ts, PAD_14_UP)
+
+        from_ts = from_ts.encode('ascii') if from_ts else None
+        to_ts = to_ts.encode('ascii') if to_ts else None
+
+        def clamp_row(i):
+            ts = self.timestamp(i)
+            if from_ts and ts < from_ts:
+                return False
+
+            if to_ts and ts > to_ts:
+                return False
+
+            return True
+
+        return clamp_row
+
+    def closest_rows(self, rows, closest, limit):
+        """ Return the (up to) 'limit' rows closest to the closest timestamp,
+        in index order, from a list of rows of a single urlkey.
+
+        Ties are resolved in favor of the earlier row, matching the stable
+        sort in cdx_sort_closest()
+        """
+        if len(rows) <= limit:
+            return rows
+
+        closest_sec = timestamp_to_sec(closest)
+
+        def sec(pos):
+            return timestamp_to_sec(self.timestamp(rows[pos]).decode('ascii'))
+
+        # first row at or after the closest timestamp
+        lo = 0
+        hi = len(rows)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if sec(mid) < closest_sec:
+                lo = mid + 1
+            else:
+                hi = mid
+
+        left = lo - 1
+        right = lo
+
+        while right - left - 1 < limit:
+            if right >= len(rows):
+                left -= 1
+            elif left < 0:
+                right += 1
+            elif closest_sec - sec(left) <= sec(right) - closest_sec:
+                left -= 1
+            else:
+                right += 1
+
+        return rows[left + 1:right]
+
+    @staticmethod
+    def _stat_sig(filename):
+        stat = os.stat(filename)
+        return (stat.st_size, stat.st_mtime_ns)
+
+    @classmethod
+    def load(cls, filename):
+        """ Return mapped index for filename, reusing the existing
+        mapping if the file is unchanged
+        """
+        stat_sig = cls._stat_sig(filename)
+
+        index = cls._cache.get(filename)
+        if index and index.stat_sig == stat_sig:
+            return index
+
+        index = cls(filename, stat_sig)
+        cls._cache[filename] = index
+        return index
+
+    @classmethod
+    def write(cls, filename, cdx_iter):
+        """ Write a columnar index from an iterator of CDXObjects,
+        sorted by urlkey and timestamp. Each column is spooled to a temp
+        file as the rows are read, so that only the distinct strings are
+        kept in memory, and the index is then assembled and written atomically.
+        """
+        # string -> id, in the order first seen, remapped to the order
+        # of the sorted string table once all rows are read
+        ids = {}
+        spilled = 0
+        ts_width = 0
+        num_rows = 0
+        last_key = None
+
+        int_start = len(cls.ID_COLUMNS)
+
+        chunks = OrderedDict()
+        for name in cls.ID_COLUMNS:
+            chunks[name] = array('I')
+
+        chunks['timestamp'] = []
+
+        for name in cls.INT_COLUMNS:
+            chunks[name] = array('Q')
+
+        # temp files in the same dir as the index, which needs the space anyway
+        tmp_dir = os.path.dirname(os.path.abspath(filename))
+        spools = OrderedDict((name, tempfile.TemporaryFile(dir=tmp_dir)) for name in chunks)
+
+        def spool_chunks():
+            for name, chunk in chunks.items():
+                if name == 'timestamp':
+                    spools[name].write(b''.join(ts + b'\n' for ts in chunk))
+                else:
+                    chunk.tofile(spools[name])
+
+                del chunk[:]
+
+        try:
+            for cdx in cdx_iter:
+                row = {}
+                extra = OrderedDict()
+
+                for name, value in cdx.items():
+                    if name == 'timestamp':
+                        continue
+
+                    if name in cls.STRING_COLUMNS and isinstance(value, str):
+                        row[name] = value.encode('utf-8')
+
+                    elif (name in cls.INT_COLUMNS and isinstance(value, str) and
+                          value.isdigit() and str(int(value)) == value and
+                          int(value) < cls.NO_INT):
+                        row[name] = int(value)
+
+                    else:
+                        extra[name] = value
+                        if name in cls.STRING_COLUMNS:
+                            spilled |= 1 << cls.STRING_COLUMNS.index(name)
+                        elif name in cls.INT_COLUMNS:
+                            spilled |= 1 << (int_start + cls.INT_COLUMNS.index(name))
+
+                ts = cdx['timestamp'].encode('ascii')
+                ts_width = max(ts_width, len(ts))
+
+                key = row['urlkey'] + b' ' + ts
+                if last_key and key < last_key:
+                    raise ValueError('Index must be sorted, found: {0} after {1}'.format(key, last_key))
+
+                last_key = key
+
+                row[cls.LAYOUT] = json_encode([cdx._from_json, list(cdx.keys())]).encode('utf-8')
+
+                if extra:
+                    row[cls.EXTRA] = json_encode(extra).encode('utf-8')
+
+                for name in cls.ID_COLUMNS:
+                    value = row.get(name)
+                    if value is None:
+                        # id 0 is reserved for missing values
+                        id_ = 0
+                    else:
+                        id_ = ids.get(value)
+                        if id_ is None:
+                            id_ = ids[value] = len(ids) + 1
+
+                    chunks[name].append(id_)
+
+                chunks['timestamp'].append(ts)
+
+                for name in cls.INT_COLUMNS:
+                    chunks[name].append(row.get(name, cls.NO_INT))
+
+                num_rows += 1
+                if num_rows % cls.WRITE_CHUNK_ROWS == 0:
+                    spool_chunks()
+
+            spool_chunks()
+
+            strings = [b''] + sorted(ids)
+
+            remap = array('I', [0]) * len(strings)
+            for i in range(1, len(strings)):
+                remap[ids[strings[i]]] = i
+
+            ids = None
+
+            str_offsets = array('Q', [0])
+            for value in strings:
+                str_offsets.append(str_offsets[-1] + len(value))
+
+            sizes = OrderedDict()
+            for name, chunk in chunks.items():
+                sizes[name] = num_rows * (ts_width if name == 'timestamp' else chunk.itemsize)
+
+            sizes['_str_offsets'] = len(str_offsets) * str_offsets.itemsize
+            sizes['_str_heap'] = str_offsets[-1]
+
+            header = cls.HEADER.pack(cls.MAGIC, cls.VERSION,
+                                     sys.byteorder[0].encode('ascii'),
+                                     spilled, num_rows, ts_width, len(strings))
+
+            pos = cls.HEADER.size + 8 * len(cls.SECTIONS)
+            offsets = []
+            for name in cls.SECTIONS:
+                pos += -pos % 8
+                offsets.append(pos)
+                pos += sizes[name]
+
+            tmp_filename = filename + '.tmp.' + str(os.getpid())
+            try:
+                with open(tmp_filename, 'wb') as fh:
+                    fh.write(header)
+                    fh.write(struct.pack('<%dQ' % len(offsets), *offsets))
+
+                    for name, offset in zip(cls.SECTIONS, offsets):
+                        fh.write(b'\0' * (offset - fh.tell()))
+
+                        if name in cls.ID_COLUMNS:
+                            cls._write_ids(fh, spools[name], remap)
+
+                        elif name == 'timestamp':
+                            cls._write_timestamps(fh, spools[name], ts_width)
+
+                        elif name in cls.INT_COLUMNS:
+                            spools[name].seek(0)
+                            shutil.copyfileobj(spools[name], fh)
+
+                        elif name == '_str_offsets':
+                            str_offsets.tofile(fh)
+
+                        else:
+                            for value in strings:
+                                fh.write(value)
+
+                os.replace(tmp_filename, filename)
+            finally:
+                if os.path.exists(tmp_filename):
+                    os.remove(tmp_filename)
+
+        finally:
+            for spool in spools.values():
+                spool.close()
+
+        return num_rows
+
+    @classmethod
+    def _write_ids(cls, fh, spool, remap):
+        """ Copy a spooled id column to fh, remapping each id
+        to its position in the sorted string table
+        """
+        spool.seek(0)
+        size = cls.WRITE_CHUNK_ROWS * remap.itemsize
+        while True:
+            buff = spool.read(size)
+            if not buff:
+                break
+
+            chunk = array('I')
+            chunk.frombytes(buff)
+            array('I', map(remap.__getitem__, chunk)).tofile(fh)
+
+    @classmethod
+    def _write_timestamps(cls, fh, spool, ts_width):
+        """ Copy a spooled timestamp column to fh, padding each
+        timestamp to the fixed width
+        """
+        spool.seek(0)
+        while True:
+            lines = list(islice(spool, cls.WRITE_CHUNK_ROWS))
+            if not lines:
+                break
+
+            fh.write(b''.join(line[:-1].ljust(ts_width) for line in lines))
+
+
+#=============================================================================
+class ColumnarIndexSource(BaseIndexSource):
+    """
+    Index source for a local ColumnarIndex (.cdxc) file.
+
+    Filters on column fields, from/to clamping and, for exact closest queries,
+    selection of the closest 'limit' captures are applied directly on
+    the columns, and only the remaining rows are loaded as CDXObjects.
+    """
+    CDX_EXT = ColumnarIndex.EXT
+
+    def __init__(self, filename, config=None):
+        self.filename_template = filename
+
+    def load_index(self, params):
+        filename = res_template(self.filename_template, params)
+
+        try:
+            index = ColumnarIndex.load(filename)
+        except IOError:
+            raise NotFoundException(filename)
+
+        start = index.lower_bound(params['key'])
+        end = index.lower_bound(params['end_key'], start)
+
+        rows = range(start, end)
+
+        # filters and clamping are applied after revisits are resolved,
+        # which may require rows excluded by them
+        if not to_bool(params.get('resolveRevisits')):
+            rows = self._select_rows(index, rows, params)
+
+        return (index.get_cdx(i) for i in rows)
+
+    def load_closest(self, params):
+        """ For an exact url query, return iterators over the captures
+        from the closest timestamp forward and backward, each ordered
+        by distance from it
+        """
+        filename = res_template(self.filename_template, params)
+
+        try:
+            index = ColumnarIndex.load(filename)
+        except IOError:
+            raise NotFoundException(filename)
+
+        closest = closest_timestamp(params['closest']).encode('utf-8')
+
+        start = index.lower_bound(params['key'])
+        end = index.lower_bound(params['end_key'], start)
+        mid = index.lower_bound(params['key'] + b' ' + closest, start)
+
+        return [(index.get_cdx(i) for i in range(mid, end)),
+                cdx_reverse_ties(index.get_cdx(i) for i in range(mid - 1, start - 1, -1))]
+
+    def may_contain(self, params):
+        filename = res_template(self.filename_template, params)
+        return HostBloomFilter.may_contain_file(filename, params)
+
+    def get_index_sig(self, params):
+        return self._file_sig(res_template(self.filename_template, params))
+
+    def get_key_range(self):
+        index = ColumnarIndex.load(self.filename_template)
+        if not len(index):
+            return None
+
+        return (index.value('urlkey', 0).encode('utf-8'),
+                index.value('urlkey', len(index) - 1).encode('utf-8'))
+
+    def _select_rows(self, index, rows, params):
+        filters = params.get('filter') or []
+        if isinstance(filters, str):
+            filters = [filters]
+
+        all_filters = True
+
+        for filter_str in filters:
+            filter_func = index.filter_func(CDXFilter(filter_str))
+            if filter_func:
+                rows = filter(filter_func, rows)
+            else:
+                all_filters = False
+
+        from_ts = params.get('from') or params.get('from_ts')
+        to_ts = params.get('to')
+        if from_ts or to_ts:
+            rows = filter(index.clamp_func(from_ts, to_ts), rows)
+
+        closest = params.get('closest')
+
+        # only safe if all filters have been applied
+        if (closest and all_filters and params.get('matchType') == 'exact' and
+            not params.get('collapseTime')):
+            limit = int(params.get('limit', 100000))
+            rows = index.closest_rows(list(rows), closest, limit)
+
+        return rows
+
+    def __repr__(self):
+        return '{0}(file://{1})'.format(self.__class__.__name__,
+                                        self.filename_template)
+
+    def __str__(self):
+        return 'file'
+
+    def __eq__(self, other):
+        if not isinstance(other, self.__class__):
+            return False
+
+        return self.filename_template == other.filename_template
+
+    @classmethod
+    def init_from_string(cls, value, config=None):
+        if not value.endswith(cls.CDX_EXT):
+            return None
+
+        if value.startswith('file://'):
+            return cls(value[7:], config)
+
+        if value.startswith('/') or '://' not in value:
+            return cls(value, config)
+
+    @classmethod
+    def init_from_config(cls, config):
+        if config['type'] != 'columnar':
+            return
+
+        path = config['path']
+        if path.startswith('file://'):
+            path = path[7:]
+
+        return cls(path, config)
@@ -1,11 +1,14 @@
 from warcio.utils import to_native_str
 
+from pywb.utils.cache import LRUCache
 from pywb.utils.loaders import load_yaml_config
 from pywb.utils.format import to_bool
+from pywb.warcserver.index.query import CDXQuery
 from pywb import DEFAULT_RULES_FILE
 
 import re
 import os
+import time
 
 from six import iterkeys
 from six.moves.urllib.parse import urlsplit
@@ -28,7 +31,20 @@ class FuzzyMatcher(object):
     FUZZY_SKIP_PARAMS = ('alt_url', 'reverse', 'closest', 'end_key',
                          'url', 'matchType', 'filter')
 
-    def __init__(self, filename=None):
+    # params which don't affect whether a query has any results,
+    # not included in the miss cache key
+    MISS_SKIP_PARAMS = ('url', 'alt_url', 'closest', 'reverse', 'sort',
+                        'output', 'fl', 'fields')
+
+    DEFAULT_MISS_CACHE_SIZE = 10000
+
+    def __init__(self, filename=None, miss_cache_ttl=0, miss_cache_size=None):
+        # ttl in seconds of cached misses, 0 to disable the miss cache
+        self.miss_ttl = int(miss_cache_ttl or 0)
+        self.miss_cache = None
+        if self.miss_ttl:
+            self.miss_cache = LRUCache(int(miss_cache_size or self.DEFAULT_MISS_CACHE_SIZE))
+
         filename = filename or DEFAULT_RULES_FILE
         config = load_yaml_config(filename)
         self.rules = []
@@ -43,6 +59,53 @@ class FuzzyMatcher(object):
 
         self.url_normalize_rx = [(re.compile(rule['match']), rule['replace']) for rule in self.default_filters['url_normalize']]
 
+        self.not_exts = frozenset(self.default_filters['not_exts'])
+        self.mimes = frozenset(self.default_filters['mimes'])
+
+        self.prefix_rules, self.prefix_lens = self.make_prefix_index(self.rules)
+
+    @staticmethod
+    def make_prefix_index(rules):
+        """ Index the rules by url prefix, for dispatching a urlkey
+        to the rules with a matching prefix by looking up each of its
+        prefixes of the indexed lengths, instead of trying every rule
+
+        :return: dict of prefix -> list of rule positions,
+        and the sorted list of distinct prefix lengths
+        """
+        prefix_rules = {}
+        for i, rule in enumerate(rules):
+            for prefix in rule.url_prefix:
+                if prefix is None:
+                    continue
+
+                rule_list = prefix_rules.setdefault(prefix, [])
+                if not rule_list or rule_list[-1] != i:
+                    rule_list.append(i)
+
+        prefix_lens = sorted(set(len(prefix) for prefix in prefix_rules))
+        return prefix_rules, prefix_lens
+
+    def get_matching_rules(self, urlkey):
+        """ Return the rules with a url prefix matching the urlkey,
+        in the order of the rules file
+        """
+        matched = []
+        key_len = len(urlkey)
+        for prefix_len in self.prefix_lens:
+            if prefix_len > key_len:
+                break
+
+            rule_list = self.prefix_rules.get(urlkey[:prefix_len])
+            if rule_list:
+                matched.extend(rule_list)
+
+        # only sort if more than one prefix matched
+        if len(matched) > 1:
+            matched = sorted(set(matched))
+
+        return [self.rules[i] for i in matched]
+
     def parse_fuzzy_rule(self, rule):
         """ Parse rules using all the different supported forms
         """
@@ -74,10 +137,7 @@ class FuzzyMatcher(object):
         filters = set()
         matched_rule = None
 
-        for rule in self.rules:
-            if not any((urlkey.startswith(prefix) for prefix in rule.url_prefix)):
-                continue
-
+        for rule in self.get_matching_rules(urlkey):
             groups = None
             if rule.re_type == 'findall':
                 groups = rule.regex.findall(urlkey)
@@ -124,7 +184,7 @@ class FuzzyMatcher(object):
 
         if matched_rule.re_type == 'sub':
             filters = {'urlkey:'}
-            url = re.sub(rule.regex, rule.replace_after, url)            
+            url = matched_rule.regex.sub(matched_rule.replace_after, url)
 
         fuzzy_params = {'url': url,
                         'matchType': matched_rule.match_type,
@@ -162,10 +222,58 @@ class FuzzyMatcher(object):
         return '.*'.join([conv(param) for param in params_list])
 
     def __call__(self, index_source, params):
+        miss = None
+        if self.miss_cache is not None:
+            miss = self.get_miss_key(index_source, params)
+            if self.is_cached_miss(miss):
+                return iter([]), {}
+
         cdx_iter, errs = index_source(params)
-        return self.get_fuzzy_iter(cdx_iter, index_source, params), errs
 
-    def get_fuzzy_iter(self, cdx_iter, index_source, params):
+        # only cache misses without errors from any source
+        if errs:
+            miss = None
+
+        return self.get_fuzzy_iter(cdx_iter, index_source, params, miss), errs
+
+    def get_miss_key(self, index_source, params):
+        """ Return the (key, index signature) of a query for the miss cache.
+
+        The key is the collection, canonical urlkey and the params which may
+        affect the results. The signature of the indexes of the collection
+        is compared on lookup, so that cached misses are invalidated when
+        any (local) index changes
+        """
+        query = CDXQuery(dict(params))
+
+        key_params = tuple(sorted((name, str(value)) for name, value in query.params.items()
+                                  if not name.startswith('_') and name not in self.MISS_SKIP_PARAMS))
+
+        key = (params.get('param.coll'), query.key, key_params)
+
+        get_index_sig = getattr(index_source, 'get_index_sig', None)
+        index_sig = get_index_sig(query.params) if get_index_sig else None
+
+        return key, index_sig
+
+    def is_cached_miss(self, miss):
+        key, index_sig = miss
+        entry = self.miss_cache.get(key)
+        if entry is None:
+            return False
+
+        expires, cached_sig = entry
+        if expires <= time.time() or cached_sig != index_sig:
+            self.miss_cache.remove(key)
+            return False
+
+        return True
+
+    def add_miss(self, miss):
+        key, index_sig = miss
+        self.miss_cache.put(key, (time.time() + self.miss_ttl, index_sig))
+
+    def get_fuzzy_iter(self, cdx_iter, index_source, params, miss=None):
         found = False
         for cdx in cdx_iter:
             found = True
@@ -176,6 +284,8 @@ class FuzzyMatcher(object):
 
         # if fuzzy matching disabled
         if not to_bool(params.get('allowFuzzy', True)):
+            if miss:
+                self.add_miss(miss)
             return
 
         url = params['url']
@@ -183,6 +293,8 @@ class FuzzyMatcher(object):
 
         res = self.get_fuzzy_match(urlkey, url, params)
         if not res:
+            if miss:
+                self.add_miss(miss)
             return
 
         rule, fuzzy_params = res
@@ -191,16 +303,32 @@ class FuzzyMatcher(object):
 
         is_custom = (rule.url_prefix != [''])
 
-        rx_cache = {}
+        # computed once for all candidates
+        url_no_query, ext = self.get_ext(url)
+        norm_urlkeys = self.get_normalized_urlkeys(urlkey)
 
         for cdx in new_iter:
-            if is_custom or self.match_general_fuzzy_query(url, urlkey, cdx, rx_cache):
+            if is_custom or self.match_general_fuzzy_query(url_no_query, ext, norm_urlkeys, cdx):
                 cdx['is_fuzzy'] = '1'
+                found = True
                 yield cdx
 
-    def match_general_fuzzy_query(self, url, urlkey, cdx, rx_cache):
+        if miss and not found and not errs:
+            self.add_miss(miss)
+
+    def get_normalized_urlkeys(self, urlkey):
+        """ Return the urlkey after applying each of the url normalization
+        rules in turn
+        """
+        norm_urlkeys = []
+        for rx, replace in self.url_normalize_rx:
+            urlkey = rx.sub(replace, urlkey)
+            norm_urlkeys.append(urlkey)
+
+        return norm_urlkeys
+
+    def match_general_fuzzy_query(self, url_no_query, ext, norm_urlkeys, cdx):
         check_query = False
-        url_no_query, ext = self.get_ext(url)
 
         # don't fuzzy match to 204
         if cdx.get('status') == '204':
@@ -208,13 +336,13 @@ class FuzzyMatcher(object):
                 return False
 
         # check ext
-        if ext and ext not in self.default_filters['not_exts']:
+        if ext and ext not in self.not_exts:
             check_query = True
 
         else:
             # check mime
             mime = cdx.get('mime')
-            if mime and mime in self.default_filters['mimes']:
+            if mime and mime in self.mimes:
                 check_query = True
 
             # also check query if has method (non-GET request) or requestBody is set
@@ -228,16 +356,10 @@ class FuzzyMatcher(object):
 
         match_urlkey = cdx['urlkey']
 
-        for normalize_rx in self.url_normalize_rx:
-            match_urlkey = re.sub(normalize_rx[0], normalize_rx[1], match_urlkey)
-            curr_urlkey = rx_cache.get(normalize_rx[0])
-
-            if not curr_urlkey:
-                curr_urlkey = re.sub(normalize_rx[0], normalize_rx[1], urlkey)
-                rx_cache[normalize_rx[0]] = curr_urlkey
-                urlkey = curr_urlkey
+        for (rx, replace), norm_urlkey in zip(self.url_normalize_rx, norm_urlkeys):
+            match_urlkey = rx.sub(replace, match_urlkey)
 
-            if curr_urlkey == match_urlkey:
+            if norm_urlkey == match_urlkey:
                 return True
 
         return False
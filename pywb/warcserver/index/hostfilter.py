@@ -0,0 +1,326 @@
+"""
+Bloom filter of the SURT hosts in an index file, persisted next to the index,
+allowing aggregators to skip index files which can not contain
+any results for a query.
+"""
+
+from hashlib import md5
+from math import ceil, log
+
+import gzip
+import logging
+import os
+import struct
+
+
+#=============================================================================
+def host_key(urlkey):
+    """ Return the host part of a urlkey, up to and including
+    the ')' (SURT) or the first '/' (non-SURT), or None if the urlkey
+    has neither.
+
+    >>> host_key(b'com,example,www)/path/file.html')
+    b'com,example,www)'
+
+    >>> host_key(b'example.com/path)')
+    b'example.com/'
+
+    >>> host_key(b'com,exam') is None
+    True
+    """
+    end = len(urlkey)
+    for delim in (b')', b'/'):
+        i = urlkey.find(delim, 0, end)
+        if i >= 0:
+            end = i
+
+    if end == len(urlkey):
+        return None
+
+    return urlkey[:end + 1]
+
+
+def domain_keys(host):
+    """ Return all SURT domains of a SURT host key,
+    used to match matchType=domain queries.
+
+    >>> domain_keys(b'com,example,www)')
+    [b'com', b'com,example', b'com,example,www']
+
+    >>> domain_keys(b'example.com/')
+    []
+    """
+    if not host.endswith(b')'):
+        return []
+
+    parts = host[:-1].split(b',')
+    return [b','.join(parts[:i + 1]) for i in range(len(parts))]
+
+
+def query_filter_key(params):
+    """ Return the key to check in the host filter for a query,
+    or None if the query can not be excluded by host
+    """
+    key = params.get('key')
+    if not key or not isinstance(key, bytes):
+        return None
+
+    # paged index queries return results even for no matching captures
+    if (params.get('showNumPages') or params.get('showPagedIndex') or
+        params.get('matchType') not in ('exact', 'prefix', 'host', 'domain')):
+        return None
+
+    host = host_key(key)
+    if not host:
+        return None
+
+    if params['matchType'] == 'domain':
+        if not host.endswith(b')'):
+            return None
+
+        host = host[:-1]
+
+    return host
+
+
+#=============================================================================
+class HostBloomFilter(object):
+    """
+    Bloom filter of all the host keys (and, for SURT keys, all the domains)
+    of the urlkeys in an index file.
+
+    The filter is persisted next to the index file with the '.bloom'
+    extension, and is created at indexing time, eg. by
+    'wb-manager cdx-bloom'. The size and mtime of the index file are stored
+    in the filter, and if the index has since changed, the filter is ignored.
+
+    A query for an exact url, url prefix or host can be skipped if its host
+    is not in the filter, and a domain query if the domain is not in
+    the filter.
+    """
+    EXT = '.bloom'
+
+    MAGIC = b'PYWBBLOM'
+    VERSION = 1
+
+    # magic, version, num hashes, num bits, index size, index mtime
+    HEADER = struct.Struct('<8sBBxxxxxxQQQ')
+
+    DEFAULT_ERROR_RATE = 0.01
+
+    logger = logging.getLogger('warcserver')
+
+    _cache = {}
+
+    def __init__(self, num_bits, num_hashes, bits=None, stat_sig=None):
+        self.num_bits = num_bits
+        self.num_hashes = num_hashes
+        self.bits = bits if bits is not None else bytearray((num_bits + 7) // 8)
+        self.stat_sig = stat_sig
+
+    @classmethod
+    def for_capacity(cls, count, error_rate=DEFAULT_ERROR_RATE):
+        """ Create empty filter sized for 'count' keys,
+        with the specified false positive rate
+        """
+        count = max(count, 1)
+        num_bits = int(ceil(-count * log(error_rate) / (log(2) ** 2)))
+        num_bits = max(64, num_bits + (-num_bits % 8))
+        num_hashes = max(1, int(round(-log(error_rate) / log(2))))
+        return cls(num_bits, num_hashes)
+
+    def _positions(self, key):
+        # enhanced double hashing, see:
+        # Dillinger & Manolios, "Bloom Filters in Probabilistic Verification"
+        num_bits = self.num_bits
+        h1, h2 = struct.unpack('<QQ', md5(key).digest())
+        x = h1 % num_bits
+        y = h2 % num_bits
+        for i in range(self.num_hashes):
+            yield x
+            x = (x + y) % num_bits
+            y = (y + i + 1) % num_bits
+
+    def add(self, key):
+        bits = self.bits
+        for pos in self._positions(key):
+            bits[pos >> 3] |= 1 << (pos & 7)
+
+    def __contains__(self, key):
+        bits = self.bits
+        for pos in self._positions(key):
+            if not bits[pos >> 3] & (1 << (pos & 7)):
+                return False
+
+        return True
+
+    def may_contain(self, params):
+        """ Return False only if the index can not contain
+        any results for the query
+        """
+        key = query_filter_key(params)
+        if key is None:
+            return True
+
+        return key in self
+
+    @staticmethod
+    def _stat_sig(filename):
+        stat = os.stat(filename)
+        return (stat.st_size, stat.st_mtime_ns)
+
+    @classmethod
+    def load_for_file(cls, filename):
+        """ Return the filter for an index file, if one exists
+        and is up-to-date, otherwise None
+        """
+        try:
+            stat_sig = cls._stat_sig(filename)
+            filter_stat_sig = cls._stat_sig(filename + cls.EXT)
+        except OSError:
+            return None
+
+        cached = cls._cache.get(filename)
+        if cached and cached[0] == filter_stat_sig:
+            host_filter = cached[1]
+        else:
+            host_filter = cls.read(filename + cls.EXT)
+            cls._cache[filename] = (filter_stat_sig, host_filter)
+
+        if not host_filter or host_filter.stat_sig != stat_sig:
+            return None
+
+        return host_filter
+
+    @classmethod
+    def may_contain_file(cls, filename, params):
+        host_filter = cls.load_for_file(filename)
+        if not host_filter:
+            return True
+
+        return host_filter.may_contain(params)
+
+    @classmethod
+    def read(cls, filter_filename):
+        try:
+            with open(filter_filename, 'rb') as fh:
+                buff = fh.read()
+        except IOError:
+            return None
+
+        try:
+            magic, version, num_hashes, num_bits, size, mtime = cls.HEADER.unpack_from(buff, 0)
+        except struct.error:
+            magic = None
+
+        bits = bytearray(buff[cls.HEADER.size:])
+
+        if (magic != cls.MAGIC or version != cls.VERSION or
+            len(bits) != (num_bits + 7) // 8):
+            cls.logger.warning('Invalid host filter: ' + filter_filename)
+            return None
+
+        return cls(num_bits, num_hashes, bits, (size, mtime))
+
+    @classmethod
+    def build(cls, urlkeys, error_rate=DEFAULT_ERROR_RATE):
+        """ Build filter from an iterator of urlkeys
+        """
+        keys = set()
+        last_host = None
+        for urlkey in urlkeys:
+            host = host_key(urlkey)
+            if not host or host == last_host:
+                continue
+
+            last_host = host
+            keys.add(host)
+            keys.update(domain_keys(host))
+
+        host_filter = cls.for_capacity(len(keys), error_rate)
+        for key in keys:
+            host_filter.add(key)
+
+        return host_filter
+
+    @classmethod
+    def write_for_file(cls, filename, error_rate=DEFAULT_ERROR_RATE):
+        """ Build and atomically write the filter for an index file
+        """
+        stat_sig = cls._stat_sig(filename)
+
+        host_filter = cls.build(iter_urlkeys(filename), error_rate)
+        host_filter.stat_sig = stat_sig
+
+        filter_filename = filename + cls.EXT
+        tmp_filename = filter_filename + '.tmp.' + str(os.getpid())
+        try:
+            with open(tmp_filename, 'wb') as fh:
+                fh.write(cls.HEADER.pack(cls.MAGIC, cls.VERSION,
+                                         host_filter.num_hashes,
+                                         host_filter.num_bits,
+                                         stat_sig[0], stat_sig[1]))
+                fh.write(host_filter.bits)
+
+            os.replace(tmp_filename, filter_filename)
+        finally:
+            if os.path.exists(tmp_filename):
+                os.remove(tmp_filename)
+
+        return host_filter
+
+
+#=============================================================================
+def iter_urlkeys(filename):
+    """ Iterate over the urlkeys of a CDX, CDXJ, columnar or
+    ZipNum index file. For ZipNum, all the compressed cdx shards
+    listed in the summary (.idx) are read.
+    """
+    from pywb.warcserver.index.columnar import ColumnarIndex
+    from pywb.warcserver.index.zipnum import ZipNumIndexSource
+
+    if filename.endswith(ColumnarIndex.EXT):
+        index = ColumnarIndex.load(filename)
+        for i in range(len(index)):
+            yield index.value('urlkey', i).encode('utf-8')
+
+    elif filename.endswith(ZipNumIndexSource.IDX_EXT):
+        for line in _iter_zipnum_lines(ZipNumIndexSource(filename)):
+            yield line.split(b' ', 1)[0]
+
+    else:
+        with open(filename, 'rb') as fh:
+            for line in fh:
+                # skip cdx header
+                if line.startswith(b' CDX'):
+                    continue
+
+                yield line.split(b' ', 1)[0]
+
+
+def _iter_zipnum_lines(source):
+    parts = []
+    with open(source.summary, 'rb') as fh:
+        for line in fh:
+            part = line.split(b'\t')[1].decode('utf-8')
+            if not parts or parts[-1] != part:
+                parts.append(part)
+
+    for part in parts:
+        stream = None
+        last_exc = None
+        for location in source.loc_resolver(part, None):
+            try:
+                stream = source.blk_loader.load(location)
+                break
+            except Exception as exc:
+                last_exc = exc
+
+        if not stream:
+            raise last_exc or Exception('No Locations Found for: ' + part)
+
+        try:
+            for line in gzip.GzipFile(fileobj=stream):
+                yield line
+        finally:
+            stream.close()
@@ -1,15 +1,19 @@
 from six.moves.urllib.parse import quote_plus
-from warcio.timeutils import PAD_14_DOWN, http_date_to_timestamp, pad_timestamp, timestamp_now, timestamp_to_http_date
+from warcio.timeutils import PAD_14_DOWN, PAD_14_UP, http_date_to_timestamp, pad_timestamp, timestamp_now, timestamp_to_http_date
 
-from pywb.utils.binsearch import iter_range
+from pywb.utils.binsearch import BlockIndex, TimestampIndex, iter_lines_reverse, iter_range, search_offset
+from pywb.utils.cache import LRUCache
 from pywb.utils.canonicalize import canonicalize
-from pywb.utils.format import res_template
-from pywb.utils.io import no_except_close
+from pywb.utils.format import res_template, to_bool
+from pywb.utils.io import FileHandlePool, MMapReader, no_except_close
+from pywb.utils.loaders import read_last_line
 from pywb.utils.memento import MementoUtils
 from pywb.utils.wbexception import BadRequestException, NotFoundException
-from pywb.warcserver.http import DefaultAdapters
-from pywb.warcserver.index.cdxobject import CDXObject
-from pywb.warcserver.index.cdxops import cdx_sort_closest
+from pywb.warcserver.http import DefaultAdapters, PywbHttpAdapter
+from pywb.warcserver.index.cdxobject import CDXObject, LazyCDXObject
+from pywb.warcserver.index.cdxops import closest_timestamp, cdx_reverse_ties, cdx_sort_closest
+from pywb.warcserver.index.hostfilter import HostBloomFilter
+from pywb.warcserver.index.querycache import CacheableNotFoundException, QueryCache
 
 try:
     from lxml import etree
@@ -19,10 +23,14 @@ except:
 import redis
 
 import requests
+from urllib3.util.retry import Retry
+
+from itertools import takewhile
 
 import re
 import logging
 import os
+import time
 
 
 no_verify = os.environ.get("PYWB_NO_VERIFY_SSL")
@@ -34,9 +42,76 @@ class BaseIndexSource(object):
 
     logger = logging.getLogger('warcserver')
 
+    # open index file handles, shared by all local index sources
+    handle_pool = FileHandlePool()
+
+    query_cache = None
+
     def load_index(self, params):  #pragma: no cover
         raise NotImplemented()
 
+    def _load_cached_index(self, params, load_func):
+        """ Load the index with load_func(params), through
+        the query cache if this source has one
+        """
+        if not self.query_cache:
+            return load_func(params)
+
+        return self.query_cache.load(self._get_cache_key(params), load_func, params)
+
+    def _get_cache_key(self, params):  #pragma: no cover
+        raise NotImplemented()
+
+    def get_index_sig(self, params):
+        """ Return a signature of the index for the query, which changes
+        when the index changes, or None if changes can not be detected
+        """
+        return None
+
+    @staticmethod
+    def _file_sig(filename):
+        try:
+            stat = os.stat(filename)
+        except OSError:
+            return None
+
+        return (filename, stat.st_size, stat.st_mtime_ns)
+
+    @staticmethod
+    def _not_found(url, res=None):
+        """ Return the exception for a failed upstream query,
+        cacheable if the upstream responded with a 404
+        """
+        if res is not None and res.status_code == 404:
+            return CacheableNotFoundException(url)
+
+        return NotFoundException(url)
+
+    @staticmethod
+    def _iter_raw_cdxj(line_iter, close=None):
+        """ Return iterator over raw lines if the index is CDXJ,
+        (checking the first line), otherwise None
+        """
+        first = next(line_iter, None)
+        if first is not None and not first.split(b' ', 2)[-1].startswith(b'{'):
+            if close:
+                close()
+            return None
+
+        def do_iter():
+            try:
+                if first is None:
+                    return
+
+                yield first
+                for line in line_iter:
+                    yield line
+            finally:
+                if close:
+                    close()
+
+        return do_iter()
+
     def _get_referrer(self, params):
         input_req = params.get('_input_req')
         if input_req:
@@ -58,12 +133,23 @@ class BaseIndexSource(object):
 class FileIndexSource(BaseIndexSource):
     CDX_EXT = ('.cdx', '.cdxj')
 
+    # min size of the key range of each shard of a sharded query
+    SPLIT_MIN_SIZE = 4 * 1024 * 1024
+
     def __init__(self, filename, config=None):
         self.filename_template = filename
 
+        config = config or {}
+        self.use_block_index = config.get('block_index', False)
+        self.use_timestamp_index = config.get('timestamp_index', False)
+        self.use_mmap = config.get('mmap', False)
+
     def _do_open(self, filename):
         try:
-            return open(filename, 'rb')
+            if self.use_mmap:
+                return self.handle_pool.acquire(filename, MMapReader.open, 'mmap')
+
+            return self.handle_pool.acquire(filename)
         except IOError:
             raise NotFoundException(filename)
 
@@ -79,9 +165,190 @@ class FileIndexSource(BaseIndexSource):
 
         return do_iter()
 
+    def load_raw_index(self, params):
+        filename = res_template(self.filename_template, params)
+
+        fh = self._do_open(filename)
+
+        line_iter = iter_range(fh, params['key'], params['end_key'],
+                               block_index=self._get_block_index(fh),
+                               ts_index=self._get_timestamp_index(fh))
+
+        return self._iter_raw_cdxj(line_iter, fh.close)
+
+    def may_contain(self, params):
+        filename = res_template(self.filename_template, params)
+        return HostBloomFilter.may_contain_file(filename, params)
+
+    def get_index_sig(self, params):
+        return self._file_sig(res_template(self.filename_template, params))
+
+    def get_key_range(self):
+        """ Return the first and last urlkey in the index,
+        or None if the index is empty
+        """
+        with open(self.filename_template, 'rb') as fh:
+            first = fh.readline()
+
+            # skip cdx header
+            if first.startswith(b' CDX'):
+                first = fh.readline()
+
+            if not first.strip():
+                return None
+
+            last = read_last_line(fh)
+
+        return first.split(b' ', 1)[0], last.split(b' ', 1)[0]
+
+    def get_split_keys(self, params, num_splits):
+        """ Return up to num_splits - 1 urlkeys, evenly spaced by file
+        offset within the key range of the query, to split the query
+        into sub-ranges of about the same size.
+
+        Key ranges of less than SPLIT_MIN_SIZE bytes are not split
+        """
+        filename = res_template(self.filename_template, params)
+
+        split_keys = []
+
+        with self._do_open(filename) as fh:
+            start = self._search_offset(fh, params['key'])
+            end = self._search_offset(fh, params['end_key'])
+
+            num_splits = min(num_splits, (end - start) // self.SPLIT_MIN_SIZE)
+
+            for i in range(1, num_splits):
+                fh.seek(start + (end - start) * i // num_splits)
+                fh.readline()  # skip partial line
+                split_keys.append(fh.readline().split(b' ', 1)[0])
+
+        return split_keys
+
+    def load_closest(self, params):
+        """ For an exact url query, return iterators over the captures
+        from the closest timestamp forward and backward, each ordered
+        by distance from it. The file is only read as far as the
+        iterators are consumed.
+        """
+        filename = res_template(self.filename_template, params)
+
+        key = params['key']
+        end_key = params['end_key']
+        closest = closest_timestamp(params['closest']).encode('utf-8')
+
+        with self._do_open(filename) as fh:
+            offset = self._search_offset(fh, key + b' ' + closest,
+                                         params.get('_search_offsets'))
+
+        # handles acquired on first read, so that unread iterators hold none
+        def iter_forward():
+            with self._do_open(filename) as fh:
+                fh.seek(offset)
+                for line in fh:
+                    line = line.rstrip()
+                    if line >= end_key:
+                        break
+
+                    yield LazyCDXObject(line)
+
+        def iter_backward():
+            with self._do_open(filename) as fh:
+                for line in iter_lines_reverse(fh, offset):
+                    if line < key:
+                        break
+
+                    yield LazyCDXObject(line)
+
+        return [iter_forward(), cdx_reverse_ties(iter_backward())]
+
     def _do_iter(self, fh, params):
-        for line in iter_range(fh, params['key'], params['end_key']):
-            yield CDXObject(line)
+        key, end_key = self._get_timestamp_range(params)
+
+        offsets = params.get('_search_offsets')
+        if offsets is None:
+            line_iter = iter_range(fh, key, end_key,
+                                   block_index=self._get_block_index(fh),
+                                   ts_index=self._get_timestamp_index(fh))
+        else:
+            fh.seek(self._search_offset(fh, key, offsets))
+            line_iter = takewhile(lambda line: line < end_key,
+                                  (line.rstrip() for line in fh))
+
+        for line in line_iter:
+            yield LazyCDXObject(line)
+
+    def _search_offset(self, fh, key, offsets=None):
+        """ Return the offset of the first line >= key.
+
+        If an 'offsets' dict is provided, eg. for a batch of queries
+        in key order, the search starts from the offset found for
+        the previous key in this file, if not larger
+        """
+        min_offset = 0
+        last = offsets.get(fh.name) if offsets is not None else None
+        if last and last[0] <= key:
+            min_offset = last[1]
+
+        offset = search_offset(fh, key,
+                               block_index=self._get_block_index(fh),
+                               ts_index=self._get_timestamp_index(fh),
+                               min_offset=min_offset)
+
+        if offsets is not None:
+            offsets[fh.name] = (key, offset)
+
+        return offset
+
+    @staticmethod
+    def _get_timestamp_range(params):
+        """ For an exact url query with 'from' and/or 'to', narrow the
+        search range to 'urlkey from' - 'urlkey to', otherwise return
+        the query key and end_key
+        """
+        key = params['key']
+        end_key = params['end_key']
+
+        if params.get('matchType') != 'exact':
+            return key, end_key
+
+        from_ts = params.get('from') or params.get('from_ts')
+        to_ts = params.get('to')
+
+        # same padding as cdx_clamp(), which is still applied
+        if from_ts:
+            if len(from_ts) < 14:
+                from_ts = pad_timestamp(from_ts, PAD_14_DOWN)
+
+            key = key + b' ' + from_ts.encode('utf-8')
+
+        if to_ts:
+            if len(to_ts) < 14:
+                to_ts = pad_timestamp(to_ts, PAD_14_UP)
+
+            end_key = params['key'] + b' ' + to_ts.encode('utf-8') + b'!'
+
+        return key, end_key
+
+    def _get_block_index(self, fh):
+        if not self.use_block_index:
+            return None
+
+        try:
+            return BlockIndex.load_for_file(fh.name)
+        except Exception as e:
+            self.logger.debug('Block index not available: ' + str(e))
+            return None
+
+    def _get_timestamp_index(self, fh):
+        if not self.use_timestamp_index:
+            return None
+
+        try:
+            return TimestampIndex.load_for_file(fh.name)
+        except Exception as e:
+            self.logger.debug('Timestamp index not available: ' + str(e))
+            return None
 
     def __repr__(self):
         return '{0}(file://{1})'.format(self.__class__.__name__,
@@ -97,34 +364,56 @@ class FileIndexSource(BaseIndexSource):
         return self.filename_template == other.filename_template
 
     @classmethod
-    def init_from_string(cls, value):
+    def init_from_string(cls, value, config=None):
         if value.startswith('file://'):
-            return cls(value[7:])
+            return cls(value[7:], config)
 
         if not value.endswith(cls.CDX_EXT):
             return None
 
         if value.startswith('/') or '://' not in value:
-            return cls(value)
+            return cls(value, config)
 
     @classmethod
     def init_from_config(cls, config):
         if config['type'] != 'file':
             return
 
-        return cls.init_from_string(config['path'])
+        return cls.init_from_string(config['path'], config)
 
 
 #=============================================================================
 class RemoteIndexSource(BaseIndexSource):
     CDX_MATCH_RX = re.compile('^cdxj?\+(?P<url>https?\:.*)')
 
-    def __init__(self, api_url, replay_url, url_field='load_url', closest_limit=100):
+    STREAM_CHUNK_SIZE = 16384
+
+    def __init__(self, api_url, replay_url, url_field='load_url', closest_limit=100,
+                 stream=False, pool_size=None, query_cache=None):
         self.api_url = api_url
         self.replay_url = replay_url
         self.url_field = url_field
         self.closest_limit = closest_limit
-        self._init_sesh()
+        self.stream = stream
+        self.pool_size = pool_size
+        self.query_cache = query_cache
+        self._init_sesh(self._get_adapter(pool_size))
+
+    @staticmethod
+    def _get_adapter(pool_size):
+        """ Return a separate adapter for this upstream, keeping up to
+        'pool_size' keep-alive connections, or None to use the
+        shared remote adapter
+        """
+        if not pool_size:
+            return None
+
+        default = DefaultAdapters.remote_adapter
+        return PywbHttpAdapter(max_retries=Retry(3),
+                               cert_reqs=default.cert_reqs,
+                               ca_cert_dir=default.ca_cert_dir,
+                               pool_connections=1,
+                               pool_maxsize=int(pool_size))
 
     def _get_api_url(self, params):
         api_url = res_template(self.api_url, params)
@@ -137,15 +426,30 @@ class RemoteIndexSource(BaseIndexSource):
         return api_url
 
     def load_index(self, params):
+        return self._load_cached_index(params, self._load_index)
+
+    def _get_cache_key(self, params):
+        return ' '.join((repr(self), self._get_api_url(params), self._get_src_coll(params)))
+
+    def _load_index(self, params):
         api_url = self._get_api_url(params)
+        r = None
         try:
-            r = self.sesh.get(api_url, timeout=params.get('_timeout'))
+            r = self.sesh.get(api_url, timeout=params.get('_timeout'),
+                              stream=self.stream)
             r.raise_for_status()
         except Exception as e:
+            if r is not None:
+                r.close()
+
             self.logger.debug('FAILED: ' + str(e))
-            raise NotFoundException(api_url)
+            raise self._not_found(api_url, r)
+
+        if self.stream:
+            lines = self._iter_stream_lines(r)
+        else:
+            lines = r.content.strip().split(b'\n')
 
-        lines = r.content.strip().split(b'\n')
         def do_load(lines):
             for line in lines:
                 if not line:
@@ -157,11 +461,27 @@ class RemoteIndexSource(BaseIndexSource):
 
         return do_load(lines)
 
-    def _set_load_url(self, cdx, params):
-        source_coll = ''
+    def _iter_stream_lines(self, r):
+        """ Iterate over the lines of the response as they are received,
+        reading at most 'STREAM_CHUNK_SIZE' bytes at a time, and releasing
+        the connection when done
+        """
+        try:
+            for line in r.iter_lines(chunk_size=self.STREAM_CHUNK_SIZE,
+                                     delimiter=b'\n'):
+                yield line
+        finally:
+            r.close()
+
+    def _get_src_coll(self, params):
         name = params.get('_name')
         if name:
-            source_coll = params.get('param.' + name + '.src_coll', '')
+            return params.get('param.' + name + '.src_coll', '')
+
+        return ''
+
+    def _set_load_url(self, cdx, params):
+        source_coll = self._get_src_coll(params)
 
         cdx[self.url_field] = res_template(self.replay_url, dict(url=cdx['url'],
                                                      timestamp=cdx['timestamp'],
@@ -211,7 +531,10 @@ class RemoteIndexSource(BaseIndexSource):
         if config['type'] != 'cdx':
             return
 
-        return cls(config['api_url'], config['replay_url'])
+        return cls(config['api_url'], config['replay_url'],
+                   stream=to_bool(config.get('stream')),
+                   pool_size=config.get('pool_size'),
+                   query_cache=QueryCache.init_from_config(config))
 
 
 # =============================================================================
@@ -437,6 +760,8 @@ class LiveIndexSource(BaseIndexSource):
 
 #=============================================================================
 class RedisIndexSource(BaseIndexSource):
+    KEY_CACHE_SIZE = 1000
+
     def __init__(self, redis_url=None, redis=None, key_template=None, **kwargs):
         if redis_url:
             redis, key_template = self.parse_redis_url(redis_url, redis)
@@ -448,6 +773,11 @@ class RedisIndexSource(BaseIndexSource):
 
         self.member_key_type = None
 
+        # cache of scanned keys and member key sets
+        self.key_cache_ttl = float(kwargs.get('key_cache_ttl') or 0)
+        self.key_version_key = kwargs.get('key_version_key')
+        self.key_cache = LRUCache(self.KEY_CACHE_SIZE)
+
     @staticmethod
     def parse_redis_url(redis_url, redis_=None):
         parts = redis_url.split('/')
@@ -466,7 +796,12 @@ class RedisIndexSource(BaseIndexSource):
             member_key = self.member_key_template
 
         if not member_key:
-            return self.redis.scan_iter(match=match_templ)
+            if not self.key_cache_ttl:
+                return self.redis.scan_iter(match=match_templ)
+
+            return self._load_cached_keys('scan:' + match_templ,
+                                          lambda: list(self.redis.scan_iter(match=match_templ)),
+                                          params)
 
         key = res_template(member_key, params)
 
@@ -474,13 +809,38 @@ class RedisIndexSource(BaseIndexSource):
         # check if already have keys to avoid extra redis call
         keys = params.get(scan_key)
         if not keys:
-            keys = self._load_key_set(key)
+            keys = self._load_cached_keys('member:' + key,
+                                          lambda: self._load_key_set(key),
+                                          params)
             params[scan_key] = keys
 
         #match_templ = match_templ.encode('utf-8')
 
         return [match_templ.replace('*', key) for key in keys]
 
+    def _load_cached_keys(self, cache_key, load_func, params):
+        """ Return keys loaded with load_func(), cached for 'key_cache_ttl'
+        seconds, if set.
+
+        If 'key_version_key' is also set, the cached keys are also reloaded
+        whenever the value of that key changes, eg. incremented when keys are added
+        """
+        if not self.key_cache_ttl:
+            return load_func()
+
+        version = None
+        if self.key_version_key:
+            version = self.redis.get(res_template(self.key_version_key, params))
+
+        now = time.time()
+        cached = self.key_cache.get(cache_key)
+        if cached and cached[0] > now and cached[1] == version:
+            return cached[2]
+
+        keys = load_func()
+        self.key_cache.put(cache_key, (now + self.key_cache_ttl, version, keys))
+        return keys
+
     def _load_key_set(self, key):
         if not self.member_key_type:
             self.member_key_type = self.redis.type(key)
@@ -501,18 +861,22 @@ class RedisIndexSource(BaseIndexSource):
         return self.load_key_index(self.redis_key_template, params)
 
     def load_key_index(self, key_template, params):
-        z_key = res_template(key_template, params)
-        index_list = self.redis.zrangebylex(z_key,
-                                            b'[' + params['key'],
-                                            b'(' + params['end_key'])
+        index_list = self.redis.zrangebylex(*self.get_range_args(key_template, params))
+        return self.iter_cdx(index_list)
 
-        def do_load(index_list):
-            for line in index_list:
-                if isinstance(line, str):
-                    line = line.encode('utf-8')
-                yield CDXObject(line)
+    @staticmethod
+    def get_range_args(key_template, params):
+        """ Return the key and range for the ZRANGEBYLEX query
+        """
+        z_key = res_template(key_template, params)
+        return z_key, b'[' + params['key'], b'(' + params['end_key']
 
-        return do_load(index_list)
+    @staticmethod
+    def iter_cdx(index_list):
+        for line in index_list:
+            if isinstance(line, str):
+                line = line.encode('utf-8')
+            yield LazyCDXObject(line)
 
     def __repr__(self):
         return '{0}({1}, {2}, {3})'.format(self.__class__.__name__,
@@ -540,15 +904,21 @@ class RedisIndexSource(BaseIndexSource):
         if config['type'] != 'redis':
             return
 
-        return cls.init_from_string(config['redis_url'])
+        if not config['redis_url'].startswith('redis://'):
+            return
+
+        return cls(config['redis_url'],
+                   key_cache_ttl=config.get('key_cache_ttl'),
+                   key_version_key=config.get('key_version_key'))
 
 
 #=============================================================================
 class MementoIndexSource(BaseIndexSource):
-    def __init__(self, timegate_url, timemap_url, replay_url):
+    def __init__(self, timegate_url, timemap_url, replay_url, query_cache=None):
         self.timegate_url = timegate_url
         self.timemap_url = timemap_url
         self.replay_url = replay_url
+        self.query_cache = query_cache
         self._init_sesh()
 
     def links_to_cdxobject(self, link_header, def_name):
@@ -584,6 +954,7 @@ class MementoIndexSource(BaseIndexSource):
     def get_timegate_links(self, params, timestamp):
         url = res_template(self.timegate_url, params)
         accept_dt = timestamp_to_http_date(timestamp)
+        res = None
         try:
             headers = self._get_headers(params)
             headers['Accept-Datetime'] = accept_dt
@@ -591,7 +962,7 @@ class MementoIndexSource(BaseIndexSource):
             res.raise_for_status()
         except Exception as e:
             self.logger.debug('FAILED: ' + str(e))
-            raise NotFoundException(url)
+            raise self._not_found(url, res)
 
         links = res.headers.get('Link')
 
@@ -618,18 +989,26 @@ class MementoIndexSource(BaseIndexSource):
         except Exception as e:
             no_except_close(res)
             self.logger.debug('FAILED: ' + str(e))
-            raise NotFoundException(url)
+            raise self._not_found(url, res)
 
         links = res.text
         return self.links_to_cdxobject(links, 'timemap')
 
     def load_index(self, params):
-        timestamp = params.get('closest')
-
         # can't do fuzzy matching via memento
         if params.get('is_fuzzy'):
             raise NotFoundException(params['url'] + '*')
 
+        return self._load_cached_index(params, self._load_index)
+
+    def _get_cache_key(self, params):
+        headers = self._get_headers(params)
+        return ' '.join([repr(self), params['url'], params.get('closest') or ''] +
+                        ['{0}: {1}'.format(n, headers[n]) for n in sorted(headers)])
+
+    def _load_index(self, params):
+        timestamp = params.get('closest')
+
         if not timestamp:
             return self.handle_timemap(params)
         else:
@@ -680,7 +1059,8 @@ class MementoIndexSource(BaseIndexSource):
 
         return cls(config['timegate_url'],
                    config['timemap_url'],
-                   config['replay_url'])
+                   config['replay_url'],
+                   query_cache=QueryCache.init_from_config(config))
 
 
 #=============================================================================
@@ -688,8 +1068,9 @@ class WBMementoIndexSource(MementoIndexSource):
     WBURL_MATCH = re.compile('([0-9]{0,14})?(?:\w+_)?/{0,3}(.*)')
     WAYBACK_ORIG_SUFFIX = '{timestamp}im_/{url}'
 
-    def __init__(self, timegate_url, timemap_url, replay_url):
-        super(WBMementoIndexSource, self).__init__(timegate_url, timemap_url, replay_url)
+    def __init__(self, timegate_url, timemap_url, replay_url, query_cache=None):
+        super(WBMementoIndexSource, self).__init__(timegate_url, timemap_url, replay_url,
+                                                   query_cache=query_cache)
         self.prefix = replay_url.split('{', 1)[0]
 
     def _get_referrer(self, params):
@@ -737,7 +1118,7 @@ class WBMementoIndexSource(MementoIndexSource):
         if res and res.headers.get('Memento-Datetime'):
             if res.status_code >= 400:
                 no_except_close(res)
-                raise NotFoundException(url)
+                raise self._not_found(url, res)
 
             if res.status_code >= 300:
                 info = self._extract_location(url, res.headers.get('Location'))
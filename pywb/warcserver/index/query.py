@@ -30,6 +30,11 @@ class CDXQuery(object):
         self.params['key'] = start.encode('utf-8')
         self.params['end_key'] = end.encode('utf-8')
 
+        # sub-range of the full key range, for one shard of a sharded query
+        key_range = self.params.get('_key_range')
+        if key_range:
+            self.set_key(*key_range)
+
     @property
     def key(self):
         return self.params['key']
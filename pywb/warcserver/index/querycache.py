@@ -0,0 +1,173 @@
+"""
+TTL cache of the results of remote index queries, shared by all
+remote CDX and Memento index sources, stored either in-process
+or in Redis.
+"""
+
+from hashlib import md5
+from itertools import chain, islice
+
+import logging
+import time
+
+from pywb.utils.cache import LRUCache
+from pywb.utils.wbexception import NotFoundException
+from pywb.warcserver.index.cdxobject import CDXObject
+
+
+#=============================================================================
+class CacheableNotFoundException(NotFoundException):
+    """ Raised when an upstream index responded that it has no results for
+    a query (a 404), as opposed to failing to respond, so that the result
+    may be cached
+    """
+
+
+#=============================================================================
+class QueryCache(object):
+    """
+    In-process cache of index query results, with a ttl in seconds for
+    found and for not found results.
+
+    Entries of all sources are stored in a single LRU cache, bounded by
+    number of entries, which can be set with the top-level
+    'index_query_cache_size' option.
+
+    Results are stored serialized as CDXJ, so that each cache hit returns
+    new cdx objects.
+
+    Only results of up to max_lines cdx lines are cached. Results are read
+    ahead up to max_lines + 1 lines, and any larger result is passed through
+    uncached, so that large (eg. prefix or streamed) results are not
+    buffered in memory.
+    """
+    DEFAULT_TTL = 300
+    DEFAULT_NOT_FOUND_TTL = 60
+    DEFAULT_CACHE_SIZE = 10000
+    DEFAULT_MAX_LINES = 1000
+
+    logger = logging.getLogger('warcserver')
+
+    local_cache = LRUCache(DEFAULT_CACHE_SIZE)
+
+    def __init__(self, ttl=DEFAULT_TTL, not_found_ttl=DEFAULT_NOT_FOUND_TTL,
+                 max_lines=DEFAULT_MAX_LINES):
+        self.ttl = ttl
+        self.not_found_ttl = not_found_ttl
+        self.max_lines = max_lines
+
+    def load(self, key, load_func, params):
+        """ Return the cached results for the query key, or load them with
+        load_func(params) and cache them, if not more than max_lines.
+
+        If the query is cached as not found, raise NotFoundException
+        """
+        cached = self._get(key)
+        if cached is not None:
+            found, value = cached
+            if not found:
+                raise NotFoundException(value)
+
+            return (CDXObject(line) for line in value)
+
+        try:
+            cdx_iter = load_func(params)
+            cdx_list = list(islice(cdx_iter, self.max_lines + 1))
+        except CacheableNotFoundException as nf:
+            if self.not_found_ttl:
+                self._put(key, (False, nf.msg), self.not_found_ttl)
+            raise
+
+        # too large to cache, pass through the rest of the results
+        if len(cdx_list) > self.max_lines:
+            return chain(cdx_list, cdx_iter)
+
+        if self.ttl:
+            lines = [cdx.to_cdxj().encode('utf-8') for cdx in cdx_list]
+            self._put(key, (True, lines), self.ttl)
+
+        return iter(cdx_list)
+
+    def _get(self, key):
+        entry = self.local_cache.get(key)
+        if entry is None:
+            return None
+
+        expires, value = entry
+        if expires <= time.time():
+            self.local_cache.remove(key)
+            return None
+
+        return value
+
+    def _put(self, key, value, ttl):
+        self.local_cache.put(key, (time.time() + ttl, value))
+
+    @classmethod
+    def init_from_config(cls, config):
+        """ Return the cache for an index source config, if 'cache_ttl'
+        is set, stored in Redis if 'cache_redis_url' is also set
+        """
+        ttl = config.get('cache_ttl')
+        if not ttl:
+            return None
+
+        ttl = int(ttl)
+        not_found_ttl = int(config.get('cache_not_found_ttl', cls.DEFAULT_NOT_FOUND_TTL))
+        max_lines = int(config.get('cache_max_lines', cls.DEFAULT_MAX_LINES))
+
+        redis_url = config.get('cache_redis_url')
+        if redis_url:
+            return RedisQueryCache(redis_url, ttl, not_found_ttl, max_lines)
+
+        return QueryCache(ttl, not_found_ttl, max_lines)
+
+
+#=============================================================================
+class RedisQueryCache(QueryCache):
+    """
+    Cache of index query results stored in Redis, shared by all
+    processes using the same Redis. The url is of the same form as for
+    a Redis index, eg. 'redis://localhost:6379/0/pywb:querycache:',
+    with the last part used as the prefix of all keys.
+
+    Redis errors are logged and treated as a cache miss.
+    """
+    def __init__(self, redis_url, ttl=QueryCache.DEFAULT_TTL,
+                 not_found_ttl=QueryCache.DEFAULT_NOT_FOUND_TTL,
+                 max_lines=QueryCache.DEFAULT_MAX_LINES, redis=None):
+        super(RedisQueryCache, self).__init__(ttl, not_found_ttl, max_lines)
+
+        from pywb.warcserver.index.indexsource import RedisIndexSource
+        self.redis, self.key_prefix = RedisIndexSource.parse_redis_url(redis_url, redis)
+
+    def _redis_key(self, key):
+        return self.key_prefix + md5(key.encode('utf-8')).hexdigest()
+
+    def _get(self, key):
+        try:
+            value = self.redis.get(self._redis_key(key))
+        except Exception as e:
+            self.logger.warning('Query cache get failed: ' + str(e))
+            return None
+
+        if not value:
+            return None
+
+        # '+' followed by cdxj lines, or '-' followed by not found message
+        if value[0] == '-':
+            return (False, value[1:])
+
+        return (True, [line.encode('utf-8') for line in value[1:].split('\n') if line])
+
+    def _put(self, key, value, ttl):
+        found, value = value
+        if found:
+            value = '+' + ''.join(line.decode('utf-8') for line in value)
+        else:
+            value = '-' + (value or '')
+
+        try:
+            self.redis.setex(self._redis_key(key), int(ttl), value)
+        except Exception as e:
+            self.logger.warning('Query cache put failed: ' + str(e))
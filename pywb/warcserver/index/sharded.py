@@ -0,0 +1,212 @@
+"""
+Parallel execution of large prefix and domain index queries, split into
+key sub-ranges (shards) which are each loaded and processed in a pool of
+worker processes.
+"""
+
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import logging
+import multiprocessing
+import pickle
+
+from pywb.utils.wbexception import WbException
+from pywb.warcserver.index.cdxops import cdx_collapse_time_status, cdx_limit, process_cdx
+from pywb.warcserver.index.query import CDXQuery
+
+
+#=============================================================================
+def load_shard(data, key_range):
+    """ Load and process the cdx of one key sub-range of a query, in a worker
+    process, returning the list of cdx objects
+
+    :param data: the pickled (aggregator, params) of the query
+    :param key_range: the (key, end_key) of the shard
+    """
+    agg, params = pickle.loads(data)
+
+    params['_key_range'] = key_range
+    query = CDXQuery(params)
+
+    cdx_iter, errs = agg.load_index(query.params)
+
+    return list(process_cdx(cdx_iter, query))
+
+
+#=============================================================================
+class ShardedQuery(object):
+    """
+    Runs non-exact (prefix, host and domain) queries over local CDXJ and
+    ZipNum indexes in a pool of worker processes.
+
+    The key range of the query is split into up to 'shards' sub-ranges,
+    using the file offsets and ZipNum summary lines of the indexes. Each
+    shard is loaded, merged, filtered, clamped, collapsed and limited in a
+    worker process, with up to 'processes' shards loaded concurrently.
+    As the shards are consecutive key ranges, their results are returned
+    in order, with collapsing and the limit applied again across shards.
+
+    Queries which are exact, sorted by closest or in reverse, resolve
+    revisits or are paged, and queries with any source which is not a
+    local index, are not sharded.
+
+    Under gevent, the process pool is only used if the threading module
+    is also monkey-patched, as the pool's threads can not be managed with
+    only some modules patched.
+    """
+    logger = logging.getLogger('warcserver')
+
+    def __init__(self, processes, shards=None):
+        self.processes = processes
+        self.num_shards = shards or processes * 2
+        self._executor = None
+        self._warned_gevent = False
+
+    def __getstate__(self):
+        # the process pool is not passed to worker processes
+        state = self.__dict__.copy()
+        state['_executor'] = None
+        return state
+
+    def attach(self, agg):
+        """ Use this sharded query for queries over the aggregator, if it
+        can be passed to worker processes, returning True if attached
+        """
+        try:
+            pickle.dumps(agg, pickle.HIGHEST_PROTOCOL)
+        except Exception as e:
+            self.logger.debug('Aggregator not sharded: ' + str(e))
+            return False
+
+        agg.sharded_query = self
+        return True
+
+    @staticmethod
+    def _is_mixed_gevent_patching():
+        try:
+            from gevent import monkey
+        except ImportError:  #pragma: no cover
+            return False
+
+        return monkey.is_anything_patched() and not monkey.is_module_patched('threading')
+
+    @property
+    def executor(self):
+        if not self._executor:
+            # workers are started from a new interpreter, as forking
+            # a process using gevent or threads is not safe
+            self._executor = ProcessPoolExecutor(max_workers=self.processes,
+                                                 mp_context=multiprocessing.get_context('spawn'))
+
+        return self._executor
+
+    def can_shard(self, query):
+        return (not query.is_exact and not query.closest and not query.reverse and
+                not query.resolve_revisits and not query.page_count and
+                not query.secondary_index_only and not query.custom_ops and
+                'page' not in query.params and 'pageSize' not in query.params)
+
+    def __call__(self, agg, query):
+        """ Return (cdx iterator, errs) for the query over the sources
+        of the aggregator, or None if the query is not sharded
+        """
+        if not self.can_shard(query):
+            return None
+
+        if not self._executor and self._is_mixed_gevent_patching():
+            if not self._warned_gevent:
+                self.logger.warning('Index queries not sharded, gevent has not patched threading')
+                self._warned_gevent = True
+
+            return None
+
+        params = dict((name, value) for name, value in query.params.items()
+                      if not name.startswith('_'))
+
+        # checked before reading the split keys of the sources
+        try:
+            data = pickle.dumps((agg, params), pickle.HIGHEST_PROTOCOL)
+        except Exception as e:
+            self.logger.debug('Query not sharded: ' + str(e))
+            return None
+
+        errs = []
+        try:
+            split_keys = self.get_split_keys(agg, query.params, errs)
+        except WbException:
+            return None
+
+        if not split_keys:
+            return None
+
+        bounds = [query.key] + split_keys + [query.end_key]
+        key_ranges = list(zip(bounds[:-1], bounds[1:]))
+
+        cdx_iter = self._iter_shards(data, key_ranges)
+
+        collapse_time = query.collapse_time
+        if collapse_time:
+            cdx_iter = cdx_collapse_time_status(cdx_iter, collapse_time)
+
+        return cdx_limit(cdx_iter, query.limit), errs
+
+    def get_split_keys(self, agg, params, errs):
+        """ Return up to num_shards - 1 sorted urlkeys within the key range
+        of the query, evenly spaced among the split keys of all sources,
+        including sources of nested aggregators, or None if any source
+        does not support splitting
+        """
+        split_keys = set()
+
+        for name, source in agg._iter_query_sources(params):
+            if hasattr(source, '_iter_query_sources'):
+                res = self.get_split_keys(source, params, errs)
+
+            elif hasattr(source, 'get_split_keys'):
+                try:
+                    res = source.get_split_keys(params, self.num_shards)
+                except WbException as wbe:
+                    errs.append((name, repr(wbe)))
+                    continue
+
+            else:
+                return None
+
+            if res is None:
+                return None
+
+            split_keys.update(res)
+
+        split_keys = sorted(split_key for split_key in split_keys
+                            if params['key'] < split_key < params['end_key'])
+
+        if len(split_keys) < self.num_shards:
+            return split_keys
+
+        return [split_keys[len(split_keys) * i // self.num_shards]
+                for i in range(1, self.num_shards)]
+
+    def _iter_shards(self, data, key_ranges):
+        pending = deque()
+
+        try:
+            for key_range in key_ranges:
+                pending.append(self.executor.submit(load_shard, data, key_range))
+
+                if len(pending) > self.processes:
+                    for cdx in pending.popleft().result():
+                        yield cdx
+
+            while pending:
+                for cdx in pending.popleft().result():
+                    yield cdx
+
+        finally:
+            for future in pending:
+                future.cancel()
+
+    def close(self):
+        if self._executor:
+            self._executor.shutdown(cancel_futures=True)
+            self._executor = None
@@ -1,7 +1,7 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
-from pywb.warcserver.index.cdxobject import CDXObject, IDXObject, CDXException
+from pywb.warcserver.index.cdxobject import CDXObject, IDXObject, CDXException, LazyCDXObject
 from pytest import raises
 
 def test_empty_cdxobject():
@@ -53,3 +53,48 @@ def test_lt_le():
     assert A < C
 
 
+
+
+def test_lazy_cdxobject():
+    line = b'com,example)/ 2016 {"url": "http://example.com/", "status": 200, "filename": "example.warc.gz"}'
+    x = LazyCDXObject(line)
+    assert x['urlkey'] == 'com,example)/'
+    assert x['timestamp'] == '2016'
+    assert x._json_block
+
+    # unmodified, original line
+    assert x.to_cdxj() == line.decode('utf-8') + '\n'
+    assert x.to_text() == line.decode('utf-8') + '\n'
+    assert x._json_block
+
+    assert x.get('status') == '200'
+    assert not x._json_block
+    assert x == CDXObject(line)
+    assert list(x.items()) == list(CDXObject(line).items())
+
+    x['source'] = 'coll'
+    assert x.to_cdxj() == 'com,example)/ 2016 {"url": "http://example.com/", "status": "200", "filename": "example.warc.gz", "source": "coll"}\n'
+
+
+def test_lazy_cdxobject_load_on_access():
+    line = b'com,example)/ 2016 {"url": "http://example.com/"}'
+    assert 'url' in LazyCDXObject(line)
+    assert 'mime' not in LazyCDXObject(line)
+    assert LazyCDXObject(line)['url'] == 'http://example.com/'
+    assert len(LazyCDXObject(line)) == 3
+    assert list(LazyCDXObject(line)) == ['urlkey', 'timestamp', 'url']
+    assert LazyCDXObject(line) == LazyCDXObject(line)
+    assert LazyCDXObject(line).to_json() == CDXObject(line).to_json()
+
+    with raises(KeyError):
+        LazyCDXObject(line)['mime']
+
+    # non-cdxj loaded immediately
+    x = LazyCDXObject(b'com,example)/ 2016 http://example.com/ text/html 200 ABC - - 10 20 example.warc.gz')
+    assert x['mime'] == 'text/html'
+    assert len(x) == 11
+
+
+def test_lazy_unicode_url():
+    x = LazyCDXObject(u'com,example,cafe)/ 123 {"url": "http://example.com/café/path"}'.encode('utf-8'))
+    assert x.to_cdxj() == 'com,example,cafe)/ 123 {"url": "http://example.com/caf%C3%A9/path"}\n'
@@ -0,0 +1,184 @@
+from pywb.warcserver.index.aggregator import SimpleAggregator, DirectoryIndexSource, BaseAggregator
+from pywb.warcserver.index.columnar import ColumnarIndex
+from pywb.warcserver.index.cdxobject import CDXObject, LazyCDXObject
+from pywb.warcserver.index.cdxops import cdx_sort_closest
+from pywb.warcserver.index import indexsource
+from pywb.utils.binsearch import TimestampIndex
+
+from pywb.warcserver.test.testutils import TEST_CDX_PATH
+
+from warcio.timeutils import datetime_to_timestamp
+
+from mock import patch
+from datetime import datetime, timedelta
+
+import pytest
+import shutil
+import tempfile
+import os
+
+
+# ============================================================================
+def setup_module():
+    global root_dir
+    root_dir = tempfile.mkdtemp()
+
+    global index_dir
+    index_dir = os.path.join(root_dir, 'indexes')
+    os.makedirs(index_dir)
+
+    for name in ('iana.cdxj', 'dupes.cdxj', 'example.cdxj'):
+        shutil.copy(TEST_CDX_PATH + name, index_dir)
+
+    # same captures as iana.cdxj, in columnar format, for ties across sources
+    with open(TEST_CDX_PATH + 'iana.cdxj', 'rb') as fh:
+        ColumnarIndex.write(os.path.join(index_dir, 'iana.cdxc'),
+                            (CDXObject(line) for line in fh))
+
+    # many captures of one url
+    global many_cdxj
+    many_cdxj = os.path.join(root_dir, 'many.cdxj')
+    with open(many_cdxj, 'wb') as fh:
+        for i in range(5000):
+            fh.write(b'com,example)/ %s {"url": "http://example.com/", "offset": "%d"}\n' % (ts(i), i))
+
+
+def teardown_module():
+    shutil.rmtree(root_dir)
+
+
+def ts(minutes):
+    return datetime_to_timestamp(datetime(2015, 1, 1) + timedelta(minutes=minutes)).encode('utf-8')
+
+
+def query(source, params):
+    params = dict(params, nosource='true')
+    cdx_iter, errs = SimpleAggregator({'source': source})(params)
+    return [cdx.to_text() for cdx in cdx_iter]
+
+
+no_closest_query = staticmethod(lambda query: False)
+
+
+# ============================================================================
+@pytest.mark.parametrize('params', [
+    dict(url='http://www.iana.org/_css/2013.1/fonts/opensans-bold.ttf', closest='20140126200826'),
+    dict(url='http://www.iana.org/_css/2013.1/fonts/opensans-bold.ttf', closest='20140126200826', limit=3),
+    dict(url='http://www.iana.org/_css/2013.1/fonts/opensans-bold.ttf', closest='2014'),
+    dict(url='http://www.iana.org/_css/2013.1/fonts/opensans-bold.ttf', closest='2020', limit=2),
+    dict(url='http://www.iana.org/_css/2013.1/fonts/opensans-bold.ttf', closest='20140126201240',
+         filter='!mime:warc/revisit', limit=2),
+    dict(url='http://www.iana.org/_css/2013.1/fonts/opensans-bold.ttf', closest='20140126200826',
+         **{'from': '20140126200700', 'to': '20140126201000'}),
+    dict(url='http://example.com/', closest='20140127171250'),
+    dict(url='http://example.com/', closest='20140127171251', limit=1),
+    dict(url='http://iana.org/', closest='20140127171238'),
+    dict(url='http://iana.org/dont_have_this', closest='20140127171238'),
+])
+def test_closest_same_as_sorted(params):
+    source = DirectoryIndexSource(index_dir)
+    res = query(source, params)
+
+    with patch.object(BaseAggregator, '_is_closest_query', no_closest_query):
+        expected = query(source, params)
+
+    assert res == expected
+
+
+@pytest.mark.parametrize('reverse', [False, True])
+def test_closest_ties_independent_of_source_order(reverse):
+    params = dict(url='http://www.iana.org/_css/2013.1/fonts/opensans-bold.ttf', closest='20140126200826')
+
+    def query_with_source(source):
+        cdx_iter, errs = SimpleAggregator({'source': source})(dict(params))
+        return [cdx.to_text() for cdx in cdx_iter]
+
+    source = DirectoryIndexSource(index_dir)
+
+    with patch.object(BaseAggregator, '_is_closest_query', no_closest_query):
+        expected = query_with_source(source)
+
+    # iana.cdxj and iana.cdxc have the same captures, listed in either order
+    orig_listdir = os.listdir
+    listdir = lambda the_dir: sorted(orig_listdir(the_dir), reverse=reverse)
+
+    with patch('pywb.warcserver.index.aggregator.os.listdir', listdir):
+        res = query_with_source(source)
+
+    assert 'source:iana.cdxc' in res[0]
+    assert 'source:iana.cdxj' in res[1]
+    assert res == expected
+
+
+def test_closest_reads_near_captures_only():
+    source = indexsource.FileIndexSource(many_cdxj)
+
+    created = []
+
+    class CountLazyCDXObject(LazyCDXObject):
+        def __init__(self, *args, **kwargs):
+            created.append(1)
+            super(CountLazyCDXObject, self).__init__(*args, **kwargs)
+
+    params = dict(url='http://example.com/', closest=ts(2500).decode('utf-8'), limit=3)
+
+    with patch.object(indexsource, 'LazyCDXObject', CountLazyCDXObject):
+        res = query(source, params)
+
+    assert [line.split(' ')[1].encode('utf-8') for line in res] == [ts(2500), ts(2499), ts(2501)]
+    assert len(created) < 10
+
+    with patch.object(BaseAggregator, '_is_closest_query', no_closest_query):
+        assert query(source, params) == res
+
+
+def test_sort_closest_ascending_stops():
+    lines = [b'com,example)/ %s {}' % ts(i * 2) for i in range(1000)]
+    read = []
+
+    def cdx_iter():
+        for line in lines:
+            read.append(line)
+            yield CDXObject(line)
+
+    closest = ts(201).decode('utf-8')
+
+    res = list(cdx_sort_closest(closest, cdx_iter(), limit=2, ascending=True))
+    assert [cdx['timestamp'].encode('utf-8') for cdx in res] == [ts(200), ts(202)]
+    assert len(read) < 110
+
+    read[:] = []
+    assert list(cdx_sort_closest(closest, cdx_iter(), limit=2)) == res
+    assert len(read) == 1000
+
+
+@pytest.mark.parametrize('params', [
+    dict(url='http://example.com/', **{'from': '201501020300', 'to': '201501020310'}),
+    dict(url='http://example.com/', **{'from': '2015010203'}),
+    dict(url='http://example.com/', to='2015010101'),
+    dict(url='http://example.com/', closest='20150102030405', limit=5),
+    dict(url='http://example.com/', closest='20150102030405', to='20150102030405', limit=5),
+    dict(url='http://example.com/', matchType='prefix', **{'from': '2015010402', 'to': '2015010403'}),
+])
+def test_timestamp_index_queries(params):
+    expected = query(indexsource.FileIndexSource(many_cdxj), params)
+    assert len(expected) > 0
+
+    created = []
+
+    class CountLazyCDXObject(LazyCDXObject):
+        def __init__(self, *args, **kwargs):
+            created.append(1)
+            super(CountLazyCDXObject, self).__init__(*args, **kwargs)
+
+    source = indexsource.FileIndexSource(many_cdxj, dict(timestamp_index=True))
+
+    # no binary search of the file needed
+    with patch.object(indexsource, 'LazyCDXObject', CountLazyCDXObject):
+        with patch('pywb.utils.binsearch.binsearch_offset', side_effect=AssertionError):
+            assert query(source, params) == expected
+
+    assert os.path.isfile(many_cdxj + TimestampIndex.EXT)
+
+    if params.get('matchType') != 'prefix':
+        assert len(created) <= len(expected) + 10
@@ -0,0 +1,166 @@
+from pywb.warcserver.index.columnar import ColumnarIndex, ColumnarIndexSource
+from pywb.warcserver.index.indexsource import FileIndexSource
+from pywb.warcserver.index.aggregator import SimpleAggregator, DirectoryIndexSource
+from pywb.warcserver.index.cdxobject import CDXObject
+from pywb.warcserver.warcserver import init_index_source
+
+from pywb.warcserver.test.testutils import TEST_CDX_PATH
+
+from pywb.manager.manager import CollectionsManager
+
+from mock import patch
+
+import pytest
+import shutil
+import tempfile
+import tracemalloc
+import os
+
+
+# ============================================================================
+def setup_module():
+    global root_dir
+    root_dir = tempfile.mkdtemp()
+
+    global cdxc_path
+    cdxc_path = os.path.join(root_dir, 'iana.cdxc')
+
+    with open(TEST_CDX_PATH + 'iana.cdxj', 'rb') as fh:
+        ColumnarIndex.write(cdxc_path, (CDXObject(line) for line in fh))
+
+
+def teardown_module():
+    shutil.rmtree(root_dir)
+
+
+def query(source, params):
+    cdx_iter, errs = SimpleAggregator({'source': source})(dict(params))
+    return [cdx.to_text() for cdx in cdx_iter]
+
+
+# ============================================================================
+@pytest.mark.parametrize('params', [
+    dict(url='http://www.iana.org/_css/2013.1/fonts/Inconsolata.otf'),
+    dict(url='http://www.iana.org/_css/2013.1/fonts/Inconsolata.otf', limit=2),
+    dict(url='http://www.iana.org/_css/2013.1/fonts/Inconsolata.otf', closest='20140126200920', limit=2),
+    dict(url='http://www.iana.org/_css/2013.1/fonts/Inconsolata.otf', closest='20140126200912', limit=1),
+    dict(url='http://www.iana.org/_css/2013.1/fonts/Inconsolata.otf', closest='20140126200912',
+         filter='=mime:warc/revisit', limit=1),
+    dict(url='http://www.iana.org/_css/2013.1/fonts/Inconsolata.otf', resolveRevisits='true',
+         filter='!mime:warc/revisit'),
+    dict(url='http://iana.org/domains/root/*'),
+    dict(url='iana.org', matchType='domain', filter=['=status:200', '~url:.*\\.css$']),
+    dict(url='iana.org', matchType='domain', filter='!=mime:warc/revisit', limit=10),
+    dict(url='iana.org', matchType='domain', filter='filename:iana', reverse='1'),
+    dict(url='iana.org', matchType='domain', filter='~length:1...$'),
+    dict(url='iana.org', matchType='domain', **{'from': '2014012620090', 'to': '20140126201'}),
+    dict(url='iana.org', matchType='domain', collapseTime='12'),
+    dict(url='http://example.com/'),
+])
+def test_columnar_same_as_file(params):
+    file_source = FileIndexSource(TEST_CDX_PATH + 'iana.cdxj')
+    source = ColumnarIndexSource(cdxc_path)
+
+    expected = query(file_source, params)
+    assert query(source, params) == expected
+
+
+def test_columnar_all_rows():
+    index = ColumnarIndex.load(cdxc_path)
+
+    with open(TEST_CDX_PATH + 'iana.cdxj', 'rb') as fh:
+        lines = fh.read().rstrip().split(b'\n')
+
+    assert len(index) == len(lines)
+
+    for i, line in enumerate(lines):
+        assert index.get_cdx(i) == CDXObject(line)
+        assert index.get_cdx(i).to_text() == CDXObject(line).to_text()
+
+    # same object if file unchanged
+    assert ColumnarIndex.load(cdxc_path) is index
+
+
+def test_columnar_cdx_and_extra_fields():
+    lines = [b'com,example)/ 20140102000000 {"url": "http://example.com/", "status": "200", "length": 100, "offset": "0100", "custom": ["a", "b"]}',
+             b'com,example)/ 20140102000000 http://example.com/ text/html 200 ABCD - - 123 456 example.warc.gz',
+             b'com,example)/ 201401030000 {"url": "http://example.com/", "offset": "10", "filename": "example.warc.gz"}']
+
+    filename = os.path.join(root_dir, 'extra.cdxc')
+    ColumnarIndex.write(filename, (CDXObject(line) for line in lines))
+
+    index = ColumnarIndex.load(filename)
+    for i, line in enumerate(lines):
+        assert index.get_cdx(i) == CDXObject(line)
+        assert str(index.get_cdx(i)) == str(CDXObject(line))
+
+    # non-string length and non-numeric offset spill into extra json,
+    # and can't be filtered on their column
+    assert index.is_column('status')
+    assert not index.is_column('length')
+    assert not index.is_column('offset')
+
+    res = query(ColumnarIndexSource(filename), dict(url='http://example.com/', filter='=offset:0100'))
+    assert len(res) == 1
+
+
+def test_columnar_write_streaming():
+    # many captures of relatively few distinct strings,
+    # all rows would take well over the memory limit below
+    def gen_line(i):
+        return ('com,example)/page/{0:05d} 2014{1:010d} {{"url": "http://example.com/page/{0:05d}", '
+                '"mime": "text/html", "status": "200", "digest": "ABCD{2}", "length": "{3}", '
+                '"offset": "{4}", "filename": "example.warc.gz"}}\n').format(i // 20, i % 20, i % 50, 100 + i % 7, i * 1000)
+
+    cdxj = os.path.join(root_dir, 'many.cdxj')
+    with open(cdxj, 'wt') as fh:
+        for i in range(5000):
+            fh.write(gen_line(i))
+
+    filename = os.path.join(root_dir, 'many.cdxc')
+    with patch.object(ColumnarIndex, 'WRITE_CHUNK_ROWS', 1000):
+        tracemalloc.start()
+        try:
+            with open(cdxj, 'rb') as fh:
+                assert ColumnarIndex.write(filename, (CDXObject(line) for line in fh)) == 5000
+
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+
+    assert peak < 2 * 1024 * 1024
+
+    index = ColumnarIndex.load(filename)
+    assert len(index) == 5000
+    for i in (0, 999, 1000, 2345, 4999):
+        assert index.get_cdx(i) == CDXObject(gen_line(i).rstrip().encode('utf-8'))
+
+
+def test_columnar_unsorted():
+    lines = [b'com,example)/ 20140102000000 {"url": "http://example.com/"}',
+             b'com,example)/ 20140101000000 {"url": "http://example.com/"}']
+
+    with pytest.raises(ValueError):
+        ColumnarIndex.write(os.path.join(root_dir, 'unsorted.cdxc'),
+                            (CDXObject(line) for line in lines))
+
+
+def test_columnar_init():
+    assert init_index_source(cdxc_path) == ColumnarIndexSource(cdxc_path)
+    assert init_index_source('file://' + cdxc_path) == ColumnarIndexSource(cdxc_path)
+    assert init_index_source(dict(type='columnar', path=cdxc_path)) == ColumnarIndexSource(cdxc_path)
+
+
+def test_columnar_manager_convert_and_dir():
+    index_dir = os.path.join(root_dir, 'indexes')
+    os.makedirs(index_dir)
+
+    shutil.copy(TEST_CDX_PATH + 'iana.cdxj', index_dir)
+
+    CollectionsManager('', must_exist=False).convert_columnar(index_dir, force=True)
+
+    assert os.listdir(index_dir) == ['iana.cdxc']
+
+    params = dict(url='http://iana.org/domains/root/*', nosource='true')
+    res = query(DirectoryIndexSource(index_dir), params)
+    assert res == query(FileIndexSource(TEST_CDX_PATH + 'iana.cdxj'), params)
@@ -9,9 +9,14 @@ from mock import patch
 
 import time
 
-from pywb.warcserver.index.aggregator import DirectoryIndexSource, CacheDirectoryIndexSource
+from pywb.warcserver.index.aggregator import DirectoryIndexSource, CacheDirectoryIndexSource, IndexRoutes
 from pywb.warcserver.index.aggregator import SimpleAggregator
 from pywb.warcserver.index.indexsource import MementoIndexSource
+from pywb.warcserver.index.query import CDXQuery
+
+from pywb import get_test_dir
+
+import pytest
 
 
 #=============================================================================
@@ -182,6 +187,26 @@ class TestDirAgg(TempDirTests, BaseTestClass):
         assert(res == exp)
 
 
+    def test_agg_index_sig(self):
+        params = {'url': 'example.com/', 'param.coll': 'A'}
+        sig = self.dir_loader.get_index_sig(params)
+
+        assert [name for name, source_sig in sig] == [to_path('colls:A/indexes/example2.cdxj')]
+        assert self.dir_loader.get_index_sig(params) == sig
+
+        new_file = to_path(self.root_dir + '/colls/A/indexes/iana.cdxj')
+        shutil.copy(to_path(TEST_CDX_PATH + 'iana.cdxj'), new_file)
+
+        try:
+            assert self.dir_loader.get_index_sig(params) != sig
+        finally:
+            os.remove(new_file)
+
+        assert self.dir_loader.get_index_sig(params) == sig
+
+        # no such collection
+        assert self.dir_loader.get_index_sig({'url': 'example.com/', 'param.coll': 'Z'}) == ()
+
     def test_agg_dir_sources_not_found_dir(self):
         loader = DirectoryIndexSource(os.path.join(self.root_dir, 'colls', 'Z', 'indexes'), '')
         res = loader.get_source_list({'url': 'example.com/'})
@@ -217,3 +242,129 @@ class TestDirAgg(TempDirTests, BaseTestClass):
         # New File Included
         exp['sources'][to_path('colls:C/indexes/empty.cdxj')] = 'file'
         assert(res == exp)
+
+
+#=============================================================================
+class TestKeyRangeRouting(TempDirTests, BaseTestClass):
+    @classmethod
+    def setup_class(cls):
+        super(TestKeyRangeRouting, cls).setup_class()
+        cls.index_dir = to_path(cls.root_dir + '/indexes')
+        os.makedirs(cls.index_dir)
+
+        for name in ('example2.cdxj', 'iana.cdxj', 'post-test.cdxj', 'url-agnost-example.cdxj'):
+            shutil.copy(to_path(TEST_CDX_PATH + name), cls.index_dir)
+
+        for name in ('zipnum-sample.idx', 'zipnum-sample.cdx.gz', 'zipnum-sample.loc'):
+            shutil.copy(to_path(get_test_dir() + 'zipcdx/' + name), cls.index_dir)
+
+        with open(os.path.join(cls.index_dir, 'empty.cdxj'), 'w') as fh:
+            pass
+
+        cls.dir_loader = DirectoryIndexSource(cls.index_dir)
+        cls.routing_loader = CacheDirectoryIndexSource(cls.index_dir, config={'key_range_routing': True})
+
+    def route_names(self, params):
+        CDXQuery(params)
+        return sorted(name for name, source in self.routing_loader._iter_sources(params))
+
+    @pytest.mark.parametrize('params', [
+        dict(url='http://example.com/'),
+        dict(url='http://example.com/', matchType='prefix'),
+        dict(url='http://www.iana.org/_css/2013.1/screen.css'),
+        dict(url='http://www.iana.org/_css/', matchType='prefix'),
+        dict(url='iana.org', matchType='domain'),
+        dict(url='http://httpbin.org/post', matchType='prefix'),
+        dict(url='http://example.org/'),
+        dict(url='http://not-found.example.net/'),
+    ])
+    def test_routing_same_results(self, params):
+        res, errs = self.routing_loader(dict(params))
+        expected, exp_errs = self.dir_loader(dict(params))
+
+        assert to_json_list(res, fields=None) == to_json_list(expected, fields=None)
+        assert errs == exp_errs
+
+    def test_routing_selected_sources(self):
+        assert self.route_names(dict(url='http://example.com/')) == ['example2.cdxj', 'url-agnost-example.cdxj', 'zipnum-sample.idx']
+        assert self.route_names(dict(url='http://iana.org/time-zones')) == ['iana.cdxj', 'url-agnost-example.cdxj', 'zipnum-sample.idx']
+        assert self.route_names(dict(url='httpbin.org', matchType='domain')) == ['post-test.cdxj', 'url-agnost-example.cdxj', 'zipnum-sample.idx']
+        assert self.route_names(dict(url='http://iana.org/zzz')) == ['url-agnost-example.cdxj']
+        assert self.route_names(dict(url='http://example.zz/')) == []
+
+        # all sources, for source list and paged queries
+        all_sources = ['empty.cdxj', 'example2.cdxj', 'iana.cdxj', 'post-test.cdxj', 'url-agnost-example.cdxj', 'zipnum-sample.idx']
+        assert sorted(self.routing_loader.get_source_list({'url': 'httpbin.org/'})['sources']) == all_sources
+        assert self.route_names(dict(url='httpbin.org/', showNumPages='true')) == all_sources
+
+    def test_routes_persisted_and_refreshed(self):
+        self.route_names(dict(url='http://example.com/'))
+
+        routes = IndexRoutes(self.index_dir)
+        ranges = routes.read()
+        assert ranges['iana.cdxj'][1] == (b'org,iana)/', b'org,iana)/time-zones')
+        assert ranges['zipnum-sample.idx'][1] == (b'com,example)/', b'org,iana)/time-zones/y')
+        assert ranges['empty.cdxj'][1] is None
+
+        # persisted key ranges are reused
+        with patch('pywb.warcserver.index.indexsource.FileIndexSource.get_key_range') as get_key_range:
+            routes.refresh(self.routing_loader._load_file)
+            assert get_key_range.call_count == 0
+
+        new_file = os.path.join(self.index_dir, 'example.cdxj')
+        shutil.copy(to_path(TEST_CDX_PATH + 'example.cdxj'), new_file)
+
+        try:
+            # new file is included, only its key range is read
+            assert self.route_names(dict(url='http://iana.org/domains/example')) == ['example.cdxj', 'iana.cdxj', 'url-agnost-example.cdxj', 'zipnum-sample.idx']
+            assert routes.read()['example.cdxj'][1] == (b'com,example)/?example=1', b'org,iana)/domains/example')
+        finally:
+            os.remove(new_file)
+
+        assert self.route_names(dict(url='http://iana.org/domains/example')) == ['iana.cdxj', 'url-agnost-example.cdxj', 'zipnum-sample.idx']
+        assert 'example.cdxj' not in routes.read()
+
+    def test_routes_file_modified_in_place(self):
+        loader = CacheDirectoryIndexSource(self.index_dir, config={'key_range_routing': True,
+                                                                   'key_range_check_interval': 0})
+
+        def route_names(params):
+            CDXQuery(params)
+            return sorted(name for name, source in loader._iter_sources(params))
+
+        filename = os.path.join(self.index_dir, 'post-test.cdxj')
+        with open(filename, 'rb') as fh:
+            orig = fh.read()
+
+        assert route_names(dict(url='http://zzz.example.zz/')) == []
+
+        dir_stat = os.stat(self.index_dir)
+
+        try:
+            # append in place, directory not modified
+            with open(filename, 'ab') as fh:
+                fh.write(b'zz,example,zzz)/ 20140127171200 {"url": "http://zzz.example.zz/"}\n')
+
+            os.utime(self.index_dir, ns=(dir_stat.st_atime_ns, dir_stat.st_mtime_ns))
+            assert os.stat(self.index_dir).st_mtime_ns == dir_stat.st_mtime_ns
+
+            assert route_names(dict(url='http://zzz.example.zz/')) == ['post-test.cdxj']
+
+            res, errs = loader(dict(url='http://zzz.example.zz/'))
+            assert [cdx['urlkey'] for cdx in res] == ['zz,example,zzz)/']
+
+        finally:
+            with open(filename, 'wb') as fh:
+                fh.write(orig)
+
+            os.utime(self.index_dir, ns=(dir_stat.st_atime_ns, dir_stat.st_mtime_ns))
+
+        assert route_names(dict(url='http://zzz.example.zz/')) == []
+
+        # not checked again within the check interval
+        routes = IndexRoutes(self.index_dir, check_interval=60)
+        routes.refresh(loader._load_file)
+
+        with patch.object(routes, '_files_changed') as files_changed:
+            routes.refresh(loader._load_file)
+            assert files_changed.call_count == 0
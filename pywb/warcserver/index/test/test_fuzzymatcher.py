@@ -2,7 +2,14 @@ from pywb.warcserver.index.fuzzymatcher import FuzzyMatcher
 from pywb.utils.canonicalize import canonicalize
 
 from pywb.warcserver.index.aggregator import SimpleAggregator
-from pywb.warcserver.index.indexsource import BaseIndexSource
+from pywb.warcserver.index.indexsource import BaseIndexSource, FileIndexSource
+
+from mock import patch
+
+import shutil
+import tempfile
+import time
+import os
 
 
 # ============================================================================
@@ -241,3 +248,123 @@ class TestFuzzy(object):
         params = self.get_params(url, actual_url)
         cdx_iter, errs = self.fuzzy(self.source, params)
         assert list(cdx_iter) == self.get_expected(actual_url)
+
+    def test_matching_rules_same_as_linear(self):
+        urlkeys = ['', 'com,example)/?_=123', 'com,youtube)/get_video_info?video_id=1']
+        for rule in self.fuzzy.rules:
+            for prefix in rule.url_prefix:
+                urlkeys.extend([prefix, prefix[:-1], prefix + '/path?a=b'])
+
+        for urlkey in urlkeys:
+            expected = [rule for rule in self.fuzzy.rules
+                        if any(urlkey.startswith(prefix) for prefix in rule.url_prefix)]
+
+            assert self.fuzzy.get_matching_rules(urlkey) == expected
+
+        # general rule always last
+        assert self.fuzzy.get_matching_rules('com,example)/')[-1].url_prefix == ['']
+
+
+# ============================================================================
+class CountingSource(BaseIndexSource):
+    def __init__(self, filename):
+        self.source = FileIndexSource(filename)
+        self.count = 0
+
+    def load_index(self, params):
+        self.count += 1
+        return self.source.load_index(params)
+
+    def get_index_sig(self, params):
+        return self.source.get_index_sig(params)
+
+
+# ============================================================================
+class TestFuzzyMissCache(object):
+    @classmethod
+    def setup_class(cls):
+        cls.root_dir = tempfile.mkdtemp()
+        cls.filename = os.path.join(cls.root_dir, 'index.cdxj')
+
+        with open(cls.filename, 'wt') as fh:
+            fh.write('com,example)/ 20140127171200 {"url": "http://example.com/"}\n')
+
+        cls.fuzzy = FuzzyMatcher(miss_cache_ttl=60)
+
+    @classmethod
+    def teardown_class(cls):
+        shutil.rmtree(cls.root_dir)
+
+    def query(self, source, url, **kwargs):
+        params = dict(url=url, **kwargs)
+        cdx_iter, errs = self.fuzzy(source, params)
+        return list(cdx_iter), errs
+
+    def test_miss_cached(self):
+        counting = CountingSource(self.filename)
+        source = SimpleAggregator({'source': counting})
+
+        # exact and fuzzy lookup
+        assert self.query(source, 'http://example.com/missing?_=123') == ([], {})
+        assert counting.count == 2
+
+        # cached
+        assert self.query(source, 'http://example.com/missing?_=123') == ([], {})
+        assert counting.count == 2
+
+        # not cached, other params
+        assert self.query(source, 'http://example.com/missing?_=123', allowFuzzy='0') == ([], {})
+        assert counting.count == 3
+
+        assert self.query(source, 'http://example.com/missing?_=123', allowFuzzy='0', closest='20140101') == ([], {})
+        assert counting.count == 3
+
+        # found, not cached
+        res, errs = self.query(source, 'http://example.com/?_=123')
+        assert res[0]['urlkey'] == 'com,example)/'
+        assert res[0]['is_fuzzy'] == '1'
+
+        res, errs = self.query(source, 'http://example.com/?_=123')
+        assert res[0]['urlkey'] == 'com,example)/'
+        assert counting.count == 7
+
+    def test_miss_invalidated_on_index_change(self):
+        counting = CountingSource(self.filename)
+        source = SimpleAggregator({'source': counting})
+
+        assert self.query(source, 'http://example.com/new?a=b') == ([], {})
+        assert self.query(source, 'http://example.com/new?a=b') == ([], {})
+        assert counting.count == 2
+
+        with open(self.filename, 'at') as fh:
+            fh.write('com,example)/new?a=b 20140127171200 {"url": "http://example.com/new?a=b"}\n')
+
+        res, errs = self.query(source, 'http://example.com/new?a=b')
+        assert res[0]['urlkey'] == 'com,example)/new?a=b'
+        assert counting.count == 3
+
+    def test_miss_expired(self):
+        counting = CountingSource(self.filename)
+        source = SimpleAggregator({'source': counting})
+
+        assert self.query(source, 'http://example.com/expired') == ([], {})
+        assert counting.count == 2
+
+        with patch('pywb.warcserver.index.fuzzymatcher.time.time', return_value=time.time() + 61):
+            assert self.query(source, 'http://example.com/expired') == ([], {})
+
+        assert counting.count == 4
+
+    def test_miss_with_errors_not_cached(self):
+        source = SimpleAggregator({'source': CountingSource(self.filename),
+                                   'missing': FileIndexSource(os.path.join(self.root_dir, 'missing.cdxj'))})
+
+        res, errs = self.query(source, 'http://example.com/errors')
+        assert res == []
+        assert list(errs.keys()) == ['missing']
+
+        res, errs = self.query(source, 'http://example.com/errors')
+        assert list(errs.keys()) == ['missing']
+
+    def test_miss_cache_disabled(self):
+        assert FuzzyMatcher().miss_cache is None
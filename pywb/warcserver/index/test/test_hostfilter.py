@@ -0,0 +1,185 @@
+from pywb.warcserver.index.hostfilter import HostBloomFilter, iter_urlkeys
+from pywb.warcserver.index.aggregator import SimpleAggregator, DirectoryIndexSource
+from pywb.warcserver.index.columnar import ColumnarIndex, ColumnarIndexSource
+from pywb.warcserver.index.indexsource import FileIndexSource
+from pywb.warcserver.index.zipnum import ZipNumIndexSource
+from pywb.warcserver.index.cdxobject import CDXObject
+
+from pywb.warcserver.test.testutils import TEST_CDX_PATH
+from pywb.manager.manager import CollectionsManager
+from pywb.indexer.cdxindexer import main as cdxindexer_main
+
+from pywb import get_test_dir
+
+from mock import patch
+
+import pytest
+import shutil
+import tempfile
+import os
+
+
+# ============================================================================
+def setup_module():
+    global root_dir
+    root_dir = tempfile.mkdtemp()
+
+    global index_dir
+    index_dir = os.path.join(root_dir, 'indexes')
+    os.makedirs(index_dir)
+
+    for name in ('iana.cdxj', 'example.cdxj', 'post-test.cdxj'):
+        shutil.copy(TEST_CDX_PATH + name, index_dir)
+
+
+def teardown_module():
+    shutil.rmtree(root_dir)
+
+
+def query(source, params):
+    params = dict(params, nosource='true')
+    cdx_iter, errs = SimpleAggregator({'source': source})(params)
+    return [cdx.to_text() for cdx in cdx_iter]
+
+
+def loaded_files(params):
+    loaded = []
+    orig_load_index = FileIndexSource.load_index
+
+    def load_index(self, params):
+        loaded.append(os.path.basename(self.filename_template))
+        return orig_load_index(self, params)
+
+    with patch.object(FileIndexSource, 'load_index', load_index):
+        res = query(DirectoryIndexSource(index_dir), params)
+
+    return sorted(loaded), res
+
+
+# ============================================================================
+def test_build_filter():
+    with open(TEST_CDX_PATH + 'iana.cdxj', 'rb') as fh:
+        host_filter = HostBloomFilter.build(line.split(b' ', 1)[0] for line in fh)
+
+    assert b'org,iana)' in host_filter
+
+    # domains
+    assert b'org,iana' in host_filter
+    assert b'org' in host_filter
+
+    # can't be certain for any single value, but should be mostly missing
+    missing = sum(1 for i in range(1000) if b'com,example-%d)' % i not in host_filter)
+    assert missing > 900
+
+
+def test_iter_urlkeys():
+    shutil.copy(get_test_dir() + 'zipcdx/zipnum-sample.idx', root_dir)
+    shutil.copy(get_test_dir() + 'zipcdx/zipnum-sample.cdx.gz', root_dir)
+    shutil.copy(get_test_dir() + 'zipcdx/zipnum-sample.loc', root_dir)
+
+    with open(TEST_CDX_PATH + 'iana.cdxj', 'rb') as fh:
+        expected = [line.split(b' ', 1)[0] for line in fh]
+
+    cdxc = os.path.join(root_dir, 'iana.cdxc')
+    with open(TEST_CDX_PATH + 'iana.cdxj', 'rb') as fh:
+        ColumnarIndex.write(cdxc, (CDXObject(line) for line in fh))
+
+    assert list(iter_urlkeys(TEST_CDX_PATH + 'iana.cdxj')) == expected
+    assert list(iter_urlkeys(cdxc)) == expected
+
+    zipnum_keys = list(iter_urlkeys(os.path.join(root_dir, 'zipnum-sample.idx')))
+    assert len(zipnum_keys) == 151
+    assert zipnum_keys[0].startswith(b'com,example)/')
+    assert zipnum_keys[-1].startswith(b'org,iana)/')
+
+
+@pytest.mark.parametrize('params, expected', [
+    # example.cdxj also has an iana.org capture
+    (dict(url='http://www.iana.org/_css/2013.1/screen.css'), ['example.cdxj', 'iana.cdxj']),
+    (dict(url='http://www.iana.org/domains/', matchType='prefix'), ['example.cdxj', 'iana.cdxj']),
+    (dict(url='iana.org', matchType='domain'), ['example.cdxj', 'iana.cdxj']),
+    (dict(url='http://example.com/', matchType='host'), ['example.cdxj']),
+    (dict(url='httpbin.org', matchType='domain'), ['post-test.cdxj']),
+    (dict(url='http://not-found.example.org/'), []),
+    (dict(url='http://httpbin.org/post', matchType='prefix'), ['post-test.cdxj']),
+
+    # can't be excluded by host
+    (dict(url='org', matchType='domain'), ['example.cdxj', 'iana.cdxj', 'post-test.cdxj']),
+])
+def test_dir_skip_sources(params, expected):
+    no_filter_loaded, no_filter_res = loaded_files(params)
+    assert no_filter_loaded == ['example.cdxj', 'iana.cdxj', 'post-test.cdxj']
+
+    CollectionsManager('', must_exist=False).build_host_filters(index_dir)
+
+    try:
+        loaded, res = loaded_files(params)
+        assert loaded == expected
+        assert res == no_filter_res
+    finally:
+        for name in os.listdir(index_dir):
+            if name.endswith(HostBloomFilter.EXT):
+                os.remove(os.path.join(index_dir, name))
+
+
+def test_filter_ignored_if_index_changed():
+    filename = os.path.join(index_dir, 'example.cdxj')
+    params = dict(key=b'org,httpbin)/', matchType='exact')
+
+    HostBloomFilter.write_for_file(filename)
+    assert HostBloomFilter.may_contain_file(filename, params) == False
+
+    with open(filename, 'ab') as fh:
+        fh.write(b'org,httpbin)/ 20140101000000 {"url": "http://httpbin.org/"}\n')
+
+    assert HostBloomFilter.load_for_file(filename) is None
+    assert HostBloomFilter.may_contain_file(filename, params) == True
+
+    # no longer stale once rebuilt
+    CollectionsManager._update_host_filter(filename)
+    assert HostBloomFilter.may_contain_file(filename, params) == True
+    assert HostBloomFilter.may_contain_file(filename, dict(params, key=b'com,foo)/')) == False
+
+    os.remove(filename + HostBloomFilter.EXT)
+
+
+def test_zipnum_columnar_may_contain():
+    zipnum = ZipNumIndexSource(os.path.join(root_dir, 'zipnum-sample.idx'))
+    columnar = ColumnarIndexSource(os.path.join(root_dir, 'iana.cdxc'))
+
+    params = dict(key=b'com,example)/', matchType='prefix')
+
+    # no filter
+    assert zipnum.may_contain(params)
+    assert columnar.may_contain(params)
+
+    HostBloomFilter.write_for_file(zipnum.summary)
+    HostBloomFilter.write_for_file(columnar.filename_template)
+
+    assert zipnum.may_contain(params)
+    assert not columnar.may_contain(params)
+
+    # paged queries not skipped
+    assert columnar.may_contain(dict(params, showNumPages='true'))
+
+
+def test_cdxindexer_bloom():
+    out = os.path.join(root_dir, 'example.cdxj')
+    cdxindexer_main(['-s', '-j', '-b', '-o', out, get_test_dir() + 'warcs/example.warc.gz'])
+
+    host_filter = HostBloomFilter.load_for_file(out)
+    assert b'com,example)' in host_filter
+
+
+def test_cdxindexer_bloom_dir():
+    out_dir = os.path.join(root_dir, 'cdx_out')
+    os.makedirs(out_dir)
+    cdxindexer_main(['-s', '-j', '-b', '-o', out_dir,
+                     get_test_dir() + 'warcs/example.warc.gz',
+                     get_test_dir() + 'warcs/iana.warc.gz'])
+
+    host_filter = HostBloomFilter.load_for_file(os.path.join(out_dir, 'example.cdx'))
+    assert b'com,example)' in host_filter
+
+    host_filter = HostBloomFilter.load_for_file(os.path.join(out_dir, 'iana.cdx'))
+    assert b'org,iana)' in host_filter
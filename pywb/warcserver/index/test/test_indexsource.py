@@ -8,10 +8,11 @@ from warcio.timeutils import timestamp_now
 from pywb.warcserver.test.testutils import key_ts_res, TEST_CDX_PATH, FakeRedisTests, BaseTestClass
 
 import pytest
+import shutil
 import os
 
 
-local_sources = ['file', 'redis']
+local_sources = ['file', 'file_mmap', 'redis']
 remote_sources = ['remote_cdx', 'memento']
 all_sources = local_sources + remote_sources
 
@@ -25,6 +26,7 @@ class TestIndexSources(FakeRedisTests, BaseTestClass):
 
         cls.all_sources = {
             'file': FileIndexSource(TEST_CDX_PATH + 'iana.cdxj'),
+            'file_mmap': FileIndexSource(TEST_CDX_PATH + 'iana.cdxj', {'mmap': True}),
             'redis': RedisIndexSource('redis://localhost:6379/2/test:rediscdx'),
             'remote_cdx': RemoteIndexSource('https://webarchives.rhizome.org/excellences-and-perfections/cdx?url={url}',
                               'https://webarchives.rhizome.org/excellences-and-perfections/{timestamp}id_/{url}'),
@@ -185,6 +187,26 @@ com,instagram)/amaliaulman 20141014162333 https://webarchives.rhizome.org/excell
         assert(key_ts_res(res) == expected)
         assert(errs['source'] == "NotFoundException('testdata/not-found-x',)"), errs
 
+    def test_file_block_index(self, tmpdir):
+        filename = str(tmpdir.join('iana.cdxj'))
+        shutil.copy(TEST_CDX_PATH + 'iana.cdxj', filename)
+
+        source = FileIndexSource.init_from_config({'type': 'file',
+                                                   'path': filename,
+                                                   'block_index': True})
+
+        url = 'http://www.iana.org/_css/2013.1/fonts/Inconsolata.otf'
+        res, errs = self.query_single_source(source, dict(url=url, limit=3))
+
+        expected = """\
+org,iana)/_css/2013.1/fonts/inconsolata.otf 20140126200826 iana.warc.gz
+org,iana)/_css/2013.1/fonts/inconsolata.otf 20140126200912 iana.warc.gz
+org,iana)/_css/2013.1/fonts/inconsolata.otf 20140126200930 iana.warc.gz"""
+
+        assert(key_ts_res(res) == expected)
+        assert(errs == {})
+        assert os.path.isfile(filename + '.blkidx')
+
     def test_ait_filters(self):
         pytest.skip("ait issue, may not work anymore")
 
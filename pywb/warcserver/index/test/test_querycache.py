@@ -0,0 +1,241 @@
+from gevent import monkey; monkey.patch_all(thread=False)
+
+from pywb.warcserver.index.indexsource import RemoteIndexSource, MementoIndexSource
+from pywb.warcserver.index.aggregator import SimpleAggregator
+from pywb.warcserver.index.querycache import QueryCache, RedisQueryCache
+from pywb.warcserver.index.cdxobject import CDXObject
+from pywb.warcserver.warcserver import init_index_source
+
+from pywb.warcserver.test.testutils import TEST_CDX_PATH, FakeRedisTests, BaseTestClass
+from pywb.utils.geventserver import GeventServer
+
+from six.moves.urllib.parse import unquote_plus
+
+from mock import patch
+import pytest
+import time
+
+
+MEMENTO_LINKS = ('<http://example.com/>; rel="original", '
+                 '<{0}20140127171251id_/http://example.com/>; rel="memento"; '
+                 'datetime="Mon, 27 Jan 2014 17:12:51 GMT"')
+
+
+# ============================================================================
+class TestQueryCache(FakeRedisTests, BaseTestClass):
+    @classmethod
+    def setup_class(cls):
+        super(TestQueryCache, cls).setup_class()
+
+        with open(TEST_CDX_PATH + 'iana.cdxj', 'rb') as fh:
+            cls.cdx_lines = fh.read().rstrip().split(b'\n')
+
+        cls.requests = []
+        cls.server = GeventServer(cls.upstream_app)
+        cls.base_url = 'http://localhost:{0}/'.format(cls.server.port)
+
+    @classmethod
+    def teardown_class(cls):
+        cls.server.stop()
+        super(TestQueryCache, cls).teardown_class()
+
+    def setup_method(self):
+        QueryCache.local_cache.clear()
+        self.redis.flushdb()
+        del self.requests[:]
+
+    @classmethod
+    def upstream_app(cls, env, start_response):
+        path = env['PATH_INFO']
+        query = unquote_plus(env.get('QUERY_STRING', ''))
+        cls.requests.append(path + '?' + query)
+
+        if path == '/cdx' and 'iana.org' in query:
+            start_response('200 OK', [('Content-Type', 'text/x-cdxj')])
+            return [b'\n'.join(cls.cdx_lines)]
+
+        if path.startswith('/mem/') and path.endswith('/http://example.com/'):
+            links = MEMENTO_LINKS.format(cls.base_url + 'mem/')
+            start_response('200 OK', [('Content-Type', 'application/link-format'),
+                                      ('Link', links)])
+            if env['REQUEST_METHOD'] == 'HEAD':
+                return []
+
+            return [links.encode('utf-8')]
+
+        if path == '/error':
+            start_response('500 Server Error', [])
+            return []
+
+        start_response('404 Not Found', [])
+        return []
+
+    def query(self, source, url, **params):
+        params['url'] = url
+        res, errs = SimpleAggregator({'source': source})(params)
+        return [cdx.to_text() for cdx in res], errs
+
+    def get_remote(self, query_cache):
+        return RemoteIndexSource(self.base_url + 'cdx?url={url}',
+                                 self.base_url + 'web/{timestamp}id_/{url}',
+                                 query_cache=query_cache)
+
+    @pytest.fixture(params=['local', 'redis'])
+    def query_cache(self, request):
+        if request.param == 'local':
+            return QueryCache(ttl=60, not_found_ttl=60)
+        else:
+            return RedisQueryCache('redis://localhost:6379/2/test:querycache:', ttl=60, not_found_ttl=60)
+
+    def test_remote_cached(self, query_cache):
+        expected, errs = self.query(self.get_remote(None), 'http://www.iana.org/')
+        assert len(expected) == len(self.cdx_lines)
+        assert len(self.requests) == 1
+
+        source = self.get_remote(query_cache)
+        assert self.query(source, 'http://www.iana.org/') == (expected, {})
+        assert self.query(source, 'http://www.iana.org/', limit=2) == (expected[:2], {})
+        assert len(self.requests) == 2
+
+        # different query
+        self.query(source, 'http://iana.org/')
+        assert len(self.requests) == 3
+
+    def test_remote_large_not_cached(self, query_cache):
+        query_cache.max_lines = 10
+
+        for stream in (False, True):
+            source = RemoteIndexSource(self.base_url + 'cdx?url={url}',
+                                       self.base_url + 'web/{timestamp}id_/{url}',
+                                       stream=stream,
+                                       query_cache=query_cache)
+
+            for i in range(2):
+                res, errs = self.query(source, 'http://www.iana.org/')
+                assert len(res) == len(self.cdx_lines)
+
+        assert len(self.requests) == 4
+
+    def test_large_passed_through(self):
+        read = []
+
+        def load_func(params):
+            for line in self.cdx_lines:
+                read.append(line)
+                yield CDXObject(line)
+
+        query_cache = QueryCache(ttl=60, max_lines=10)
+
+        # only max_lines + 1 read ahead
+        cdx_iter = query_cache.load('key', load_func, {})
+        assert next(cdx_iter).to_cdxj().encode('utf-8').rstrip() == self.cdx_lines[0]
+        assert len(read) == 11
+
+        assert len(list(cdx_iter)) == len(self.cdx_lines) - 1
+        assert len(QueryCache.local_cache) == 0
+
+        # small result cached
+        del read[:]
+        query_cache.max_lines = len(self.cdx_lines)
+        assert len(list(query_cache.load('key', load_func, {}))) == len(self.cdx_lines)
+        assert len(list(query_cache.load('key', load_func, {}))) == len(self.cdx_lines)
+        assert len(read) == len(self.cdx_lines)
+
+    def test_remote_not_found_cached(self, query_cache):
+        source = self.get_remote(query_cache)
+        for i in range(3):
+            res, errs = self.query(source, 'http://example.com/')
+            assert res == []
+            assert 'NotFoundException' in errs['source']
+
+        assert len(self.requests) == 1
+
+    def test_remote_error_not_cached(self, query_cache):
+        source = RemoteIndexSource(self.base_url + 'error?url={url}',
+                                   self.base_url + 'web/{timestamp}id_/{url}',
+                                   query_cache=query_cache)
+
+        for i in range(3):
+            res, errs = self.query(source, 'http://example.com/')
+            assert 'NotFoundException' in errs['source']
+
+        assert len(self.requests) == 3
+
+    def test_memento_cached(self, query_cache):
+        source = MementoIndexSource.from_timegate_url(self.base_url + 'mem/')
+        source.query_cache = query_cache
+
+        for i in range(3):
+            res, errs = self.query(source, 'http://example.com/', closest='20140127171251')
+            assert errs == {}
+            assert len(res) == 1
+            assert '20140127171251' in res[0]
+
+            res, errs = self.query(source, 'http://example.com/')
+            assert len(res) == 1
+
+        # one timegate, one timemap request
+        assert self.requests == ['/mem/http://example.com/?',
+                                 '/mem/timemap/link/http://example.com/?']
+
+        # not found
+        for i in range(2):
+            res, errs = self.query(source, 'http://example.com/other', closest='20140127171251')
+            assert res == []
+
+        assert len(self.requests) == 3
+
+    def test_ttl_expired(self):
+        source = self.get_remote(QueryCache(ttl=60, not_found_ttl=60))
+        self.query(source, 'http://www.iana.org/')
+        self.query(source, 'http://www.iana.org/')
+        assert len(self.requests) == 1
+
+        now = time.time()
+        with patch('time.time', lambda: now + 61):
+            self.query(source, 'http://www.iana.org/')
+
+        assert len(self.requests) == 2
+
+    def test_redis_error_not_cached(self):
+        query_cache = RedisQueryCache('redis://localhost:6379/2/test:querycache:')
+        source = self.get_remote(query_cache)
+
+        with patch.object(query_cache.redis, 'get', side_effect=Exception('down')):
+            with patch.object(query_cache.redis, 'setex', side_effect=Exception('down')):
+                for i in range(2):
+                    res, errs = self.query(source, 'http://www.iana.org/')
+                    assert len(res) == len(self.cdx_lines)
+
+        assert len(self.requests) == 2
+
+    def test_init_from_config(self):
+        source = init_index_source({'type': 'memento',
+                                    'timegate_url': self.base_url + 'mem/{url}',
+                                    'timemap_url': self.base_url + 'mem/timemap/link/{url}',
+                                    'replay_url': self.base_url + 'mem/{timestamp}id_/{url}',
+                                    'cache_ttl': 600})
+
+        assert isinstance(source.query_cache, QueryCache)
+        assert source.query_cache.ttl == 600
+        assert source.query_cache.not_found_ttl == QueryCache.DEFAULT_NOT_FOUND_TTL
+        assert source.query_cache.max_lines == QueryCache.DEFAULT_MAX_LINES
+
+        source = init_index_source({'type': 'cdx',
+                                    'api_url': self.base_url + 'cdx?url={url}',
+                                    'replay_url': self.base_url + 'web/{timestamp}id_/{url}',
+                                    'cache_ttl': 600,
+                                    'cache_not_found_ttl': 0,
+                                    'cache_max_lines': 100,
+                                    'cache_redis_url': 'redis://localhost:6379/2/test:querycache:'})
+
+        assert isinstance(source.query_cache, RedisQueryCache)
+        assert source.query_cache.key_prefix == 'test:querycache:'
+        assert source.query_cache.not_found_ttl == 0
+        assert source.query_cache.max_lines == 100
+
+        source = init_index_source({'type': 'cdx',
+                                    'api_url': self.base_url + 'cdx?url={url}',
+                                    'replay_url': self.base_url + 'web/{timestamp}id_/{url}'})
+
+        assert source.query_cache is None
@@ -1,5 +1,8 @@
 from pywb.warcserver.index.aggregator import RedisMultiKeyIndexSource
+from pywb.warcserver.index.indexsource import RedisIndexSource
 from pywb.warcserver.test.testutils import to_path, to_json_list, FakeRedisTests, BaseTestClass, TEST_CDX_PATH
+from mock import patch
+import time
 import pytest
 
 
@@ -58,3 +61,73 @@ class TestRedisAgg(FakeRedisTests, BaseTestClass):
         assert(to_json_list(res) == exp)
 
 
+
+    def test_redis_agg_pipelined(self, indexloader):
+        pipelines = []
+        orig_pipeline = indexloader.redis.pipeline
+
+        def pipeline(*args, **kwargs):
+            pipe = orig_pipeline(*args, **kwargs)
+            pipelines.append(pipe)
+            return pipe
+
+        # all keys queried in one pipeline, not loaded individually
+        with patch.object(indexloader.redis, 'pipeline', pipeline):
+            with patch.object(RedisIndexSource, 'load_key_index', side_effect=AssertionError):
+                res, errs = indexloader({'url': 'example.com/', 'param.user': 'FOO', 'param.coll': '*'})
+
+        assert(errs == {})
+        assert(len(to_json_list(res)) == 3)
+        assert(len(pipelines) == 1)
+
+    def test_redis_agg_key_cache(self):
+        loader = RedisMultiKeyIndexSource('redis://localhost/2/{user}:{coll}:cdxj',
+                                          key_cache_ttl=60,
+                                          key_version_key='{user}:version')
+
+        params = {'url': 'example.com/', 'param.user': 'BAR', 'param.coll': '*'}
+
+        self.add_cdx_to_redis(TEST_CDX_PATH + 'dupes.cdxj', 'BAR:dupes:cdxj')
+
+        res, errs = loader(dict(params))
+        assert(len(to_json_list(res)) == 2)
+
+        # keys not scanned again
+        with patch.object(loader.redis, 'scan_iter', side_effect=AssertionError):
+            res, errs = loader(dict(params))
+            assert(len(to_json_list(res)) == 2)
+
+        # new key not seen until version changes
+        self.add_cdx_to_redis(TEST_CDX_PATH + 'example2.cdxj', 'BAR:example:cdxj')
+
+        res, errs = loader(dict(params))
+        assert(len(to_json_list(res)) == 2)
+
+        self.redis.incr('BAR:version')
+
+        res, errs = loader(dict(params))
+        assert(len(to_json_list(res)) == 3)
+
+    def test_redis_agg_key_cache_ttl(self):
+        loader = RedisMultiKeyIndexSource('redis://localhost/2/{user}:{coll}:cdxj',
+                                          member_key_templ='{user}:list',
+                                          key_cache_ttl=60)
+
+        params = {'url': 'example.com/', 'param.user': 'FOO', 'param.coll': '*'}
+
+        self.redis.sadd('FOO:list', 'dupes')
+
+        res, errs = loader(dict(params))
+        assert(len(to_json_list(res)) == 2)
+
+        self.redis.sadd('FOO:list', 'example')
+
+        with patch.object(loader.redis, 'smembers', side_effect=AssertionError):
+            res, errs = loader(dict(params))
+            assert(len(to_json_list(res)) == 2)
+
+        # reloaded once expired
+        now = time.time()
+        with patch('time.time', lambda: now + 61):
+            res, errs = loader(dict(params))
+            assert(len(to_json_list(res)) == 3)
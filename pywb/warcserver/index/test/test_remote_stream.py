@@ -0,0 +1,108 @@
+from gevent import monkey; monkey.patch_all(thread=False)
+from gevent.event import Event
+
+from pywb.warcserver.index.indexsource import RemoteIndexSource
+from pywb.warcserver.index.aggregator import SimpleAggregator
+from pywb.warcserver.http import DefaultAdapters
+
+from pywb.warcserver.test.testutils import TEST_CDX_PATH
+from pywb.utils.geventserver import GeventServer
+
+from mock import patch
+
+import pytest
+
+
+# ============================================================================
+class TestRemoteStream(object):
+    @classmethod
+    def setup_class(cls):
+        with open(TEST_CDX_PATH + 'iana.cdxj', 'rb') as fh:
+            cls.cdx_lines = fh.read().rstrip().split(b'\n')
+
+        cls.done = None
+        cls.server = GeventServer(cls.cdx_app)
+        cls.api_url = 'http://localhost:{0}/cdx?url={{url}}'.format(cls.server.port)
+
+    @classmethod
+    def teardown_class(cls):
+        cls.server.stop()
+
+    @classmethod
+    def cdx_app(cls, env, start_response):
+        start_response('200 OK', [('Content-Type', 'text/x-cdxj')])
+
+        def body():
+            # send the first half, then wait until allowed to finish
+            half = len(cls.cdx_lines) // 2
+            yield b'\n'.join(cls.cdx_lines[:half]) + b'\n'
+
+            if cls.done:
+                cls.done.wait()
+
+            yield b'\n'.join(cls.cdx_lines[half:]) + b'\n'
+
+        return body()
+
+    def get_source(self, **kwargs):
+        return RemoteIndexSource(self.api_url, 'http://replay/{timestamp}id_/{url}', **kwargs)
+
+    def query(self, source, **params):
+        params['url'] = 'http://www.iana.org/'
+        res, errs = SimpleAggregator({'source': source})(params)
+        assert errs == {}
+        return res
+
+    @pytest.mark.parametrize('chunk_size', [16, 16384])
+    def test_stream_same_as_buffered(self, chunk_size):
+        expected = [cdx.to_text() for cdx in self.query(self.get_source())]
+        assert len(expected) == len(self.cdx_lines)
+
+        with patch.object(RemoteIndexSource, 'STREAM_CHUNK_SIZE', chunk_size):
+            res = [cdx.to_text() for cdx in self.query(self.get_source(stream=True))]
+
+        assert res == expected
+
+    def test_stream_before_response_done(self):
+        TestRemoteStream.done = Event()
+        try:
+            res = self.query(self.get_source(stream=True))
+
+            # first capture available before the full response is sent
+            first = next(res)
+            assert first['urlkey'] == self.cdx_lines[0].split(b' ')[0].decode('utf-8')
+            assert first['load_url'] == 'http://replay/{0}id_/{1}'.format(first['timestamp'], first['url'])
+
+            self.done.set()
+            assert len(list(res)) == len(self.cdx_lines) - 1
+        finally:
+            self.done.set()
+            TestRemoteStream.done = None
+
+    def test_pool_size(self):
+        source = self.get_source()
+        assert source.sesh.adapters['http://'] is DefaultAdapters.remote_adapter
+
+        source = self.get_source(pool_size=4)
+        adapter = source.sesh.adapters['http://']
+        assert adapter is not DefaultAdapters.remote_adapter
+        assert adapter._pool_maxsize == 4
+
+        assert len(list(self.query(source))) == len(self.cdx_lines)
+
+    def test_init_from_config(self):
+        source = RemoteIndexSource.init_from_config({'type': 'cdx',
+                                                     'api_url': self.api_url,
+                                                     'replay_url': 'http://replay/{timestamp}id_/{url}',
+                                                     'stream': 'true',
+                                                     'pool_size': 8})
+
+        assert source.stream == True
+        assert source.sesh.adapters['https://']._pool_maxsize == 8
+
+        source = RemoteIndexSource.init_from_config({'type': 'cdx',
+                                                     'api_url': self.api_url,
+                                                     'replay_url': 'http://replay/{timestamp}id_/{url}'})
+
+        assert source.stream == False
+        assert source.pool_size is None
@@ -0,0 +1,217 @@
+from pywb.warcserver.index.aggregator import SimpleAggregator, DirectoryIndexSource, BaseAggregator
+from pywb.warcserver.index.aggregator import GeventTimeoutAggregator
+from pywb.warcserver.index.indexsource import FileIndexSource, RemoteIndexSource
+from pywb.warcserver.index.zipnum import ZipNumIndexSource
+from pywb.warcserver.index.query import CDXQuery
+from pywb.warcserver.index.sharded import ShardedQuery
+
+from pywb.warcserver.test.testutils import TEST_CDX_PATH
+from pywb import get_test_dir
+
+from concurrent.futures import ThreadPoolExecutor
+from mock import patch
+
+import subprocess
+import pytest
+import shutil
+import tempfile
+import sys
+import os
+
+
+# ============================================================================
+def setup_module():
+    global root_dir
+    root_dir = tempfile.mkdtemp()
+
+    global index_dir
+    index_dir = os.path.join(root_dir, 'indexes')
+    os.makedirs(index_dir)
+
+    for name in ('iana.cdxj', 'example.cdxj'):
+        shutil.copy(TEST_CDX_PATH + name, index_dir)
+
+    # many urls, with captures in the same minute and repeated statuses
+    with open(os.path.join(index_dir, 'many.cdxj'), 'wb') as fh:
+        for i in range(4000):
+            fh.write(b'com,example)/page/%04d 2015010100%02d%02d {"url": "http://example.com/page/%04d", '
+                     b'"status": "%d", "mime": "text/html"}\n' % (i, i % 3, i % 60, i, 200 + (i % 7 == 0)))
+
+    # shards loaded in threads, as a process pool can not be shut down
+    # in a process with mixed gevent patching, see test_process_pool()
+    global sharded_query
+    sharded_query = ShardedQuery(2, shards=4)
+    sharded_query._executor = ThreadPoolExecutor(max_workers=2)
+
+
+def teardown_module():
+    sharded_query.close()
+    shutil.rmtree(root_dir)
+
+
+def query(agg, params, **kwargs):
+    cdx_iter, errs = agg(dict(params, **kwargs))
+    return [cdx.to_text(CDXQuery(dict(params)).fields) for cdx in cdx_iter], errs
+
+
+def assert_sharded_same(agg, params):
+    assert sharded_query(agg, CDXQuery(dict(params))) is not None
+
+    expected, errs = query(agg, params)
+    assert len(expected) > 0
+
+    with patch.object(BaseAggregator, 'sharded_query', sharded_query):
+        assert query(agg, params) == (expected, errs)
+
+
+@pytest.fixture
+def small_splits():
+    with patch.object(FileIndexSource, 'SPLIT_MIN_SIZE', 1024):
+        yield
+
+
+# ============================================================================
+@pytest.mark.parametrize('params', [
+    dict(url='http://example.com/*'),
+    dict(url='http://example.com/page/*', filter='!status:201'),
+    dict(url='http://example.com/page/*', filter=['~url:.*/00', '!mime:warc/revisit']),
+    dict(url='http://example.com/page/*', collapseTime='10'),
+    dict(url='http://example.com/page/*', collapseTime='12', filter='status:200'),
+    dict(url='http://example.com/*', fl='urlkey,status'),
+    dict(url='http://example.com/page/*', limit='1500', nosource='true'),
+    dict(url='http://example.com/page/*', limit='3'),
+    dict(url='http://example.com/page/*', **{'from': '201501010001', 'to': '201501010001'}),
+    dict(url='*.example.com', sources='dir', output='json'),
+])
+def test_sharded_file_same_as_serial(small_splits, params):
+    agg = SimpleAggregator({'dir': DirectoryIndexSource(index_dir),
+                            'many': FileIndexSource(os.path.join(index_dir, 'many.cdxj'))})
+
+    assert_sharded_same(agg, params)
+
+
+@pytest.mark.parametrize('params', [
+    dict(url='*.iana.org'),
+    dict(url='http://www.iana.org/_css/*', filter='mime:application/octet-stream'),
+    dict(url='*.iana.org', collapseTime='8', fl='urlkey,timestamp,status'),
+    dict(url='*.iana.org', limit='20'),
+])
+def test_sharded_zipnum_same_as_serial(params):
+    agg = SimpleAggregator({'zip': ZipNumIndexSource(get_test_dir() + 'zipcdx/zipnum-sample.idx',
+                                                     dict(max_blocks=100))})
+
+    assert_sharded_same(agg, params)
+
+
+def test_zipnum_more_than_max_blocks_not_sharded():
+    source = ZipNumIndexSource(get_test_dir() + 'zipcdx/zipnum-sample.idx')
+    params = CDXQuery(dict(url='*.iana.org')).params
+
+    assert source.get_split_keys(params, 4) is None
+    assert sharded_query(SimpleAggregator({'zip': source}), CDXQuery(params)) is None
+
+
+def test_split_keys(small_splits):
+    source = FileIndexSource(os.path.join(index_dir, 'many.cdxj'))
+    params = CDXQuery(dict(url='http://example.com/page/*')).params
+
+    split_keys = source.get_split_keys(params, 4)
+    assert len(split_keys) == 3
+    assert split_keys == sorted(split_keys)
+    assert all(key.startswith(b'com,example)/page/') for key in split_keys)
+
+    # range too small to split
+    params = CDXQuery(dict(url='http://example.com/page/000*')).params
+    assert source.get_split_keys(params, 4) == []
+
+
+@pytest.mark.parametrize('params', [
+    dict(url='http://example.com/page/0001'),
+    dict(url='http://example.com/page/*', reverse='1'),
+    dict(url='http://example.com/page/*', closest='20150101000000'),
+    dict(url='http://example.com/page/*', resolveRevisits='true'),
+    dict(url='http://example.com/page/*', showNumPages='true'),
+    dict(url='http://example.com/page/*', page='0'),
+])
+def test_query_not_sharded(small_splits, params):
+    agg = SimpleAggregator({'many': FileIndexSource(os.path.join(index_dir, 'many.cdxj'))})
+    assert sharded_query(agg, CDXQuery(params)) is None
+
+
+def test_remote_source_not_sharded(small_splits):
+    agg = SimpleAggregator({'many': FileIndexSource(os.path.join(index_dir, 'many.cdxj')),
+                            'remote': RemoteIndexSource('http://localhost:1/cdx?url={url}',
+                                                        'http://localhost:1/{timestamp}id_/{url}')})
+
+    params = dict(url='http://example.com/page/*')
+    assert sharded_query(agg, CDXQuery(dict(params))) is None
+
+    params['sources'] = 'many'
+    assert sharded_query(agg, CDXQuery(dict(params))) is not None
+
+
+def test_attach(small_splits):
+    agg = SimpleAggregator({'many': FileIndexSource(os.path.join(index_dir, 'many.cdxj'))})
+    params = dict(url='http://example.com/page/*', filter='!status:201')
+    expected, errs = query(agg, params)
+
+    assert sharded_query.attach(agg)
+    assert agg.sharded_query is sharded_query
+    assert BaseAggregator.sharded_query is None
+
+    with patch.object(ShardedQuery, '_iter_shards', autospec=True,
+                      side_effect=ShardedQuery._iter_shards) as iter_shards:
+        assert query(agg, params) == (expected, errs)
+        assert iter_shards.call_count == 1
+
+
+def test_unpicklable_agg_not_split(small_splits):
+    agg = GeventTimeoutAggregator({'many': FileIndexSource(os.path.join(index_dir, 'many.cdxj'))})
+
+    assert not sharded_query.attach(agg)
+    assert agg.sharded_query is None
+
+    with patch.object(ShardedQuery, 'get_split_keys') as get_split_keys:
+        assert sharded_query(agg, CDXQuery(dict(url='http://example.com/page/*'))) is None
+        assert get_split_keys.call_count == 0
+
+
+def test_mixed_gevent_patching_not_sharded(small_splits):
+    agg = SimpleAggregator({'many': FileIndexSource(os.path.join(index_dir, 'many.cdxj'))})
+
+    process_query = ShardedQuery(2)
+    with patch.object(ShardedQuery, '_is_mixed_gevent_patching', return_value=True):
+        assert process_query(agg, CDXQuery(dict(url='http://example.com/page/*'))) is None
+
+    assert process_query._executor is None
+
+
+def test_not_found_errors(small_splits):
+    agg = SimpleAggregator({'many': FileIndexSource(os.path.join(index_dir, 'many.cdxj')),
+                            'missing': FileIndexSource(os.path.join(index_dir, 'missing.cdxj'))})
+
+    res, errs = sharded_query(agg, CDXQuery(dict(url='http://example.com/page/*')))
+    assert len(list(res)) == 4000
+    assert list(dict(errs).keys()) == ['missing']
+
+
+def test_process_pool():
+    script = """
+from pywb.warcserver.index.sharded import ShardedQuery
+from pywb.warcserver.index.aggregator import DirectoryIndexSource
+from pywb.warcserver.index.indexsource import FileIndexSource
+from pywb.warcserver.index.query import CDXQuery
+
+if __name__ == '__main__':
+    FileIndexSource.SPLIT_MIN_SIZE = 1024
+    sharded_query = ShardedQuery(2)
+    res, errs = sharded_query(DirectoryIndexSource({0!r}), CDXQuery(dict(url='*.example.com', filter='!status:201')))
+    print(len(list(res)))
+    sharded_query.close()
+"""
+
+    agg = DirectoryIndexSource(index_dir)
+    expected, errs = query(agg, dict(url='*.example.com', filter='!status:201'))
+
+    output = subprocess.check_output([sys.executable, '-c', script.format(index_dir)], timeout=120)
+    assert int(output) == len(expected)
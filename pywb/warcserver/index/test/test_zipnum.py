@@ -126,7 +126,9 @@ from pywb import get_test_dir
 from pywb.warcserver.index.test.test_cdxops import cdx_ops_test, cdx_ops_test_data
 from pywb.warcserver.warcserver import init_index_agg
 from pywb.warcserver.index.cdxobject import CDXException
+from pywb.warcserver.index.zipnum import ZipNumIndexSource, SummaryIndex
 
+import gzip
 import shutil
 import tempfile
 import os
@@ -193,6 +195,171 @@ def test_zip_prefix_load():
         shutil.rmtree(tmpdir)
 
 
+def test_zip_block_cache():
+    tmpdir = tempfile.mkdtemp()
+    try:
+        shutil.copy(test_zipnum, tmpdir)
+        shutil.copy(get_test_dir() + 'zipcdx/zipnum-sample.cdx.gz',
+                    os.path.join(tmpdir, 'zipnum'))
+
+        config = dict(type='zipnum',
+                      path=os.path.join(tmpdir, 'zipnum-sample.idx'),
+                      shard_index_loc=dict(match='(.*)', replace=r'\1'))
+
+        server = init_index_agg({'zip': config})
+
+        ZipNumIndexSource.block_cache.clear()
+
+        cdx_iter, err = server(dict(url='iana.org/', matchType='prefix'))
+        results = list(cdx_iter)
+        assert len(results) == 46
+        assert len(ZipNumIndexSource.block_cache) > 0
+
+        hits = ZipNumIndexSource.block_cache.hits
+
+        # remove shard, all blocks now loaded from cache
+        os.remove(os.path.join(tmpdir, 'zipnum'))
+
+        cdx_iter, err = server(dict(url='iana.org/', matchType='prefix'))
+        assert list(cdx_iter) == results
+        assert ZipNumIndexSource.block_cache.hits > hits
+
+    finally:
+        ZipNumIndexSource.block_cache.clear()
+        shutil.rmtree(tmpdir)
+
+def test_zip_block_cache_same_part():
+    def write_index(dirname, filename, mtime):
+        os.makedirs(dirname)
+        line = 'com,example)/ 20140127171200 {"url": "http://example.com/", "filename": "%s"}\n' % filename
+        block = gzip.compress(line.encode('utf-8'), mtime=0)
+
+        with open(os.path.join(dirname, 'cdx-00000.gz'), 'wb') as out:
+            out.write(block)
+
+        with open(os.path.join(dirname, 'index.idx'), 'wb') as idx:
+            idx.write(b'com,example)/ 20140127171200\tcdx-00000\t0\t%d\t1\n' % len(block))
+
+        with open(os.path.join(dirname, 'index.loc'), 'wb') as loc:
+            loc.write(b'cdx-00000\tcdx-00000.gz\n')
+
+        os.utime(os.path.join(dirname, 'index.idx'), (mtime, mtime))
+        return len(block)
+
+    def query(dirname):
+        config = dict(type='zipnum', path=os.path.join(dirname, 'index.idx'))
+        server = init_index_agg({'zip': config})
+        cdx_iter, errs = server(dict(url='http://example.com/'))
+        return [cdx['filename'] for cdx in cdx_iter]
+
+    tmpdir = tempfile.mkdtemp()
+    try:
+        # same part name, offset and block length in both indexes
+        len_a = write_index(os.path.join(tmpdir, 'a'), 'crawl-0001.warc.gz', 1000)
+        len_b = write_index(os.path.join(tmpdir, 'b'), 'crawl-0002.warc.gz', 1000)
+        assert len_a == len_b
+
+        ZipNumIndexSource.block_cache.clear()
+
+        assert query(os.path.join(tmpdir, 'a')) == ['crawl-0001.warc.gz']
+        assert query(os.path.join(tmpdir, 'b')) == ['crawl-0002.warc.gz']
+
+        # rebuild index a in place, cached blocks not reused
+        shutil.rmtree(os.path.join(tmpdir, 'a'))
+        write_index(os.path.join(tmpdir, 'a'), 'crawl-0003.warc.gz', 2000)
+
+        assert query(os.path.join(tmpdir, 'a')) == ['crawl-0003.warc.gz']
+
+    finally:
+        ZipNumIndexSource.block_cache.clear()
+        shutil.rmtree(tmpdir)
+
+@pytest.mark.parametrize('params', [
+    dict(url='iana.org/'),
+    dict(url='http://iana.org/domains/example', matchType='exact'),
+    dict(url='http://iana.org/domains/', matchType='domain', pageSize=4, page=9),
+    dict(url='http://iana.org/domains/', matchType='domain', showPagedIndex=True, pageSize=4, page=1),
+    dict(url='http://iana.org/domains/', matchType='domain', showNumPages=True),
+    dict(url='iana.org/domains/int/blah', pageSize=4, showNumPages=True),
+    dict(url='http://aaa.zz/', matchType='domain', showNumPages=True),
+    dict(url='*.foo.bar', showNumPages=True),
+    dict(url='http://zzz.zz/', matchType='prefix'),
+    dict(url='http://0.zz/', matchType='prefix'),
+])
+def test_zip_summary_in_memory(params):
+    def query(config):
+        server = init_index_agg({'zip': config})
+        cdx_iter, errs = server(dict(params))
+        return [str(cdx) for cdx in cdx_iter]
+
+    config = dict(type='zipnum', path=test_zipnum)
+    expected = query(config)
+
+    config['summary_in_memory'] = True
+    assert query(config) == expected
+    assert test_zipnum in SummaryIndex._cache
+
+def test_zip_prefetch_blocks():
+    def query(config):
+        server = init_index_agg({'zip': config})
+        cdx_iter, errs = server(dict(url='iana.org/', matchType='prefix',
+                                     pageSize=100))
+        return [str(cdx) for cdx in cdx_iter]
+
+    ZipNumIndexSource.block_cache.clear()
+
+    # one block per group, with all blocks on one page
+    config = dict(type='zipnum', path=test_zipnum, max_blocks=1)
+    expected = query(config)
+    assert len(expected) == 184
+
+    ZipNumIndexSource.block_cache.clear()
+
+    config['prefetch_blocks'] = 3
+    assert query(config) == expected
+
+
+def test_zip_raw_query():
+    # zipnum sample is 11-field cdx, not supported
+    server = init_index_agg({'zip': dict(type='zipnum', path=test_zipnum)})
+    assert server.raw_query(dict(url='iana.org/', matchType='prefix', nosource='true')) is None
+
+    tmpdir = tempfile.mkdtemp()
+    try:
+        # create cdxj zipnum, 10 lines per block
+        with open(get_test_dir() + 'cdxj/iana.cdxj', 'rb') as fh:
+            lines = fh.readlines()
+
+        offset = 0
+        with open(os.path.join(tmpdir, 'iana.cdxj.gz'), 'wb') as out, \
+             open(os.path.join(tmpdir, 'iana.idx'), 'wb') as idx:
+            for i in range(0, len(lines), 10):
+                block = gzip.compress(b''.join(lines[i:i + 10]))
+                key = b' '.join(lines[i].split(b' ', 2)[:2])
+                idx.write(b'%s\tiana\t%d\t%d\t%d\n' % (key, offset, len(block), i // 10 + 1))
+                out.write(block)
+                offset += len(block)
+
+        with open(os.path.join(tmpdir, 'iana.loc'), 'wb') as loc:
+            loc.write(b'iana\tiana.cdxj.gz\n')
+
+        config = dict(type='zipnum', path=os.path.join(tmpdir, 'iana.idx'))
+        server = init_index_agg({'zip': config})
+        params = dict(url='iana.org/', matchType='prefix', nosource='true', pageSize='100')
+
+        raw_iter, errs = server.raw_query(dict(params))
+        lines = [line.decode('utf-8') for line in raw_iter]
+
+        cdx_iter, errs = server(dict(params))
+        assert lines == [cdx.to_cdxj() for cdx in cdx_iter]
+        assert len(lines) == 171
+
+        # page count not supported
+        assert server.raw_query(dict(params, showNumPages='true')) is None
+
+    finally:
+        shutil.rmtree(tmpdir)
+
 
 def test_blocks_def_page_size():
     # Pages -- default page size
@@ -3,16 +3,22 @@ import itertools
 import json
 import logging
 import os
+import time
+from array import array
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from io import BytesIO
 
 import six
 from warcio.bufferedreaders import gzip_decompressor
 
 from pywb.utils.binsearch import iter_range, linearsearch, search
+from pywb.utils.cache import LRUCache
 from pywb.utils.io import no_except_close
 from pywb.utils.loaders import BlockLoader, read_last_line
-from pywb.warcserver.index.cdxobject import CDXException, CDXObject, IDXObject
+from pywb.warcserver.index.cdxobject import CDXException, IDXObject, LazyCDXObject
 # from pywb.warcserver.index.cdxsource import CDXSource
+from pywb.warcserver.index.hostfilter import HostBloomFilter
 from pywb.warcserver.index.indexsource import BaseIndexSource
 from pywb.warcserver.index.query import CDXQuery
 
@@ -104,12 +110,126 @@ class LocPrefixResolver(object):
         return [self.prefix + part]
 
 
+# ============================================================================
+class SummaryIndex(object):
+    """ In-memory copy of a ZipNum summary (.idx) file.
+
+    The summary data is kept as a single bytes object, along with an array
+    of the start offset of each line, allowing binary search by key without
+    any file access. Provides the same search(), iter_range() and
+    read_last_line() semantics as the file-based binsearch functions.
+    """
+    _cache = {}
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.stat_sig = self._stat_sig(filename)
+        self.last_check = time.time()
+
+        with open(filename, 'rb') as fh:
+            self.data = fh.read()
+
+        offsets = array('q')
+        find = self.data.find
+        pos = 0
+        size = len(self.data)
+        while pos < size:
+            offsets.append(pos)
+            pos = find(b'\n', pos)
+            if pos < 0:
+                break
+            pos += 1
+
+        offsets.append(size)
+
+        self.offsets = offsets
+        self.num_lines = len(offsets) - 1
+
+    @staticmethod
+    def _stat_sig(filename):
+        stat = os.stat(filename)
+        return (stat.st_ino, stat.st_size, stat.st_mtime_ns)
+
+    @classmethod
+    def load(cls, filename, reload_interval):
+        """ Return the in-memory summary for filename, shared across sources.
+        The file is checked for changes at most every reload_interval
+        seconds, and reloaded only if it has changed.
+        """
+        summary = cls._cache.get(filename)
+        if summary:
+            now = time.time()
+            if now - summary.last_check < reload_interval:
+                return summary
+
+            summary.last_check = now
+            if summary.stat_sig == cls._stat_sig(filename):
+                return summary
+
+        summary = cls(filename)
+        cls._cache[filename] = summary
+        return summary
+
+    def line(self, i):
+        return self.data[self.offsets[i]:self.offsets[i + 1]].rstrip()
+
+    def lower_bound(self, key):
+        """ Return index of first line >= key """
+        lo = 0
+        hi = self.num_lines
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.line(mid) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def iter_lines(self, start):
+        for i in range(start, self.num_lines):
+            yield self.line(i)
+
+    def search(self, key, prev_size=0):
+        i = self.lower_bound(key)
+
+        # no match, return up to prev_size last lines
+        if i == self.num_lines:
+            if not prev_size or self.num_lines <= 1:
+                return iter([])
+
+            start = max(self.num_lines - prev_size, 0)
+            return self.iter_lines(start)
+
+        return self.iter_lines(max(i - prev_size, 0))
+
+    def iter_range(self, start, end, prev_size=0):
+        return itertools.takewhile(lambda line: line < end,
+                                   self.search(start, prev_size=prev_size))
+
+    def read_last_line(self):
+        return self.data[self.offsets[self.num_lines - 1]:]
+
+    def close(self):
+        pass
+
+
 # ============================================================================
 class ZipNumIndexSource(BaseIndexSource):
     DEFAULT_RELOAD_INTERVAL = 10  # in minutes
     DEFAULT_MAX_BLOCKS = 10
+    DEFAULT_BLOCK_CACHE_SIZE = 32 * 1024 * 1024  # in bytes
     IDX_EXT = ('.idx', '.summary')
 
+    # min number of blocks in the key range of each shard of a sharded query
+    SPLIT_MIN_BLOCKS = 4
+
+    # decompressed blocks, keyed by (location, summary signature,
+    # offset, length), shared by all zipnum sources
+    block_cache = LRUCache(DEFAULT_BLOCK_CACHE_SIZE, sizeof=len)
+
+    # thread pools for prefetching block groups, keyed by size
+    _prefetch_executors = {}
+
     def __init__(self, summary, config=None):
         self.max_blocks = self.DEFAULT_MAX_BLOCKS
 
@@ -119,6 +239,8 @@ class ZipNumIndexSource(BaseIndexSource):
         loc = None
         cookie_maker = None
         reload_ival = self.DEFAULT_RELOAD_INTERVAL
+        self.summary_in_memory = False
+        self.prefetch_blocks = 0
 
         if config:
             loc = config.get('shard_index_loc')
@@ -128,6 +250,10 @@ class ZipNumIndexSource(BaseIndexSource):
 
             reload_ival = config.get('reload_interval', reload_ival)
 
+            self.summary_in_memory = config.get('summary_in_memory', False)
+
+            self.prefetch_blocks = int(config.get('prefetch_blocks', 0))
+
         if isinstance(loc, dict):
             self.loc_resolver = LocPrefixResolver(summary, loc)
         else:
@@ -142,11 +268,98 @@ class ZipNumIndexSource(BaseIndexSource):
         self.blk_loader = BlockLoader(cookie_maker=cookie_maker)
 
     def load_index(self, params):
-        self.loc_resolver.load_loc()
+        self._check_reload_loc()
+
         return self._do_load_cdx(self.summary, CDXQuery(params))
 
-    def _do_load_cdx(self, filename, query):
-        reader = open(filename, 'rb')
+    def load_raw_index(self, params):
+        query = CDXQuery(params)
+        if query.page_count or query.secondary_index_only:
+            return None
+
+        self._check_reload_loc()
+
+        return self._iter_raw_cdxj(self._do_load_cdx(self.summary, query, raw=True))
+
+    def may_contain(self, params):
+        return HostBloomFilter.may_contain_file(self.summary, params)
+
+    def get_index_sig(self, params):
+        return self._file_sig(self.summary)
+
+    def get_key_range(self):
+        """ Return the first and last urlkey in the index,
+        or None if the index is empty. The last urlkey is read
+        from the last compressed block.
+        """
+        with open(self.summary, 'rb') as fh:
+            first = fh.readline()
+            if not first.strip():
+                return None
+
+            last = IDXObject(read_last_line(fh))
+
+        blocks = ZipBlocks(last['part'], last['offset'], last['length'], 1)
+
+        last_exc = None
+        for location in self.loc_resolver(blocks.part, None):
+            try:
+                reader = self.blk_loader.load(location, blocks.offset, blocks.length)
+                buff = list(self._iter_decompress_blocks(reader, location, blocks, [blocks.length]))[0]
+                break
+            except Exception as exc:
+                last_exc = exc
+        else:
+            raise last_exc or Exception('No Locations Found for: ' + blocks.part)
+
+        last_line = buff.rstrip().rsplit(b'\n', 1)[-1]
+        return first.split(b' ', 1)[0], last_line.split(b' ', 1)[0]
+
+    def get_split_keys(self, params, num_splits):
+        """ Return up to num_splits - 1 urlkeys of summary lines, evenly
+        spaced within the key range of the query, to split the query into
+        sub-ranges of about the same number of blocks.
+
+        Key ranges of less than SPLIT_MIN_BLOCKS blocks are not split.
+        Returns None if the range is more than max_blocks blocks, as an
+        unpaged query only reads the first max_blocks blocks
+        """
+        if self.summary_in_memory:
+            reader = SummaryIndex.load(self.summary,
+                                       self.reload_interval.total_seconds())
+            idx_iter = reader.iter_range(params['key'], params['end_key'], prev_size=1)
+        else:
+            reader = self.handle_pool.acquire(self.summary)
+            idx_iter = iter_range(reader, params['key'], params['end_key'], prev_size=1)
+
+        try:
+            idx_lines = list(itertools.islice(idx_iter, self.max_blocks + 1))
+        finally:
+            no_except_close(reader)
+
+        if len(idx_lines) > self.max_blocks:
+            return None
+
+        # first line is the block before the key range
+        split_keys = [line.split(b' ', 1)[0] for line in idx_lines[1:]]
+
+        num_splits = min(num_splits, len(idx_lines) // self.SPLIT_MIN_BLOCKS)
+
+        return [split_keys[len(split_keys) * i // num_splits]
+                for i in range(1, num_splits)]
+
+    def _check_reload_loc(self):
+        now = datetime.datetime.now(datetime.timezone.utc)
+        if now - self.loc_update_time >= self.reload_interval:
+            self.loc_update_time = now
+            self.loc_resolver.load_loc()
+
+    def _do_load_cdx(self, filename, query, raw=False):
+        if self.summary_in_memory:
+            reader = SummaryIndex.load(filename,
+                                       self.reload_interval.total_seconds())
+        else:
+            reader = self.handle_pool.acquire(filename)
 
         idx_iter = self.compute_page_range(reader, query)
 
@@ -162,10 +375,13 @@ class ZipNumIndexSource(BaseIndexSource):
 
         blocks = self.idx_to_cdx(idx_iter, query)
 
+        if raw:
+            return itertools.chain.from_iterable(blocks)
+
         def gen_cdx():
             for blk in blocks:
                 for cdx in blk:
-                    yield CDXObject(cdx)
+                    yield LazyCDXObject(cdx)
 
         return gen_cdx()
 
@@ -190,20 +406,28 @@ class ZipNumIndexSource(BaseIndexSource):
 
         last_line = None
 
+        if isinstance(reader, SummaryIndex):
+            search_func = reader.search
+            iter_range_func = reader.iter_range
+            read_last_line_func = reader.read_last_line
+        else:
+            search_func = lambda key, prev_size: search(reader, key, prev_size=prev_size)
+            iter_range_func = lambda start, end, prev_size: iter_range(reader, start, end, prev_size=prev_size)
+            read_last_line_func = lambda: read_last_line(reader)
+
         # Get End
-        end_iter = search(reader, query.end_key, prev_size=1)
+        end_iter = search_func(query.end_key, prev_size=1)
 
         try:
             end_line = six.next(end_iter)
         except StopIteration:
-            last_line = read_last_line(reader)
+            last_line = read_last_line_func()
             end_line = last_line
 
         # Get Start
-        first_iter = iter_range(reader,
-                                query.key,
-                                query.end_key,
-                                prev_size=1)
+        first_iter = iter_range_func(query.key,
+                                     query.end_key,
+                                     prev_size=1)
 
         try:
             first_line = six.next(first_iter)
@@ -278,6 +502,56 @@ class ZipNumIndexSource(BaseIndexSource):
         yield six.next(line_iter)
 
     def idx_to_cdx(self, idx_iter, query):
+        groups = self.iter_block_groups(idx_iter)
+
+        if self.prefetch_blocks > 0:
+            for cdx_iter in self.prefetch_block_groups(groups, query):
+                yield cdx_iter
+
+            return
+
+        for blocks, ranges in groups:
+            yield self.block_to_cdx_iter(blocks, ranges, query)
+
+    def prefetch_block_groups(self, groups, query):
+        """ Load up to prefetch_blocks groups of blocks concurrently, ahead
+        of the group currently being iterated, yielding results in order
+        """
+        executor = self._get_prefetch_executor(self.prefetch_blocks)
+
+        def load_group(blocks, ranges):
+            return list(self.block_to_cdx_iter(blocks, ranges, query))
+
+        pending = deque()
+
+        try:
+            for blocks, ranges in groups:
+                pending.append(executor.submit(load_group, blocks, ranges))
+
+                if len(pending) > self.prefetch_blocks:
+                    yield iter(pending.popleft().result())
+
+            while pending:
+                yield iter(pending.popleft().result())
+
+        finally:
+            for future in pending:
+                future.cancel()
+
+    @classmethod
+    def _get_prefetch_executor(cls, size):
+        executor = cls._prefetch_executors.get(size)
+        if not executor:
+            executor = ThreadPoolExecutor(max_workers=size,
+                                          thread_name_prefix='zipnum-prefetch')
+            cls._prefetch_executors[size] = executor
+
+        return executor
+
+    def iter_block_groups(self, idx_iter):
+        """ Coalesce adjacent blocks in the same part, up to max_blocks,
+        yielding (ZipBlocks, list of block lengths) for each group
+        """
         blocks = None
         ranges = []
 
@@ -294,7 +568,7 @@ class ZipNumIndexSource(BaseIndexSource):
 
             else:
                 if blocks:
-                    yield self.block_to_cdx_iter(blocks, ranges, query)
+                    yield blocks, ranges
 
                 blocks = ZipBlocks(idx['part'],
                                    idx['offset'],
@@ -304,7 +578,7 @@ class ZipNumIndexSource(BaseIndexSource):
                 ranges = [blocks.length]
 
         if blocks:
-            yield self.block_to_cdx_iter(blocks, ranges, query)
+            yield blocks, ranges
 
     def block_to_cdx_iter(self, blocks, ranges, query):
         last_exc = None
@@ -338,23 +612,15 @@ class ZipNumIndexSource(BaseIndexSource):
             msg = 'Loading {b.count} blocks from {loc}:{b.offset}+{b.length}'
             logging.debug(msg.format(b=blocks, loc=location))
 
-        reader = self.blk_loader.load(location, blocks.offset, blocks.length)
-
-        def decompress_block(range_):
-            decomp = gzip_decompressor()
-            buff = decomp.decompress(reader.read(range_))
-            for line in BytesIO(buff):
-                yield line
+        buffs = self._get_cached_blocks(location, blocks, ranges)
 
-        def iter_blocks(reader):
-            try:
-                for r in ranges:
-                    yield decompress_block(r)
-            finally:
-                no_except_close(reader)
+        # not all blocks cached, load from location
+        if buffs is None:
+            reader = self.blk_loader.load(location, blocks.offset, blocks.length)
+            buffs = self._iter_decompress_blocks(reader, location, blocks, ranges)
 
         # iterate over all blocks
-        iter_ = itertools.chain.from_iterable(iter_blocks(reader))
+        iter_ = itertools.chain.from_iterable(BytesIO(buff) for buff in buffs)
 
         # start bound
         iter_ = linearsearch(iter_, query.key)
@@ -363,6 +629,55 @@ class ZipNumIndexSource(BaseIndexSource):
         iter_ = itertools.takewhile(lambda line: line < query.end_key, iter_)
         return iter_
 
+    def _block_cache_prefix(self, location):
+        """ Return the block cache key prefix for blocks read from location.
+        Part names are resolved per index, so blocks are keyed by the resolved
+        location, and by the summary signature, which changes when shards
+        are rebuilt
+        """
+        return (location, self._file_sig(self.summary))
+
+    def _get_cached_blocks(self, location, blocks, ranges):
+        """ Return list of decompressed blocks from the block cache,
+        or None if any of the blocks is not cached
+        """
+        if not self.block_cache.max_size:
+            return None
+
+        prefix = self._block_cache_prefix(location)
+
+        buffs = []
+        offset = blocks.offset
+        for range_ in ranges:
+            buff = self.block_cache.get(prefix + (offset, range_))
+            if buff is None:
+                return None
+
+            buffs.append(buff)
+            offset += range_
+
+        return buffs
+
+    def _iter_decompress_blocks(self, reader, location, blocks, ranges):
+        """ Decompress each block read from reader, adding it to block cache
+        """
+        try:
+            prefix = None
+            if self.block_cache.max_size:
+                prefix = self._block_cache_prefix(location)
+
+            offset = blocks.offset
+            for range_ in ranges:
+                decomp = gzip_decompressor()
+                buff = decomp.decompress(reader.read(range_))
+                if prefix:
+                    self.block_cache.put(prefix + (offset, range_), buff)
+
+                offset += range_
+                yield buff
+        finally:
+            no_except_close(reader)
+
     def __repr__(self):
         return 'ZipNumIndexSource({0}, {1})'.format(self.summary, self.config)
 
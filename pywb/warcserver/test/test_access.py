@@ -1,9 +1,14 @@
 from mock import patch
+from datetime import datetime, timedelta, timezone
 import shutil
+import time
 import os
 
 from pywb.warcserver.index.aggregator import SimpleAggregator
 from pywb.warcserver.access_checker import FileAccessIndexSource, AccessChecker, DirectoryAccessSource
+from pywb.warcserver.access_checker import CompiledAccessRules, AccessRulesSnapshot
+from pywb.warcserver.index.cdxobject import CDXObject
+from pywb.warcserver.index.query import CDXQuery
 
 from pywb.warcserver.test.testutils import to_path, TempDirTests, BaseTestClass
 from pywb import get_test_dir
@@ -140,3 +145,210 @@ class TestAccess(TempDirTests, BaseTestClass):
         edx = access.find_access_rule('https://www.lonesome-rule.org/')
         assert edx['urlkey'] == 'org,lonesome-rule)/###'
         assert edx['access'] == 'allow'
+
+    def test_compiled_same_as_query(self):
+        agg = DirectoryAccessSource(TEST_EXCL_PATH)
+
+        access = AccessChecker(agg, default_access='block')
+
+        urls = ['http://example.com/', 'http://example.bo', 'https://example.com/foo/path',
+                'https://example.net/abc/path/other', 'https://www.iana.org/',
+                'https://www.iana.org/about', 'https://www.iana.org/_css/2013.1/fonts/opensans-semibold.ttf',
+                'https://www.iana.org/exact/match/first/line/aclj/', 'https://www.lonesome-rule.org/',
+                'http://example.com/?example=1', 'http://example.com/?example=3',
+                'http://foo.example.net/abc', 'foo.net']
+
+        for url in urls:
+            for user in (None, 'staff', 'staff2', 'other'):
+                compiled = access.find_access_rule(url, acl_user=user)
+                queried = access.query_access_rule(url, acl_user=user)
+                assert compiled == queried, (url, user)
+
+        # compiled rules don't depend on the lines being sorted
+        edx = access.find_access_rule('http://example.org/?example=1')
+        assert edx['urlkey'] == 'org,example)/?example=1'
+        assert edx['access'] == 'block'
+
+    def test_compiled_rebuild_on_change(self):
+        filename = os.path.join(self.root_dir, 'rebuild.aclj')
+        with open(filename, 'wt') as fh:
+            fh.write('com,example)/ - {"access": "exclude"}\n')
+
+        access = AccessChecker(filename)
+
+        edx = access.find_access_rule('http://example.com/path')
+        assert edx['urlkey'] == 'com,example)/'
+        assert edx['access'] == 'exclude'
+
+        rule_files = access.get_rule_files(access.aggregator)
+        assert rule_files == [filename]
+
+        rules = CompiledAccessRules.load_for_file(filename)
+        assert CompiledAccessRules.load_for_file(filename) is rules
+
+        with open(filename, 'wt') as fh:
+            fh.write('com,example)/path### - {"access": "block"}\n')
+            fh.write('com,example)/ - {"access": "allow"}\n')
+
+        os.utime(filename, ns=(0, 0))
+
+        assert CompiledAccessRules.load_for_file(filename) is not rules
+
+        # not checked for changes again within the check interval
+        assert access.find_access_rule('http://example.com/path')['access'] == 'exclude'
+
+        with patch('pywb.warcserver.access_checker.time.time',
+                   return_value=time.time() + AccessChecker.RULES_CHECK_INTERVAL):
+            edx = access.find_access_rule('http://example.com/path')
+            assert edx['urlkey'] == 'com,example)/path###'
+            assert edx['access'] == 'block'
+
+            edx = access.find_access_rule('http://example.com/other')
+            assert edx['urlkey'] == 'com,example)/'
+            assert edx['access'] == 'allow'
+
+    def test_rule_files_checked_per_interval(self):
+        access = AccessChecker(DirectoryAccessSource(TEST_EXCL_PATH), default_access='block')
+
+        urls = ['http://example.com/', 'https://www.iana.org/', 'https://www.iana.org/about']
+
+        # directory listed once per check
+        agg = access.aggregator
+        with patch.object(agg, '_iter_sources', wraps=agg._iter_sources) as iter_sources:
+            with patch.object(CompiledAccessRules, 'load_for_file',
+                              wraps=CompiledAccessRules.load_for_file) as load_for_file:
+                expected = [access.find_access_rule(url) for url in urls]
+                assert iter_sources.call_count == 1
+                num_files = load_for_file.call_count
+
+                # per collection
+                access.find_access_rule(urls[0], collection='other')
+                assert iter_sources.call_count == 2
+
+                with patch('pywb.warcserver.access_checker.time.time',
+                           return_value=time.time() + AccessChecker.RULES_CHECK_INTERVAL):
+                    assert [access.find_access_rule(url) for url in urls] == expected
+
+                assert iter_sources.call_count == 3
+                assert load_for_file.call_count == num_files * 3
+
+    def test_snapshot_same_as_query(self):
+        snapshot_dir = os.path.join(self.root_dir, 'snapshot')
+        shutil.copytree(TEST_EXCL_PATH, snapshot_dir)
+
+        for name in os.listdir(snapshot_dir):
+            AccessRulesSnapshot.compile(os.path.join(snapshot_dir, name))
+
+        access = AccessChecker(DirectoryAccessSource(snapshot_dir), default_access='block')
+
+        rules = CompiledAccessRules.load_for_file(os.path.join(snapshot_dir, 'pywb.aclj'))
+        assert isinstance(rules, AccessRulesSnapshot)
+
+        urls = ['http://example.com/', 'http://example.bo', 'https://example.com/foo/path',
+                'https://example.net/abc/path/other', 'https://www.iana.org/',
+                'https://www.iana.org/about', 'https://www.iana.org/_css/2013.1/fonts/opensans-semibold.ttf',
+                'https://www.iana.org/exact/match/first/line/aclj/', 'https://www.lonesome-rule.org/',
+                'http://example.com/?example=1', 'http://example.com/?example=3',
+                'http://foo.example.net/abc', 'foo.net']
+
+        for url in urls:
+            for user in (None, 'staff', 'staff2', 'other'):
+                snapshot = access.find_access_rule(url, acl_user=user)
+                queried = access.query_access_rule(url, acl_user=user)
+                assert snapshot == queried, (url, user)
+
+        shutil.rmtree(snapshot_dir)
+
+    def test_snapshot_stale(self):
+        filename = os.path.join(self.root_dir, 'stale.aclj')
+        with open(filename, 'wt') as fh:
+            fh.write('com,example)/ - {"access": "exclude"}\n')
+
+        AccessRulesSnapshot.compile(filename)
+
+        access = AccessChecker(filename, check_interval=0)
+
+        assert isinstance(CompiledAccessRules.load_for_file(filename), AccessRulesSnapshot)
+        assert access.find_access_rule('http://example.com/path')['access'] == 'exclude'
+
+        # list changed after snapshot, snapshot no longer used
+        with open(filename, 'wt') as fh:
+            fh.write('com,example)/ - {"access": "block"}\n')
+
+        os.utime(filename, ns=(0, 0))
+
+        assert isinstance(CompiledAccessRules.load_for_file(filename), CompiledAccessRules)
+        assert access.find_access_rule('http://example.com/path')['access'] == 'block'
+
+        # recompiled snapshot replaces existing one
+        AccessRulesSnapshot.compile(filename)
+
+        assert isinstance(CompiledAccessRules.load_for_file(filename), AccessRulesSnapshot)
+        assert access.find_access_rule('http://example.com/path')['access'] == 'block'
+        assert not [name for name in os.listdir(self.root_dir) if '.tmp.' in name]
+
+    def test_wrap_iter_rule_per_urlkey(self):
+        agg = DirectoryAccessSource(TEST_EXCL_PATH)
+        access = AccessChecker(agg, default_access='block', embargo={'newer': {'years': 1}})
+
+        cdx_list = []
+        for url in ['https://www.iana.org/', 'http://www.iana.org/', 'https://www.iana.org/about']:
+            for timestamp in ['20140126200624', '20140127171238', '99991231000000']:
+                cdx = CDXObject()
+                cdx['urlkey'] = CDXQuery({'url': url}).key.decode('utf-8')
+                cdx['timestamp'] = timestamp
+                cdx['url'] = url
+                cdx_list.append(cdx)
+
+        with patch.object(access, 'find_access_rule', wraps=access.find_access_rule) as find_rule:
+            with patch.object(access, 'get_embargo_cutoff', wraps=access.get_embargo_cutoff) as get_cutoff:
+                res = list(access.wrap_iter(iter(cdx_list), 'staff'))
+
+        assert find_rule.call_count == 2
+        assert get_cutoff.call_count == 1
+
+        assert [(cdx['url'], cdx['timestamp'], cdx['access']) for cdx in res] == [
+            ('https://www.iana.org/', '20140126200624', 'allow'),
+            ('https://www.iana.org/', '20140127171238', 'allow'),
+            ('http://www.iana.org/', '20140126200624', 'allow'),
+            ('http://www.iana.org/', '20140127171238', 'allow'),
+            ('https://www.iana.org/about', '20140126200624', 'allow'),
+            ('https://www.iana.org/about', '20140127171238', 'allow'),
+        ]
+
+    def test_wrap_iter_rule_not_consecutive(self):
+        agg = DirectoryAccessSource(TEST_EXCL_PATH)
+        access = AccessChecker(agg, default_access='block')
+
+        cdx_list = []
+        for url in ['https://www.iana.org/', 'https://www.iana.org/about', 'https://www.iana.org/']:
+            cdx = CDXObject()
+            cdx['urlkey'] = CDXQuery({'url': url}).key.decode('utf-8')
+            cdx['timestamp'] = '20140126200624'
+            cdx['url'] = url
+            cdx_list.append(cdx)
+
+        with patch.object(access, 'find_access_rule', wraps=access.find_access_rule) as find_rule:
+            res = list(access.wrap_iter(iter(cdx_list), 'staff'))
+
+        # only the last rule is kept
+        assert find_rule.call_count == 3
+        assert [cdx['access'] for cdx in res] == ['allow', 'allow', 'allow']
+
+    def test_embargo_cutoff(self):
+        access = AccessChecker([], embargo={'before': '20140127'})
+        assert access.get_embargo_cutoff() == ('exclude', True, datetime(2014, 1, 27, 23, 59, 59, tzinfo=timezone.utc))
+
+        assert access.check_embargo('http://example.com/', '20140126') == 'exclude'
+        assert access.check_embargo('http://example.com/', '20140128') is None
+
+        access = AccessChecker([], embargo={'older': {'days': 1}, 'access': 'block'})
+        access_, before, cutoff = access.get_embargo_cutoff()
+        assert access_ == 'block'
+        assert before == True
+        assert datetime.now(timezone.utc) - cutoff >= timedelta(days=1)
+
+        assert access.check_embargo('http://example.com/', '20140126') == 'block'
+        assert access.check_embargo('http://example.com/', '99990101') is None
+
+        assert AccessChecker([]).get_embargo_cutoff() is None
@@ -18,7 +18,7 @@ from warcio.recordloader import ArcWarcRecordLoader
 from warcio.statusandheaders import StatusAndHeadersParser
 from warcio.bufferedreaders import ChunkedDataReader
 
-from pywb.warcserver.handlers import DefaultResourceHandler, HandlerSeq
+from pywb.warcserver.handlers import DefaultResourceHandler, HandlerSeq, IndexHandler
 
 from pywb.warcserver.index.indexsource import MementoIndexSource, FileIndexSource, LiveIndexSource
 from pywb.warcserver.index.indexsource import RemoteIndexSource
@@ -28,6 +28,7 @@ from pywb.warcserver.index.aggregator import DirectoryIndexSource
 
 from pywb.warcserver.basewarcserver import BaseWarcServer
 from pywb.utils.memento import MementoUtils
+from pywb.utils.wbexception import NotFoundException, BadRequestException
 
 
 sources = {
@@ -109,15 +110,15 @@ class TestBaseWarcServer(HttpBinLiveTests, MementoOverrideTests, FakeRedisTests,
                                        '/urlagnost', '/urlagnost/postreq',
                                        '/invalid', '/invalid/postreq'])
 
-        assert res['/fallback'] == {'modes': ['list_sources', 'index', 'resource']}
+        assert res['/fallback'] == {'modes': ['list_sources', 'index', 'batch', 'resource']}
 
     def test_list_handlers(self):
         resp = self.testapp.get('/many')
-        assert resp.json == {'modes': ['list_sources', 'index', 'resource']}
+        assert resp.json == {'modes': ['list_sources', 'index', 'batch', 'resource']}
         assert 'ResErrors' not in resp.headers
 
         resp = self.testapp.get('/many/other')
-        assert resp.json == {'modes': ['list_sources', 'index', 'resource']}
+        assert resp.json == {'modes': ['list_sources', 'index', 'batch', 'resource']}
         assert 'ResErrors' not in resp.headers
 
     def test_list_errors(self):
@@ -479,6 +480,120 @@ host: www.youtube.com\
 
         assert 'ResErrors' not in resp.headers
 
+    def test_raw_index_output(self):
+        url = '/posttest/index?url=httpbin.org/post&matchType=prefix&nosource=true'
+
+        # raw lines, not loaded as cdx
+        with patch('pywb.warcserver.handlers.IndexHandler._load_index_source', side_effect=Exception):
+            resp = self.testapp.get(url)
+
+        assert resp.headers['Content-Type'] == 'text/x-cdxj'
+
+        with open(TEST_CDX_PATH + 'post-test.cdxj', 'rb') as fh:
+            assert resp.body == fh.read()
+
+        # same as processed output
+        assert resp.body == self.testapp.get(url + '&filter=urlkey:').body
+
+        resp = self.testapp.get(url + '&limit=2')
+        assert len(resp.body.rstrip().split(b'\n')) == 2
+
+    def test_raw_index_output_not_raw(self):
+        url = '/posttest/index?url=httpbin.org/post&matchType=prefix'
+
+        # source field is added
+        resp = self.testapp.get(url)
+        assert b'"source": "post"' in resp.body
+
+    def test_batch_index(self):
+        queries = ['http://www.iana.org/',
+                   'http://example.com/',
+                   '',
+                   'http://not-found.example/',
+                   '{"url": "http://www.iana.org/_css/2013.1/print.css", "limit": "1"}',
+                   'http://iana.org/',
+                   '{"url": "http://www.iana.org/_js/*"}']
+
+        resp = self.testapp.post('/many/batch?sources=local&output=json', '\n'.join(queries))
+        assert resp.headers['Content-Type'] == 'text/x-ndjson'
+
+        res = [json.loads(line) for line in resp.text.rstrip().split('\n')]
+
+        # results in urlkey order
+        keys = [cdx['urlkey'] for cdx in res]
+        assert keys == sorted(keys)
+
+        # results for each query same as single query
+        for i, query in enumerate(queries):
+            if not query:
+                continue
+
+            if query.startswith('{'):
+                url = '/many/index?sources=local&output=json&' + urlencode(json.loads(query))
+            else:
+                url = '/many/index?sources=local&output=json&' + urlencode({'url': query})
+
+            single = self.testapp.get(url, status='*').text.rstrip()
+            single = [json.loads(line) for line in single.split('\n')] if single else []
+
+            batch = [dict(cdx) for cdx in res if cdx['batch'] == str(i)]
+            for cdx in batch:
+                assert cdx.pop('batch') == str(i)
+
+            assert batch == single
+
+            if i == 3:
+                assert batch == []
+            else:
+                assert len(batch) > 0
+
+    def test_batch_index_cdxj_text(self):
+        resp = self.testapp.post('/many/batch?sources=local&nosource=true&limit=1',
+                                 'http://www.iana.org/\nhttp://example.com/')
+
+        lines = resp.text.rstrip().split('\n')
+        assert len(lines) == 2
+        assert lines[0].startswith('com,example)/ ')
+        assert '"batch": "1"' in lines[0]
+        assert lines[1].startswith('org,iana)/ ')
+        assert '"batch": "0"' in lines[1]
+
+        resp = self.testapp.post('/many/batch?sources=local&output=text&fields=batch,urlkey&limit=1',
+                                 'http://www.iana.org/\nhttp://example.com/')
+
+        assert resp.text == '1 com,example)/\n0 org,iana)/\n'
+
+    def test_batch_index_query_error(self):
+        queries = ['http://www.iana.org/',
+                   '{"limit": "1"}',
+                   'http://not-found.example/',
+                   '{"url": "http://example.com/", "limit": "1"}']
+
+        resp = self.testapp.post('/many/batch?sources=local&output=json', '\n'.join(queries))
+        res = [json.loads(line) for line in resp.text.rstrip().split('\n')]
+
+        # failed query, in urlkey order of the query (none)
+        assert res[0] == {'urlkey': '-', 'timestamp': '-', 'batch': '1',
+                          'error': repr(BadRequestException('The "url" param is required'))}
+
+        assert res[1]['batch'] == '3'
+        assert res[1]['urlkey'] == 'com,example)/'
+        assert set(cdx['batch'] for cdx in res[2:]) == set(['0'])
+        assert all('error' not in cdx for cdx in res[1:])
+
+        exc = NotFoundException('No Index')
+        with patch.object(IndexHandler, '_load_fuzzy_index', side_effect=exc):
+            resp = self.testapp.post('/many/batch?sources=local', 'http://example.com/')
+
+        assert resp.text == 'com,example)/ - ' + json.dumps({'batch': '0', 'error': repr(exc)}) + '\n'
+
+    def test_batch_index_errors(self):
+        resp = self.testapp.get('/many/batch?sources=local', status=400)
+        assert resp.json == {'message': 'A POST body with one url or query per line is required'}
+
+        resp = self.testapp.post('/many/batch?sources=local', 'http://example.com/\n{"url": ', status=400)
+        assert resp.json == {'message': 'Invalid query on line 1'}
+
     def test_error_invalid_index_output(self):
         resp = self.testapp.get('/live/index?url=http://httpbin.org/get&output=foobar', status=400)
 
@@ -4,7 +4,8 @@ import os
 
 from pywb.warcserver.index.indexsource import RemoteIndexSource, LiveIndexSource, MementoIndexSource
 from pywb.warcserver.index.indexsource import WBMementoIndexSource, FileIndexSource
-from pywb.warcserver.index.aggregator import BaseSourceListAggregator, DirectoryIndexSource
+from pywb.warcserver.index.aggregator import BaseSourceListAggregator, DirectoryIndexSource, BaseAggregator
+from pywb.warcserver.index.zipnum import ZipNumIndexSource
 from pywb.warcserver.handlers import ResourceHandler, HandlerSeq
 
 
@@ -125,3 +126,42 @@ class TestWarcServer(TempDirTests, BaseTestClass):
         assert len(sources) == 1
         assert isinstance(sources['live'], LiveIndexSource)
 
+    def test_fuzzy_miss_cache_opts(self):
+        loader = WarcServer(config_file=None,
+                            custom_config={'fuzzy_miss_cache_ttl': 60,
+                                           'collections': {'miss': './local/indexes',
+                                                           'no_miss': {'index': './local/indexes',
+                                                                       'fuzzy_miss_cache_ttl': 0}}})
+
+        assert loader.fixed_routes['miss'].fuzzy.miss_ttl == 60
+        assert loader.fixed_routes['no_miss'].fuzzy.miss_cache is None
+
+        # not shared with other configs
+        assert self.loader.fixed_routes['local'].fuzzy.miss_cache is None
+
+    def test_shared_cache_opts_reset(self):
+        WarcServer(config_file=None, custom_config={'zipnum_block_cache_size': 1000})
+        assert ZipNumIndexSource.block_cache.max_size == 1000
+
+        WarcServer(config_file=None, custom_config={})
+        assert ZipNumIndexSource.block_cache.max_size == ZipNumIndexSource.DEFAULT_BLOCK_CACHE_SIZE
+
+    def test_sharded_query_per_config(self):
+        loader = WarcServer(config_file=None,
+                            custom_config={'index_shard_processes': 2,
+                                           'collections': {'shard': './local/indexes',
+                                                           'group': {'index_group': {'local': './local/indexes'}}}})
+
+        try:
+            assert loader.sharded_query.processes == 2
+            assert loader.fixed_routes['shard'].index_source.sharded_query is loader.sharded_query
+
+            # gevent aggregator can not be sharded
+            assert loader.fixed_routes['group'].index_source.sharded_query is None
+
+            # not shared with other configs
+            assert self.loader.fixed_routes['local'].index_source.sharded_query is None
+            assert BaseAggregator.sharded_query is None
+
+        finally:
+            loader.sharded_query.close()
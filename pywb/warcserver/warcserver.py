@@ -10,15 +10,20 @@ from pywb.warcserver.index.aggregator import GeventTimeoutAggregator, SimpleAggr
 
 from pywb.warcserver.handlers import DefaultResourceHandler, HandlerSeq
 
-from pywb.warcserver.index.indexsource import FileIndexSource, RemoteIndexSource
+from pywb.warcserver.index.indexsource import BaseIndexSource, FileIndexSource, RemoteIndexSource
 from pywb.warcserver.index.indexsource import MementoIndexSource, RedisIndexSource
 from pywb.warcserver.index.indexsource import LiveIndexSource, WBMementoIndexSource
 from pywb.warcserver.index.indexsource import XmlQueryIndexSource
 
 from pywb.warcserver.index.zipnum import ZipNumIndexSource
+from pywb.warcserver.index.columnar import ColumnarIndexSource
+from pywb.warcserver.index.querycache import QueryCache
+from pywb.warcserver.index.sharded import ShardedQuery
 
 from pywb.warcserver.access_checker import AccessChecker, CacheDirectoryAccessSource
 
+from pywb.utils.io import FileHandlePool
+
 from pywb import DEFAULT_CONFIG
 
 from six import iteritems, iterkeys, itervalues
@@ -32,6 +37,7 @@ SOURCE_LIST = [LiveIndexSource,
                RedisMultiKeyIndexSource,
                MementoIndexSource,
                CacheDirectoryIndexSource,
+               ColumnarIndexSource,
                FileIndexSource,
                RemoteIndexSource,
                ZipNumIndexSource,
@@ -102,6 +108,13 @@ class WarcServer(BaseWarcServer):
                                                              cert_reqs=certs_config.get('cert_reqs', 'CERT_NONE'),
                                                              ca_cert_dir=certs_config.get('ca_cert_dir'))
 
+        init_shared_caches(self.config)
+
+        self.sharded_query = None
+        if self.config.get('index_shard_processes'):
+            self.sharded_query = ShardedQuery(int(self.config['index_shard_processes']),
+                                              int(self.config.get('index_shards', 0)))
+
         self.auto_handler = None
 
         if self.config.get('enable_auto_colls', True):
@@ -154,9 +167,13 @@ class WarcServer(BaseWarcServer):
         else:
             source = dir_source
 
+        if self.sharded_query:
+            self.sharded_query.attach(source)
+
         return DefaultResourceHandler(source, self.archive_paths,
                                       rules_file=self.rules_file,
-                                      access_checker=access_checker)
+                                      access_checker=access_checker,
+                                      **self.get_fuzzy_miss_opts(self.config))
 
     def list_fixed_routes(self):
         return list(self.fixed_routes.keys())
@@ -241,6 +258,9 @@ class WarcServer(BaseWarcServer):
             timeout = int(coll_config.get('timeout', 0))
             agg = init_index_agg(index_group, True, timeout)
 
+        if self.sharded_query:
+            self.sharded_query.attach(agg)
+
         # ARCHIVE CONFIG
         if not archive_paths:
             archive_paths = self.config.get('archive_paths')
@@ -253,10 +273,21 @@ class WarcServer(BaseWarcServer):
         if acl_paths or embargo:
             access_checker = AccessChecker(acl_paths, default_access, embargo)
 
+        # FUZZY MISS CACHE CONFIG
+        fuzzy_opts = self.get_fuzzy_miss_opts(self.config)
+        if isinstance(coll_config, dict):
+            fuzzy_opts.update(self.get_fuzzy_miss_opts(coll_config))
+
         return DefaultResourceHandler(agg, archive_paths,
                                       rules_file=self.rules_file,
                                       access_checker=access_checker,
-                                      use_local_file_load=use_local_file_load)
+                                      use_local_file_load=use_local_file_load,
+                                      **fuzzy_opts)
+
+    @staticmethod
+    def get_fuzzy_miss_opts(config):
+        return {name: config[name] for name in ('fuzzy_miss_cache_ttl', 'fuzzy_miss_cache_size')
+                if name in config}
 
     def init_sequence(self, coll_name, seq_config):
         if not isinstance(seq_config, list):
@@ -274,6 +305,23 @@ class WarcServer(BaseWarcServer):
 
         return HandlerSeq(handlers)
 
+# ============================================================================
+def init_shared_caches(config):
+    """ Size the index caches and handle pool shared by all index sources
+    in the process from the top-level config, resetting any option not set
+    to its default. These are process-wide: if several WarcServer configs
+    are loaded in one process, the last one loaded applies
+    """
+    BaseIndexSource.handle_pool.max_size = int(config.get('index_handle_pool_size',
+                                                          FileHandlePool.DEFAULT_MAX_SIZE))
+
+    ZipNumIndexSource.block_cache.resize(int(config.get('zipnum_block_cache_size',
+                                                        ZipNumIndexSource.DEFAULT_BLOCK_CACHE_SIZE)))
+
+    QueryCache.local_cache.resize(int(config.get('index_query_cache_size',
+                                                 QueryCache.DEFAULT_CACHE_SIZE)))
+
+
 # ============================================================================
 def init_index_source(value, source_list=None):
     source_list = source_list or SOURCE_LIST
@@ -2,6 +2,7 @@ import os
 
 from .base_config_test import BaseConfigTest, CollsDirMixin, fmod
 from pywb.manager.manager import main as wb_manager
+from pywb.warcserver.access_checker import AccessRulesSnapshot, CompiledAccessRules
 from pytest import raises
 
 
@@ -209,3 +210,30 @@ co,example)/foo - {"access": "exclude", "url": "http://example.co/foo/"}
             wb_manager(['acl', 'importtxt', self.acl_filename, 'foo', 'exclude'])
 
 
+
+    def test_compile_acl(self, capsys):
+        snapshot_filename = self.acl_filename + '.aclb'
+
+        wb_manager(['acl', 'compile', self.acl_filename])
+
+        out, err = capsys.readouterr()
+        assert 'Compiled 5 rules to {0}'.format(snapshot_filename) in out, out
+
+        assert AccessRulesSnapshot.open(snapshot_filename, CompiledAccessRules._stat_sig(self.acl_filename))
+
+        wb_manager(['acl', 'match', self.acl_filename, 'http://example.com/subpath/path'])
+
+        out, err = capsys.readouterr()
+        assert 'com,example)/subpath - {"access": "block", "url": "http://example.com/subpath"}' in out
+
+        # snapshot updated on change
+        wb_manager(['acl', 'add', self.acl_filename, 'http://example.com/subpath/path', 'allow'])
+
+        assert AccessRulesSnapshot.open(snapshot_filename, CompiledAccessRules._stat_sig(self.acl_filename))
+
+        wb_manager(['acl', 'match', self.acl_filename, 'http://example.com/subpath/path'])
+
+        out, err = capsys.readouterr()
+        assert 'com,example)/subpath/path - {"access": "allow", "url": "http://example.com/subpath/path"}' in out
+
+        os.remove(snapshot_filename)